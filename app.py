@@ -1,19 +1,308 @@
-from fastapi import FastAPI
+import os
+import asyncio
+import secrets
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    Literal,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
 from fastapi.responses import StreamingResponse
 from fastapi.responses import HTMLResponse
-from utils import fetch_sample_database
+from fastapi.responses import JSONResponse
+from fastapi.responses import Response
+from utils import database, fetch_sample_database
 from table import Table, OperationsType
-from pydantic import NonNegativeInt
+from table import disk_pool, materializer, page_cache, table_store
+from table import slow_queries_table
+from pool import PoolTimeout
+from pydantic import NonNegativeInt, PositiveInt
 from fastapi.exceptions import HTTPException
-from view import html_page
+from view import html_page, page_arrow, page_columns
+from view import api_rows_kind, page_kind
+from cancel import CancelScope, current_scope
+from governor import governor
+from metrics import (
+    RequestTimings,
+    current_operation,
+    gauges,
+    request_timings,
+    span,
+    span_seconds,
+)
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from http_cache import cache_control, dataset_version, etag, is_not_modified
+from ingest import IngestFormat, ingester
 
 # create a flask application
 app = FastAPI()
+
+# adds the time spent per stage to responses, see `ServerTimingMiddleware`
+_SERVER_TIMING = os.environ.get("VOW_SERVER_TIMING") == "1"
+
+
+class ServerTimingMiddleware:
+    """
+    Collects the spans of each request, and with VOW_SERVER_TIMING=1 (or
+    a `server-timing` request header) reports them in a Server-Timing
+    response header, which browsers show in their dev tools
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        requested = any(k == b"server-timing" for k, _ in scope["headers"])
+
+        async def send_with_timings(message: Message):
+            if message["type"] == "http.response.start" and (
+                _SERVER_TIMING or requested
+            ):
+                header = timings.header()
+                if header:
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing", header
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            request_timings.reset(token)
+
+
+app.add_middleware(ServerTimingMiddleware)
 # set the template directory
 
-fetch_sample_database()
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout(request: Request, exc: PoolTimeout):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please try again"},
+        headers={"Retry-After": "5"},
+    )
+
+
+# with lazy startup the app serves requests (e.g. health checks) right
+# away and fetches the database in the background. Until it's there,
+# tables on disk are unavailable
+_LAZY_STARTUP = os.environ.get("VOW_LAZY_STARTUP") == "1"
+if _LAZY_STARTUP:
+    database.start()
+else:
+    fetch_sample_database()
+
+# set once the database is there, see `current_dataset_version`
+DATASET_VERSION: Optional[str] = None
+
+
+def _query_executor(name: str, workers: str) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=int(workers), thread_name_prefix=f"vow-{name}"
+    )
+
+
+# requests wait here for a thread to run their queries on, instead of
+# tying up the threadpool the rest of the app (e.g. static files) runs on.
+# Page views have threads of their own, so that operations which scan a
+# whole table, or downloads, can't hold all of them
+page_executor = _query_executor(
+    "page", os.environ.get("VOW_PAGE_WORKERS", "4")
+)
+query_executor = _query_executor(
+    "query", os.environ.get("VOW_QUERY_WORKERS", "4")
+)
+download_executor = _query_executor(
+    "download", os.environ.get("VOW_DOWNLOAD_WORKERS", "4")
+)
+
+
+def executor_for(kind: str) -> ThreadPoolExecutor:
+    if kind == "page":
+        return page_executor
+    if kind == "download":
+        return download_executor
+    return query_executor
+
+
+T = TypeVar("T")
+
+
+def _scoped_context(scope: CancelScope, kind: str) -> contextvars.Context:
+    ctx = contextvars.copy_context()
+    ctx.run(current_scope.set, scope)
+    ctx.run(current_operation.set, kind)
+    return ctx
+
+
+async def _cancel_on_disconnect(request: Request, scope: CancelScope):
+    while not await request.is_disconnected():
+        await asyncio.sleep(0.1)
+    scope.cancel()
+
+
+async def run_query(
+    request: Request, kind: str, fn: Callable[..., T], *args
+) -> T:
+    """
+    Runs `fn` on the executor for `kind`, cancelling the queries it runs if
+    the client disconnects or the timeout for `kind` is up before it's done
+
+    DuckDB 0.7 can't interrupt a query, so one that is already running
+    finishes, and only the queries after it are cancelled. Until it does,
+    it counts towards the operations of `kind` the governor lets run
+    """
+    timeout = governor.timeout(kind)
+    scope = CancelScope(timeout=timeout)
+    governor.start(kind)
+    try:
+        running = executor_for(kind).submit(
+            _scoped_context(scope, kind).run, fn, *args
+        )
+    except BaseException:
+        governor.finish(kind)
+        raise
+    running.add_done_callback(lambda _: governor.finish(kind))
+    watcher = asyncio.create_task(_cancel_on_disconnect(request, scope))
+    result = asyncio.wrap_future(running)
+    try:
+        return await asyncio.wait_for(result, timeout)
+    except asyncio.TimeoutError:
+        scope.expire()
+        scope.check()
+        raise
+    except asyncio.CancelledError:
+        scope.cancel()
+        raise
+    finally:
+        watcher.cancel()
+
+
+async def stream_query(chunks: Iterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Iterates over `chunks` on the download executor. The first chunk is
+    read before the response starts, so that a busy server answers with
+    an error status instead of a cut off download. The stream is cancelled
+    (and `chunks` closed) if the client disconnects
+    """
+    scope = CancelScope(timeout=governor.timeout("download"))
+    ctx = _scoped_context(scope, "download")
+    pending: Optional[Future] = None
+
+    async def read() -> Optional[bytes]:
+        nonlocal pending
+        pending = download_executor.submit(ctx.run, next, chunks, None)
+        return await asyncio.wrap_future(pending)
+
+    def close():
+        scope.cancel()
+        # the generator can only be closed once it isn't running
+        if pending is None or pending.done():
+            chunks.close()
+        else:
+            pending.add_done_callback(lambda _: chunks.close())
+
+    try:
+        first = await read()
+    except BaseException:
+        close()
+        raise
+
+    async def rest() -> AsyncIterator[bytes]:
+        try:
+            chunk = first
+            while chunk is not None:
+                yield chunk
+                chunk = await read()
+        finally:
+            close()
+
+    return rest()
+
+
+def load_table(uid: str) -> Table:
+    try:
+        table = Table.load(uid)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Table not found")
+    if table.dbtype == "disk" and not database.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="The datasets are still being loaded, try again shortly",
+            headers={"Retry-After": "5"},
+        )
+    return table
+
+
+@app.get("/healthz")
+def liveness():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readiness():
+    status = database.status()
+    return JSONResponse(
+        content={"ready": database.ready, "database": status},
+        status_code=200 if database.ready else 503,
+    )
+
+
+def current_dataset_version() -> str:
+    global DATASET_VERSION
+    if DATASET_VERSION is not None:
+        return DATASET_VERSION
+    version = dataset_version(database.path)
+    if database.ready:
+        DATASET_VERSION = version
+    return version
+
+
+def cache_headers(uid: str, table: Table, *parts: object) -> Dict[str, str]:
+    return {
+        "ETag": etag(current_dataset_version(), table, *parts),
+        "Cache-Control": cache_control(uid, table),
+    }
+
+
+def _load_with_headers(
+    uid: str, *parts: object
+) -> Tuple[Table, Dict[str, str]]:
+    """
+    Loads a table, which may have to query (e.g. re-creating a table from
+    its recipe), along with the cache headers of a response made from it
+    """
+    table = load_table(uid)
+    return table, cache_headers(uid, table, *parts)
+
+
+def not_modified(
+    request: Request, headers: Dict[str, str]
+) -> Optional[Response]:
+    """
+    A 304 if the client already has the response, so that nothing needs
+    to be queried or rendered
+    """
+    if is_not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return None
 
 
 @app.get("/")
@@ -23,31 +312,150 @@ def index():
 
 
 # passing uid in the body might be semantically more sensible
+def _run_op(uid: str, operation: OperationsType) -> Table:
+    table = load_table(uid)
+    with span("run_op", table):
+        return table.run_op(operation)
+
+
 @app.post("/tables/{uid}")
-def post_view(
+async def post_view(
+    request: Request,
     uid: str,
     operation: OperationsType,
 ):
-    prev_table = Table.load(uid)
-
-    new_table = prev_table.run_op(operation)
+    new_table = await run_query(
+        request, operation.operation_type, _run_op, uid, operation
+    )
 
     return {"new_table": new_table.name or new_table.uid, "yolo": "Success"}
 
 
+def _render_page(table: Table, page: int, after: Optional[str]) -> str:
+    return html_page(table, page=page, after=after)
+
+
 @app.get("/tables/{uid}")
-def table_by_uid(uid: str, page: NonNegativeInt = 0):
+async def table_by_uid(
+    request: Request,
+    uid: str,
+    page: NonNegativeInt = 0,
+    after: Optional[str] = None,
+):
+    table, headers = await run_query(
+        request, "page", _load_with_headers, uid, "html", page, after
+    )
+    response = not_modified(request, headers)
+    if response is not None:
+        return response
 
-    try:
-        table = Table.load(uid)
-    except KeyError:
-        raise HTTPException(status_code=404, detail="Table not found")
+    # the first read of a table an operation derived runs its queries
+    kind = page_kind(table, page, after)
+    content = await run_query(request, kind, _render_page, table, page, after)
+    return HTMLResponse(content=content, status_code=200, headers=headers)
+
+
+@app.get("/tables/{uid}/rows")
+async def table_rows(
+    request: Request,
+    uid: str,
+    offset: NonNegativeInt = 0,
+    limit: PositiveInt = 100,
+    format: Literal["json", "arrow"] = "json",
+    after: Optional[str] = None,
+):
+    table, headers = await run_query(
+        request, "page", _load_with_headers, uid, format, offset, limit, after
+    )
+    response = not_modified(request, headers)
+    if response is not None:
+        return response
+
+    kind = api_rows_kind(table, offset, limit, after)
+    if format == "arrow":
+        content = await run_query(
+            request, kind, page_arrow, table, offset, limit, after
+        )
+        return Response(
+            content=content,
+            media_type="application/vnd.apache.arrow.stream",
+            headers=headers,
+        )
+    columns = await run_query(
+        request, kind, page_columns, table, offset, limit, after
+    )
+    return JSONResponse(content=columns, headers=headers)
+
+
+@app.get("/metrics")
+def metrics():
+    lines = span_seconds.render()
+    lines += gauges(
+        "vow_page_cache", "Page cache statistics", page_cache.stats()
+    )
+    lines += gauges(
+        "vow_table_store", "Table store statistics", table_store.stats()
+    )
+    lines += gauges(
+        "vow_materialized", "Materialized tables", materializer.stats()
+    )
+    lines += gauges(
+        "vow_disk_pool", "Connection pool statistics", disk_pool.stats()
+    )
+    lines += gauges(
+        "vow_running", "Operations running, by kind", governor.stats()
+    )
+    return Response(
+        content="\n".join(lines) + "\n",
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@app.get("/slow_queries")
+def slow_queries():
+    table = slow_queries_table()
+    return RedirectResponse(url=f"/tables/{table.uid}")
+
+
+# uploads are only accepted with this token, and not at all without one
+_INGEST_TOKEN = os.environ.get("VOW_INGEST_TOKEN", "")
 
-    return HTMLResponse(
-        content=html_page(table, page=page),
-        status_code=200,
-        headers={"Cache-Control": "max-age=5000"},
+
+def _check_ingest_token(request: Request):
+    if not _INGEST_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    token = request.headers.get("authorization", "").removeprefix("Bearer ")
+    if not secrets.compare_digest(token, _INGEST_TOKEN):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+@app.post("/ingest", status_code=202)
+async def ingest(
+    request: Request,
+    name: str,
+    format: IngestFormat = "csv",
+    details: str = "",
+):
+    """
+    Adds the file in the request body to the datasets. It's loaded in
+    the background, GET the returned status url for its progress
+    """
+    _check_ingest_token(request)
+    content_length = request.headers.get("content-length")
+    job = ingester.create(
+        name,
+        format,
+        details,
+        total_bytes=None if content_length is None else int(content_length),
     )
+    await ingester.receive(job, request.stream())
+    return {"job": job.id, "status": f"/ingest/{job.id}"}
+
+
+@app.get("/ingest/{job_id}")
+def ingest_status(request: Request, job_id: str):
+    _check_ingest_token(request)
+    return ingester.get(job_id).status()
 
 
 @app.get("/about", response_class=HTMLResponse)
@@ -55,23 +463,37 @@ def about():
     return RedirectResponse(url=f"/tables/about")
 
 
+_download_formats = {
+    # file_type: (media type, file extension)
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
 @app.get("/downloads/{uid}")
-def download_table(uid: str, file_type: str = "csv"):
-    if file_type != "csv":
+async def download_table(request: Request, uid: str, file_type: str = "csv"):
+    if file_type not in _download_formats:
         raise HTTPException(status_code=404, detail="File type not supported")
+    media_type, extension = _download_formats[file_type]
 
-    try:
-        table = Table.load(uid)
-    except KeyError:
-        raise HTTPException(status_code=404, detail="Table not found")
+    table, headers = await run_query(
+        request, "page", _load_with_headers, uid, "download", file_type
+    )
+    response = not_modified(request, headers)
+    if response is not None:
+        return response
 
     filename_without_ext = "_".join([str(s) for s in table.lineage])
-    filename = (filename_without_ext or "download") or ".csv"
+    filename = f"{filename_without_ext or 'download'}.{extension}"
 
     return StreamingResponse(
-        table.iter_csv(),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={filename}"},
+        await stream_query(table.iter_file(file_type)),
+        media_type=media_type,
+        headers={
+            **headers,
+            "Content-Disposition": f"attachment; filename={filename}",
+        },
     )
 
 
@@ -0,0 +1,83 @@
+"""
+Page latency and SQL size of tables built by long chains of operations,
+with and without flattening the views
+
+Run from the repository root:
+    python -m benchmarks.bench_chain_depth --rows 1000000 --depth 32
+"""
+import time
+import argparse
+from pypika import Query
+import table as table_module
+from table import Table, get_in_memory_conn, page_cache
+
+
+def create_table(num_rows: int) -> Table:
+    conn = get_in_memory_conn()
+    conn.execute(
+        """
+        CREATE OR REPLACE TABLE bench_chain AS
+        SELECT
+            range AS id,
+            'name_' || (range % 1000) AS name,
+            random() * 1000 AS amount,
+            range % 7 AS grp
+        FROM range(?)
+        """,
+        [num_rows],
+    )
+    return Table(
+        view=Query.from_("bench_chain").select("*"),
+        source=None,
+        name="bench_chain",
+        dbtype="memory",
+    )
+
+
+def step(table: Table, depth: int) -> Table:
+    """
+    Alternates between the operations a user clicks through: searching,
+    sorting and filtering
+    """
+    match depth % 3:
+        case 0:
+            return table.filter_regex("name", f"{depth % 10}", None)
+        case 1:
+            return table.sort("amount" if depth % 2 else "id", depth % 2 == 0)
+        case _:
+            return table.filter_except(
+                [("grp", str(g)) for g in range(6)], None
+            )
+
+
+def measure(base: Table, max_depth: int, flatten: bool, repeat: int):
+    table_module._FLATTEN_QUERIES = flatten
+    table = base
+    print(f"flatten={flatten}")
+    print(f"{'depth':>6} {'sql bytes':>10} {'first page ms':>14}")
+    for depth in range(1, max_depth + 1):
+        table = step(table, depth)
+        sql = table.view.get_sql()
+        timings = []
+        for _ in range(repeat):
+            page_cache.pop((table.query_key, 0, 300))
+            start = time.perf_counter()
+            table[0:300]
+            timings.append(time.perf_counter() - start)
+        print(f"{depth:>6} {len(sql):>10} {min(timings) * 1000:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--depth", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    base = create_table(args.rows)
+    for flatten in [False, True]:
+        measure(base, args.depth, flatten, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
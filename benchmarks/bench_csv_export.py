@@ -0,0 +1,92 @@
+"""
+Throughput of /downloads/{uid} exports (CSV, and the columnar formats)
+
+Run from the repository root:
+    python -m benchmarks.bench_csv_export --rows 5000000
+"""
+import io
+import csv
+import time
+import argparse
+from typing import Iterator
+from pypika import Query
+from table import Table, get_in_memory_conn
+
+
+def create_table(num_rows: int) -> Table:
+    conn = get_in_memory_conn()
+    conn.execute(
+        """
+        CREATE OR REPLACE TABLE bench_export AS
+        SELECT
+            range AS id,
+            'name_' || (range % 1000) AS name,
+            random() * 1000 AS amount,
+            range % 7 AS grp,
+            DATE '2020-01-01' + (range % 365)::INT AS d
+        FROM range(?)
+        """,
+        [num_rows],
+    )
+    return Table(
+        view=Query.from_("bench_export").select("*"),
+        source=None,
+        name="bench_export",
+        dbtype="memory",
+    )
+
+
+def row_by_row_csv(table: Table) -> Iterator[bytes]:
+    """
+    Python csv module over fetchmany, roughly the old per-row export
+    """
+    conn = get_in_memory_conn()
+    conn.execute(table.view.get_sql())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([col[0] for col in conn.description])
+    while True:
+        rows = conn.fetchmany(10000)
+        if not rows:
+            break
+        writer.writerows(rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+
+
+def measure(name: str, chunks: Iterator[bytes]):
+    start = time.perf_counter()
+    num_bytes = 0
+    largest_chunk = 0
+    for chunk in chunks:
+        num_bytes += len(chunk)
+        largest_chunk = max(largest_chunk, len(chunk))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:>12}: {num_bytes / 2**20:8.1f} MB in {elapsed:6.2f}s"
+        f" = {num_bytes / 2**20 / elapsed:7.1f} MB/s"
+        f" (largest chunk {largest_chunk / 2**20:.1f} MB)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument(
+        "--skip-baseline",
+        action="store_true",
+        help="don't time the row-by-row python export",
+    )
+    args = parser.parse_args()
+
+    table = create_table(args.rows)
+    print(f"exporting {args.rows} rows")
+    for file_type in ["csv", "parquet", "arrow"]:
+        measure(file_type, table.iter_file(file_type))
+    if not args.skip_baseline:
+        measure("row-by-row", row_by_row_csv(table))
+
+
+if __name__ == "__main__":
+    main()
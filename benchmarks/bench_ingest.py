@@ -0,0 +1,102 @@
+"""
+Throughput of ingesting CSV, Parquet and JSON files with DuckDB's readers,
+next to inserting rows one by one like MemoryTable.from_records does
+
+30M rows make a CSV file of about 2 GB.
+
+Run from the repository root:
+    python -m benchmarks.bench_ingest --rows 30000000 --dir /tmp
+"""
+import os
+import time
+import argparse
+import duckdb
+from ingest import ingest_file
+from table import MemoryTable, in_memory_conn
+
+_FORMAT_OPTIONS = {
+    "csv": "(HEADER)",
+    "parquet": "(FORMAT PARQUET)",
+    "json": "(FORMAT JSON)",
+}
+
+
+def create_file(path: str, file_format: str, num_rows: int):
+    conn = duckdb.connect()
+    conn.execute(
+        f"""
+        COPY (
+            SELECT
+                range AS id,
+                'name_' || (range % 100000) AS name,
+                (range * 2654435761 % 100000) / 100.0 AS amount,
+                range % 7 AS grp,
+                DATE '2020-01-01' + (range % 1461)::INT AS d,
+                'street_' || (range % 1999) || ', apt ' || (range % 53)
+                    AS address
+            FROM range({num_rows})
+        ) TO '{path}' {_FORMAT_OPTIONS[file_format]}
+        """
+    )
+
+
+def measure_file(path: str, file_format: str):
+    num_bytes = os.path.getsize(path)
+    table_name = f"bench_ingest_{file_format}"
+    with in_memory_conn() as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+    start = time.perf_counter()
+    num_rows = ingest_file(path, file_format, table_name)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{file_format:>12}: {num_bytes / 2**20:8.1f} MB in {elapsed:6.2f}s"
+        f" = {num_bytes / 2**20 / elapsed:7.1f} MB/s,"
+        f" {num_rows / elapsed:12,.0f} rows/s"
+    )
+    with in_memory_conn() as conn:
+        conn.execute(f"DROP TABLE {table_name}")
+
+
+def measure_from_records(num_rows: int):
+    rows = [
+        (str(i), f"name_{i % 100000}", str(i % 7), f"street_{i % 1999}")
+        for i in range(num_rows)
+    ]
+    start = time.perf_counter()
+    MemoryTable.from_records(
+        name="bench_from_records",
+        cols=["id", "name", "grp", "address"],
+        rows=rows,
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"{'from_records':>12}: {num_rows} rows in {elapsed:6.2f}s"
+        f" = {num_rows / elapsed:12,.0f} rows/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--dir", default="/tmp")
+    parser.add_argument(
+        "--baseline-rows",
+        type=int,
+        default=100_000,
+        help="rows inserted one by one, 0 to skip",
+    )
+    args = parser.parse_args()
+
+    for file_format in ["csv", "parquet", "json"]:
+        path = os.path.join(args.dir, f"bench_ingest.{file_format}")
+        create_file(path, file_format, args.rows)
+        try:
+            measure_file(path, file_format)
+        finally:
+            os.remove(path)
+    if args.baseline_rows:
+        measure_from_records(args.baseline_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Latency of regex searches with and without the literal prefilter
+
+Run from the repository root:
+    python -m benchmarks.bench_regex_search --rows 5000000
+"""
+import time
+import argparse
+from pypika import Query
+import table as table_module
+from table import Table, get_in_memory_conn
+
+REGEXES = [
+    "street_12[0-9]",
+    "^name_9+ ",
+    r"apt [0-9]+, springfield",
+    "(north|south)field",
+    "(?i)SPRINGFIELD",
+]
+
+
+def create_table(num_rows: int) -> Table:
+    conn = get_in_memory_conn()
+    conn.execute(
+        """
+        CREATE OR REPLACE TABLE bench_regex AS
+        SELECT
+            range AS id,
+            'name_' || (range % 100000) || ' '
+                || (range % 997) || ' street_' || (range % 1999)
+                || ', apt ' || (range % 53) || ', '
+                || list_extract(
+                    ['springfield', 'shelbyville', 'northfield'], range % 3 + 1
+                )
+                AS address
+        FROM range(?)
+        """,
+        [num_rows],
+    )
+    return Table(
+        view=Query.from_("bench_regex").select("*"),
+        source=None,
+        name="bench_regex",
+        dbtype="memory",
+    )
+
+
+def measure(base: Table, regex: str, prefilter: bool, repeat: int) -> float:
+    table_module._REGEX_PREFILTER = prefilter
+    searched = base.filter_regex("address", regex, None)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        searched._count()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    base = create_table(args.rows)
+    print(f"{'regex':>28} {'scan ms':>10} {'prefilter ms':>13}")
+    for regex in REGEXES:
+        scan = measure(base, regex, False, args.repeat)
+        prefiltered = measure(base, regex, True, args.repeat)
+        print(f"{regex:>28} {scan * 1000:>10.1f} {prefiltered * 1000:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
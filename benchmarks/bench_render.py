@@ -0,0 +1,129 @@
+"""
+Time to render the rows of a page with view.html_rows, next to building
+the same markup cell by cell with yattag, as pages used to be rendered
+
+Run from the repository root:
+    python -m benchmarks.bench_render --rows 25 100 1000
+"""
+import time
+import argparse
+import datetime
+from typing import Any, List, Tuple
+from markdown2 import markdown
+from pypika import Query
+from yattag.doc import Doc
+from table import Column, ColType, MarkdownTable, Table
+from view import html_rows
+
+
+def html_cell(
+    s: Table, val: Any, i: int, j: int, is_percent: bool = False
+) -> str:
+    doc, tag, text = Doc().tagtext()
+    is_none = val is None
+    is_float = isinstance(val, float)
+    display_val = str(val)
+    if is_none:
+        display_val = "NaN"
+    elif is_float:
+        display_val = f"{val:.2f}"
+
+    klass = "markdown-cell" if isinstance(s, MarkdownTable) else ""
+
+    with tag(
+        "td",
+        ("x-ref", f"cell-{i}-{j}"),
+        ("x-bind", f"cell({i}, {j})"),
+        ("data-val", str(val) if not is_none else ""),
+        klass=klass,
+    ):
+        doc.add_class("null" if is_none else "")
+        doc.add_class("percentage" if is_percent else "")
+        if is_percent:
+            doc.attr(style=f"background-size: {display_val}% 100%")
+        if isinstance(s, MarkdownTable):
+            doc.asis(markdown(display_val))
+        elif type(val) == float:
+            doc.line("em", display_val)
+        elif type(val) == int:
+            doc.line("span", display_val, klass="int")
+        else:
+            text(display_val)
+
+    return doc.getvalue()
+
+
+def html_rows_doc(s: Table, rows: List[Tuple[Any, ...]]) -> str:
+    doc, tag, text = Doc().tagtext()
+    for i, row in enumerate(rows):
+        with tag(
+            "tr",
+            ("x-bind", f"row({i})"),
+            ("x-ref", f"row-{i}"),
+            style="cursor: pointer",
+        ):
+            for j, column in enumerate(s.columns):
+                is_percent = column.name == "percentage"
+                doc.asis(html_cell(s, row[j], i, j, is_percent=is_percent))
+
+    return doc.getvalue()
+
+
+# one value of each kind a cell is rendered differently for
+VALUES = [
+    None,
+    7,
+    -3.14159,
+    True,
+    'a <b> & "c"',
+    "",
+    datetime.date(2023, 1, 11),
+    [1, None],
+]
+
+
+def generated_rows(num_rows: int, num_cols: int) -> Tuple[Table, List]:
+    """
+    A table with a percentage column and `num_rows` rows cycling through
+    `VALUES`, which isn't backed by a database table
+    """
+    names = [f"col_{j}" for j in range(num_cols - 1)] + ["percentage"]
+    table = Table(
+        view=Query.from_("render_bench").select("*"),
+        source=None,
+        dbtype="memory",
+        schema=[Column(name=name, type=ColType.STRING) for name in names],
+    )
+    rows = [
+        tuple(VALUES[(i + j) % len(VALUES)] for j in range(num_cols))
+        for i in range(num_rows)
+    ]
+    return table, rows
+
+
+def measure(num_rows: int, num_cols: int):
+    table, rows = generated_rows(num_rows, num_cols)
+    start = time.perf_counter()
+    html_rows_doc(table, rows)
+    doc_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    html_rows(table, rows)
+    fast_seconds = time.perf_counter() - start
+    print(
+        f"{num_rows:>6} x {num_cols}: yattag {doc_seconds * 1000:8.1f}ms,"
+        f" html_rows {fast_seconds * 1000:8.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[25, 100, 1000])
+    parser.add_argument("--cols", type=int, default=50)
+    args = parser.parse_args()
+
+    for num_rows in args.rows:
+        measure(num_rows, args.cols)
+
+
+if __name__ == "__main__":
+    main()
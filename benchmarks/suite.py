@@ -0,0 +1,326 @@
+"""
+Timings of everything a visitor does with a table, over generated tables
+of several sizes: each kind of operation, pages at various offsets,
+counting rows, re-creating tables from their recipes, rendering pages and
+exporting CSV
+
+Results are written as JSON so that releases can be compared
+
+Run from the repository root:
+    python -m benchmarks.suite --rows 100000 1000000 --output base.json
+    python -m benchmarks.suite --rows 100000 1000000 --compare base.json
+"""
+import re
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import statistics
+import subprocess
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+import duckdb
+from fastapi import HTTPException
+from pypika import Query
+import table as table_module
+from table import (
+    FacetOperation,
+    FilterOperation,
+    FreqOperation,
+    Materializer,
+    Operation,
+    OperationsType,
+    PivotOperation,
+    RegexSearchOperation,
+    Table,
+    get_in_memory_conn,
+    page_cache,
+    table_store,
+)
+from view import _MAX_NUM_ROWS, html_page
+
+
+@dataclass
+class Result:
+    benchmark: str
+    rows: int
+    # seconds, the first one with cold caches
+    timings: List[float] = field(default_factory=list)
+    error: Optional[str] = None
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    def summary(self) -> Dict[str, Any]:
+        summary = asdict(self)
+        if self.timings:
+            summary["first"] = self.timings[0]
+            summary["min"] = min(self.timings)
+            summary["median"] = statistics.median(self.timings)
+        return summary
+
+
+def create_table(num_rows: int) -> Table:
+    """
+    A table with columns of mixed types: unique ids and names, a city with
+    30 values (few enough to pivot on) and NULLs, a group with 7 values,
+    numbers, booleans and dates
+    Values are derived from the row number, so every run sees the same
+    """
+    name = f"bench_{num_rows}"
+    conn = get_in_memory_conn()
+    conn.execute(
+        f"""
+        CREATE OR REPLACE TABLE {name} AS
+        SELECT
+            range AS id,
+            'name_' || range AS name,
+            CASE WHEN range % 13 = 0 THEN NULL
+                ELSE 'city_' || (range * 7919 % 30) END AS city,
+            range % 7 AS grp,
+            (range * 2654435761 % 100000) / 100.0 AS amount,
+            range % 3 = 0 AS flag,
+            DATE '2020-01-01' + (range % 1461)::INT AS d,
+            'street_' || (range % 1999) || ', apt ' || (range % 53) AS address
+        FROM range(?)
+        """,
+        [num_rows],
+    )
+    return Table(
+        view=Query.from_(name).select("*"),
+        source=None,
+        name=name,
+        dbtype="memory",
+    )
+
+
+def operations() -> Dict[str, OperationsType]:
+    return {
+        "freq": FreqOperation(cols=["city"]),
+        "freq_high_cardinality": FreqOperation(cols=["name"]),
+        "freq_two_cols": FreqOperation(cols=["city", "grp"]),
+        "filter_all": FilterOperation(
+            filters=[("grp", "3"), ("city", "city_7")], criterion="all"
+        ),
+        "filter_any": FilterOperation(
+            filters=[("grp", "3"), ("city", "city_7")], criterion="any"
+        ),
+        "search": RegexSearchOperation(col="address", regex="street_12[0-9],"),
+        "pivot": PivotOperation(
+            key_cols=["grp"],
+            pivot_col="city",
+            agg_col="amount",
+            agg_func="sum",
+        ),
+        "sort_asc": Operation(operation_type="sa", params="amount"),
+        "sort_desc": Operation(operation_type="sd", params="name"),
+    }
+
+
+def cold_caches() -> None:
+    """
+    Drops cached pages and counts, after waiting for background jobs
+    (prefetches, counts) so that they don't overlap the next run
+    """
+    for future in list(table_module._in_flight.values()):
+        future.result()
+    page_cache.clear()
+    table_store.counts.clear()
+
+
+def measure(
+    name: str,
+    num_rows: int,
+    fn: Callable[[], Any],
+    repeat: int,
+    cold: bool = True,
+) -> Result:
+    result = Result(benchmark=name, rows=num_rows)
+    for _ in range(repeat):
+        if cold:
+            cold_caches()
+        start = time.perf_counter()
+        try:
+            extra = fn()
+        except HTTPException as e:
+            # e.g. the governor refusing an operation on a big table
+            result.error = f"{e.status_code}: {e.detail}"
+            break
+        result.timings.append(time.perf_counter() - start)
+        if isinstance(extra, dict):
+            result.extra = extra
+    return result
+
+
+def first_page(table: Table) -> None:
+    table[0:_MAX_NUM_ROWS]
+
+
+def export_csv(table: Table) -> Dict[str, Any]:
+    return {"bytes": sum(len(chunk) for chunk in table.iter_file("csv"))}
+
+
+def rehydrate(tables: List[Table]) -> None:
+    for t in tables:
+        table_store.in_memory_db.pop(t.uid)
+    Table.load(tables[-1].uid)
+
+
+def run_scale(num_rows: int, repeat: int, only: Optional[str]):
+    base = create_table(num_rows)
+    len(base)
+    cases: Dict[str, Callable[[], Any]] = {}
+
+    for name, operation in operations().items():
+        cases[f"op:{name}"] = lambda operation=operation: first_page(
+            base.run_op(operation)
+        )
+    freq = base.run_op(FreqOperation(cols=["city"]))
+    facet = FacetOperation(facets=[("city", "city_7"), ("city", "city_9")])
+    cases["op:facet"] = lambda: first_page(freq.run_op(facet))
+
+    sorted_table = base.run_op(operations()["sort_asc"])
+    for label, offset in [
+        ("first", 0),
+        ("1pct", num_rows // 100),
+        ("middle", num_rows // 2),
+        ("last", max(num_rows - _MAX_NUM_ROWS, 0)),
+    ]:
+        for t, kind in [(base, "base"), (sorted_table, "sorted")]:
+            cases[f"page:{kind}:{label}"] = lambda t=t, offset=offset: t[
+                offset : offset + _MAX_NUM_ROWS
+            ]
+
+    filtered = base.run_op(operations()["filter_any"])
+    cases["len:base"] = lambda: len(base)
+    cases["len:filtered"] = lambda: len(filtered)
+
+    chain = [base]
+    for name in ["filter_any", "sort_asc", "search"]:
+        chain.append(chain[-1].run_op(operations()[name]))
+    cases["load:chain"] = lambda: rehydrate(chain)
+
+    cases["export:csv"] = lambda: export_csv(base)
+
+    results = []
+    for name, fn in cases.items():
+        if only and not re.search(only, name):
+            continue
+        result = measure(name, num_rows, fn, repeat)
+        if "bytes" in result.extra and result.timings:
+            result.extra["mb_per_second"] = (
+                result.extra["bytes"] / 2**20 / min(result.timings)
+            )
+        results.append(result)
+        report(result)
+
+    # rendering is timed with the rows already fetched
+    for name, t in [("render:base", base), ("render:freq", freq)]:
+        if only and not re.search(only, name):
+            continue
+        html_page(t, page=0)
+        result = measure(
+            name, num_rows, lambda t=t: html_page(t, page=0), repeat, False
+        )
+        results.append(result)
+        report(result)
+    return results
+
+
+def report(result: Result) -> None:
+    if result.error:
+        print(f"{result.rows:>11} {result.benchmark:<24} {result.error}")
+        return
+    summary = result.summary()
+    print(
+        f"{result.rows:>11} {result.benchmark:<24}"
+        f" first {summary['first'] * 1000:9.1f}ms"
+        f" min {summary['min'] * 1000:9.1f}ms"
+    )
+
+
+def metadata() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "duckdb": duckdb.__version__,
+        "platform": platform.platform(),
+    }
+
+
+def compare(results: List[Dict], baseline: Dict, max_slowdown: float) -> int:
+    """
+    Prints how the min timing of every benchmark changed since `baseline`
+    and returns the number of them that got slower than `max_slowdown`
+    """
+    before = {
+        (r["benchmark"], r["rows"]): r["min"]
+        for r in baseline["results"]
+        if "min" in r
+    }
+    regressions = 0
+    for r in results:
+        old = before.get((r["benchmark"], r["rows"]))
+        if old is None or "min" not in r:
+            continue
+        ratio = r["min"] / old if old else float("inf")
+        flag = ""
+        if ratio > max_slowdown:
+            regressions += 1
+            flag = "  <-- slower"
+        print(f"{r['rows']:>11} {r['benchmark']:<24} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--rows",
+        type=lambda s: int(float(s)),
+        nargs="+",
+        default=[100_000, 1_000_000],
+        help="sizes of the generated tables, e.g. 1e5 1e6 1e7 1e8",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="regex of the benchmarks to run")
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--compare", help="results of an earlier run")
+    parser.add_argument("--max-slowdown", type=float, default=1.25)
+    args = parser.parse_args()
+
+    # pages should come from the views being measured
+    table_module.materializer = Materializer(
+        max_bytes=0, min_hits=sys.maxsize, min_seconds=float("inf")
+    )
+
+    results = []
+    for num_rows in args.rows:
+        results.extend(run_scale(num_rows, args.repeat, args.only))
+
+    output = {
+        "meta": metadata(),
+        "results": [result.summary() for result in results],
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(output["results"], baseline, args.max_slowdown):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
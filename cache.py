@@ -0,0 +1,151 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Literal,
+    Optional,
+    TypeVar,
+)
+
+
+EvictionPolicy = Literal["lru", "lfu"]
+
+V = TypeVar("V")
+
+
+@dataclass
+class _Entry(Generic[V]):
+    value: V
+    size: int
+    hits: int = 0
+    pinned: bool = False
+
+
+class BoundedCache(Generic[V]):
+    """
+    Thread-safe key-value cache that evicts entries once the total size of
+    its values exceeds `max_bytes`
+
+    Sizes are whatever the caller says they are, usually an estimate.
+    Pinned entries count towards the budget but are never evicted.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        policy: EvictionPolicy = "lru",
+        on_evict: Optional[Callable[[Hashable, V], None]] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.on_evict = on_evict
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.num_bytes = 0
+
+        self._entries: "OrderedDict[Hashable, _Entry[V]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.hits += 1
+            self._entries.move_to_end(key)
+            return entry.value
+
+    def put(
+        self, key: Hashable, value: V, size: int, pinned: bool = False
+    ) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.num_bytes -= old.size
+                pinned = pinned or old.pinned
+            self._entries[key] = _Entry(value=value, size=size, pinned=pinned)
+            self.num_bytes += size
+            self._evict()
+
+    def pin(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries[key].pinned = True
+
+    def unpin(self, key: Hashable) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.pinned = False
+            self._evict()
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            self.num_bytes -= entry.size
+            return entry.value
+
+    def clear(self) -> None:
+        """
+        Evicts every entry that isn't pinned
+        """
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if not e.pinned]:
+                entry = self._entries.pop(key)
+                self.num_bytes -= entry.size
+                if self.on_evict is not None:
+                    self.on_evict(key, entry.value)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _victim(self) -> Optional[Hashable]:
+        candidates = (
+            (key, entry)
+            for key, entry in self._entries.items()
+            if not entry.pinned
+        )
+        if self.policy == "lru":
+            # entries are kept in recency order, oldest first
+            return next((key for key, _ in candidates), None)
+        victim = min(candidates, key=lambda kv: kv[1].hits, default=None)
+        return None if victim is None else victim[0]
+
+    def _evict(self) -> None:
+        while self.num_bytes > self.max_bytes:
+            key = self._victim()
+            if key is None:
+                return
+            entry = self._entries.pop(key)
+            self.num_bytes -= entry.size
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(key, entry.value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.num_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,94 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, Set
+from duckdb import DuckDBPyConnection
+from fastapi import HTTPException
+
+
+class CancelScope:
+    """
+    The queries run on behalf of one request, so that they can be stopped
+    once nobody is waiting for their results
+
+    Queries that are running when the scope is cancelled are interrupted
+    where DuckDB supports it (`interrupt` is new in 0.8), otherwise they
+    finish, and whatever would have run after them raises instead
+
+    A scope with a `timeout` stops its queries the same way once it's
+    been running for longer than that
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.cancelled = False
+        self.timed_out = False
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self._conns: Set[DuckDBPyConnection] = set()
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            conns = list(self._conns)
+        for conn in conns:
+            if hasattr(conn, "interrupt"):
+                conn.interrupt()
+
+    def expire(self) -> None:
+        self.timed_out = True
+        self.cancel()
+
+    def check(self) -> None:
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.timed_out = True
+        if self.timed_out:
+            raise HTTPException(
+                status_code=503,
+                detail="This is taking too long, please try again later",
+            )
+        if self.cancelled:
+            raise HTTPException(
+                status_code=499, detail="Client closed request"
+            )
+
+    @contextmanager
+    def running(self, conn: DuckDBPyConnection) -> Iterator[None]:
+        with self._lock:
+            self.check()
+            self._conns.add(conn)
+        try:
+            yield
+        except Exception:
+            # an interrupted query fails, which is down to the cancellation
+            self.check()
+            raise
+        finally:
+            with self._lock:
+                self._conns.discard(conn)
+        self.check()
+
+
+current_scope: ContextVar[Optional[CancelScope]] = ContextVar(
+    "current_scope", default=None
+)
+
+
+@contextmanager
+def cancellable(conn: DuckDBPyConnection) -> Iterator[None]:
+    """
+    Runs the query on `conn` within the cancel scope of the current
+    request, if there is one
+    """
+    scope = current_scope.get()
+    if scope is None:
+        yield
+        return
+    with scope.running(conn):
+        yield
+
+
+def check_cancelled() -> None:
+    scope = current_scope.get()
+    if scope is not None:
+        scope.check()
@@ -0,0 +1,110 @@
+import os
+import threading
+from typing import Dict, Optional
+from fastapi import HTTPException
+
+
+def _parse_limits(value: str) -> Dict[str, float]:
+    """
+    Parses limits by kind of operation, e.g. "f=20,pivot=20"
+    """
+    limits = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        kind, limit = item.split("=")
+        limits[kind.strip()] = float(limit)
+    return limits
+
+
+class QueryGovernor:
+    """
+    Time and size budgets for the kinds of operation a visitor can run
+
+    Kinds are operation types ("f", "pivot", "search", ...), and "page"
+    and "download" for the GET endpoints. Deriving a table runs no query,
+    so the first read of an operation's result counts as that operation
+    rather than as a page. A timeout of 0 means none
+
+    Only `max_running` operations of a kind are let in at once, which
+    includes those whose requests timed out while their queries are still
+    running, so that queries which are too slow don't pile up
+    """
+
+    def __init__(
+        self,
+        timeouts: Dict[str, float],
+        max_rows: Dict[str, float],
+        default_timeout: float,
+        max_running: Optional[Dict[str, float]] = None,
+    ):
+        self.timeouts = timeouts
+        self.max_rows = max_rows
+        self.default_timeout = default_timeout
+        self.max_running = max_running or {}
+        self._running: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def timeout(self, kind: str) -> Optional[float]:
+        timeout = self.timeouts.get(kind, self.default_timeout)
+        return timeout or None
+
+    def allows(self, kind: str, num_rows: int) -> bool:
+        """
+        Whether an operation of `kind` may scan `num_rows` rows
+        """
+        max_rows = self.max_rows.get(kind)
+        return max_rows is None or num_rows <= max_rows
+
+    def admit(self, kind: str, num_rows: int) -> None:
+        if not self.allows(kind, num_rows):
+            raise HTTPException(
+                status_code=400,
+                detail=(
+                    f"This would have to scan {num_rows} rows, more than"
+                    f" the limit of {int(self.max_rows[kind])}."
+                    " Filter the table first"
+                ),
+            )
+
+    def start(self, kind: str) -> None:
+        """
+        Counts an operation of `kind` as running until `finish` is called
+        Raises a 503 if as many as allowed are running (or waiting to)
+        """
+        with self._lock:
+            running = self._running.get(kind, 0)
+            max_running = self.max_running.get(kind)
+            if max_running is not None and running >= max_running:
+                raise HTTPException(
+                    status_code=503,
+                    detail="The server is busy, please try again shortly",
+                    headers={"Retry-After": "5"},
+                )
+            self._running[kind] = running + 1
+
+    def finish(self, kind: str) -> None:
+        with self._lock:
+            self._running[kind] -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Number of operations of each kind that are running
+        """
+        with self._lock:
+            return dict(self._running)
+
+
+governor = QueryGovernor(
+    timeouts=_parse_limits(os.environ.get("VOW_QUERY_TIMEOUTS", "download=0")),
+    max_rows=_parse_limits(
+        os.environ.get(
+            "VOW_QUERY_MAX_ROWS",
+            "f=50000000,pivot=50000000,search=200000000",
+        )
+    ),
+    default_timeout=float(os.environ.get("VOW_QUERY_TIMEOUT", "30")),
+    max_running=_parse_limits(
+        os.environ.get("VOW_QUERY_CONCURRENCY", "page=8,f=4,pivot=4,search=4")
+    ),
+)
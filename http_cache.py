@@ -0,0 +1,73 @@
+import os
+import hashlib
+from typing import Optional
+from fastapi import Request
+from table import Table
+
+# the dataset version and the markup aren't part of the URL, so responses
+# are only reused for a while before they are revalidated with the ETag
+_MAX_AGE = int(os.environ.get("VOW_CACHE_MAX_AGE", "300"))
+CACHEABLE = f"public, max-age={_MAX_AGE}"
+REVALIDATE = "no-cache"
+
+
+def dataset_version(path: str = "vow.db") -> str:
+    """
+    Identifies the contents of the database, so that responses for the
+    same uid are only reused while it's unchanged
+
+    Set VOW_DATASET_VERSION when deploying the same database on several
+    hosts, otherwise the size and modification time of the file are used
+    """
+    version = os.environ.get("VOW_DATASET_VERSION")
+    if version:
+        return version
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return "missing"
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def etag(version: str, table: Table, *parts: object) -> str:
+    """
+    A strong ETag for a response computed from `table` alone, e.g. a page
+    of it. `parts` are whatever else the response depends on
+
+    Responses show an estimate until the row count is known, so whether
+    it's known is part of the tag too. Tables in memory are named after
+    their rows, so the uid of one determines them in every process
+    """
+    num_rows = table._known_len()
+    key = "|".join([version, table.uid, str(num_rows), *map(str, parts)])
+    return '"' + hashlib.md5(key.encode("utf-8")).hexdigest() + '"'
+
+
+def cache_control(key: str, table: Table) -> str:
+    """
+    Derived tables on disk requested by uid only change with the dataset
+    or a deploy: the uid covers the rows as well as everything else their
+    pages show, like the tables they were derived from. A name can be
+    re-bound, and memory tables disappear with the process that created
+    them, so those are always revalidated. So are tables whose row count
+    is still being estimated
+    """
+    if key != table.uid or table.source is None:
+        return REVALIDATE
+    if table.dbtype != "disk" or table._known_len() is None:
+        return REVALIDATE
+    return CACHEABLE
+
+
+def is_not_modified(request: Request, tag: Optional[str]) -> bool:
+    """
+    Whether the client's If-None-Match matches `tag`, which is compared
+    weakly (ignoring W/), as it should be for GET requests
+    """
+    header = request.headers.get("if-none-match")
+    if header is None or tag is None:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [c.strip() for c in header.split(",")]
+    return any(c.removeprefix("W/") == tag for c in candidates)
@@ -0,0 +1,184 @@
+import os
+import re
+import time
+import uuid
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncIterator, Dict, Literal, Optional
+import anyio
+from fastapi import HTTPException
+from table import OpenOperation, in_memory_conn, register_dataset, table_store
+
+IngestFormat = Literal["csv", "parquet", "json"]
+
+# DuckDB's readers infer column types, and read files on all its threads
+_readers: Dict[str, str] = {
+    "csv": "read_csv_auto",
+    "parquet": "read_parquet",
+    "json": "read_json_auto",
+}
+
+_TABLE_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]{0,47}$")
+
+
+def ingest_file(path: str, file_format: IngestFormat, table_name: str) -> int:
+    """
+    Loads a file into a new table of the in-memory database
+    Returns the number of rows
+    """
+    reader = _readers[file_format]
+    with in_memory_conn() as conn:
+        conn.execute(
+            f'CREATE TABLE "{table_name}" AS SELECT * FROM {reader}(?)',
+            [path],
+        )
+        conn.execute(f'SELECT count(*) FROM "{table_name}"')
+        return conn.fetchone()[0]
+
+
+@dataclass
+class IngestJob:
+    id: str
+    name: str
+    file_format: IngestFormat
+    details: str = ""
+    # uploading, loading, done or failed
+    state: str = "uploading"
+    bytes_received: int = 0
+    total_bytes: Optional[int] = None
+    num_rows: Optional[int] = None
+    table_uid: Optional[str] = None
+    error: Optional[str] = None
+    started: float = field(default_factory=time.perf_counter)
+    upload_seconds: Optional[float] = None
+    load_seconds: Optional[float] = None
+
+    @property
+    def table_name(self) -> str:
+        return f"{self.name}_{self.id[:8]}"
+
+    def status(self) -> Dict[str, Any]:
+        status = asdict(self)
+        status.pop("started")
+        if self.total_bytes:
+            status["upload_progress"] = self.bytes_received / self.total_bytes
+        if self.load_seconds:
+            status["load_mb_per_second"] = (
+                self.bytes_received / 2**20 / self.load_seconds
+            )
+        return status
+
+
+class Ingester:
+    """
+    Receives uploaded files and loads them into tables, one at a time,
+    which are then added to the list of datasets
+
+    Uploads are written to `directory` first, since DuckDB's readers need
+    a file. The latest `max_jobs` jobs are kept for their status
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_jobs: int = 100):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_jobs = max_jobs
+        self.jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        # loading uses all of DuckDB's threads already
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="vow-ingest"
+        )
+
+    def create(
+        self,
+        name: str,
+        file_format: IngestFormat,
+        details: str = "",
+        total_bytes: Optional[int] = None,
+    ) -> IngestJob:
+        if table_store.backend is not None:
+            # the file is loaded into the in-memory database of the process
+            # that received it, which other processes can't read from
+            raise HTTPException(
+                status_code=501,
+                detail="Uploads aren't supported with a shared table store",
+            )
+        if not _TABLE_NAME.match(name):
+            raise HTTPException(
+                status_code=400,
+                detail="Names are letters, digits and underscores",
+            )
+        if total_bytes is not None and total_bytes > self.max_bytes:
+            raise HTTPException(status_code=413, detail="File is too big")
+        job = IngestJob(
+            id=uuid.uuid4().hex,
+            name=name,
+            file_format=file_format,
+            details=details,
+            total_bytes=total_bytes,
+        )
+        with self._lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> IngestJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    async def receive(self, job: IngestJob, chunks: AsyncIterator[bytes]):
+        """
+        Writes the uploaded file, then queues it to be loaded
+        """
+        path = os.path.join(
+            self.directory, f"vow-ingest-{job.id}.{job.file_format}"
+        )
+        try:
+            async with await anyio.open_file(path, "wb") as f:
+                async for chunk in chunks:
+                    job.bytes_received += len(chunk)
+                    if job.bytes_received > self.max_bytes:
+                        raise HTTPException(
+                            status_code=413, detail="File is too big"
+                        )
+                    await f.write(chunk)
+        except BaseException as e:
+            job.state = "failed"
+            job.error = repr(e)
+            # the file may not have been created
+            with suppress(FileNotFoundError):
+                os.remove(path)
+            raise
+        job.upload_seconds = time.perf_counter() - job.started
+        job.state = "loading"
+        self._executor.submit(self.load, job, path)
+
+    def load(self, job: IngestJob, path: str) -> None:
+        start = time.perf_counter()
+        try:
+            job.num_rows = ingest_file(path, job.file_format, job.table_name)
+            main = register_dataset(job.table_name, job.name, job.details)
+            # the table as it's opened from the list of datasets
+            table = main.run_op(OpenOperation(rowid=len(main.table_names) - 1))
+            table._store_len(job.num_rows)
+            job.table_uid = table.uid
+            job.state = "done"
+        except Exception as e:
+            job.state = "failed"
+            job.error = repr(e)
+        finally:
+            job.load_seconds = time.perf_counter() - start
+            os.remove(path)
+
+
+ingester = Ingester(
+    directory=os.environ.get("VOW_INGEST_DIR", tempfile.gettempdir()),
+    max_bytes=int(os.environ.get("VOW_INGEST_MAX_MB", "4096")) * 2**20,
+)
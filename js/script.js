@@ -65,7 +65,71 @@ document.addEventListener('alpine:init', () => {
     }
   }))
 
-  Alpine.data('table', (num_rows, num_cols, parent_table_id, wrapped_col_indices) => ({
+  // number of rows fetched at a time while scrolling
+  const ROWS_PER_FETCH = 100
+  // rows are fetched once fewer than this many are left below the viewport
+  const FETCH_AHEAD = 50
+  // number of rows in the DOM at a time, the others are spacers
+  const WINDOW_ROWS = 200
+  // the window moves once the viewport is this close to its edge
+  const WINDOW_MARGIN = 40
+  const ROWS_PER_PAGE = 25
+
+  function escapeHtml(s) {
+    return s.replaceAll('&', '&amp;').replaceAll('<', '&lt;').replaceAll('>', '&gt;')
+  }
+
+  function escapeAttr(s) {
+    return s.replaceAll('&', '&amp;').replaceAll('<', '&lt;').replaceAll('"', '&quot;')
+  }
+
+  function cellHtml(i, j, val, kind, is_percent) {
+    // same markup as view.html_rows
+    // ints too large for a number are sent as strings
+    let display = val === null ? 'NaN' : String(val)
+    let content = escapeHtml(display)
+    if (val !== null && kind == 'float') {
+      display = Number(val).toFixed(2)
+      content = `<em>${escapeHtml(display)}</em>`
+    } else if (val !== null && kind == 'int') {
+      content = `<span class="int">${escapeHtml(display)}</span>`
+    }
+    const data_val = val === null ? '' : escapeAttr(String(val))
+    const classes = [val === null ? 'null' : '', is_percent ? 'percentage' : ''].join(' ').trim()
+    const style = is_percent ? ` style="${escapeAttr(`background-size: ${display}% 100%`)}"` : ''
+    return `<td x-ref="cell-${i}-${j}" x-bind="cell(${i}, ${j})" data-val="${data_val}" class="${classes}"${style}>${content}</td>`
+  }
+
+  function rowsHtml(first_rowidx, body) {
+    // `body` is the columnar json of /tables/{uid}/rows
+    const num_fetched = body.data.length ? body.data[0].length : 0
+    const rows = []
+    for (let r = 0; r < num_fetched; r++) {
+      const i = first_rowidx + r
+      const cells = body.data.map((values, j) => cellHtml(
+        i, j, values[r], body.kinds[j], body.columns[j] == 'percentage'
+      ))
+      rows.push(`<tr x-bind="row(${i})" x-ref="row-${i}" style="cursor: pointer">${cells.join('')}</tr>`)
+    }
+    return rows
+  }
+
+  function spacerRow(num_cols) {
+    const tr = document.createElement('tr')
+    tr.setAttribute('aria-hidden', 'true')
+    tr.innerHTML = `<td colspan="${num_cols}" style="padding: 0; border: 0; height: 0"></td>`
+    return tr
+  }
+
+  // `page` is the page the table was opened at, and `row_offset` the
+  // position of its first row, or null if the page was reached through
+  // the page token of a sorted table. `next_after` is the token of the
+  // rows that follow, null if the table isn't sorted
+  Alpine.data('table', (num_rows, num_cols, parent_table_id, wrapped_col_indices, table_id = null, page = 0, row_offset = 0, has_more = false, next_after = null) => ({
+    // rows are fetched as the table is scrolled, so these grow
+    num_rows: num_rows,
+    has_more: has_more,
+    fetching_rows: false,
     rowidx: 0,
     colidx: 0,
     hidden_cols: new Set(), // contains indices of hidden columns
@@ -73,6 +137,11 @@ document.addEventListener('alpine:init', () => {
     search_input: '',
     // contains indices of columns that are rendered over multiple lines
     col_wrapping: Object.fromEntries([...Array(num_cols).keys()].map(x => [x, wrapped_col_indices.includes(x) ? 'wrap' : 'clip'])),
+    // markup of every row fetched so far. Only the rows from view.start
+    // to view.end are in the DOM, between two spacer rows standing in
+    // for the rest
+    rows_html: [],
+    view: { start: 0, end: 0, top: null, bottom: null, row_height: 30 },
 
     saveStateToStorage(key = window.location.pathname) {
       // localStorage.setItem(window.location.pathname, JSON.stringify({rowidx: this.rowidx, colidx: this.colidx}))
@@ -102,6 +171,20 @@ document.addEventListener('alpine:init', () => {
           this.col_wrapping = state.col_wrapping
         }
       }
+      this.rowidx = Math.max(Math.min(this.rowidx, this.num_rows - 1), 0)
+
+      // runs before alpine initializes the rows, so this is the markup
+      // the server rendered
+      const rows = this.$el.querySelectorAll('tr[x-ref^="row-"]')
+      rows.forEach(tr => this.rows_html.push(tr.outerHTML))
+      this.view.end = rows.length
+      this.view.top = spacerRow(num_cols)
+      this.view.bottom = spacerRow(num_cols)
+      // the rows are the last in the same tbody as the header, whose
+      // ref isn't registered yet
+      const tbody = this.$el.querySelector('tr[x-ref="header"]').parentNode
+      tbody.insertBefore(this.view.top, rows.length ? rows[0] : null)
+      tbody.appendChild(this.view.bottom)
     },
 
     performOp(op, args) {
@@ -124,8 +207,8 @@ document.addEventListener('alpine:init', () => {
       const promise = sendPostRequest(data);
 
       promise.then(response => {
-        // alert the user if response is 400
-        if (response.status == 400) {
+        // alert the user if the operation was refused or timed out
+        if (response.status == 400 || response.status == 503) {
           response.json().then(body => {
             this.loading = false
             alert(body.detail)
@@ -180,6 +263,14 @@ document.addEventListener('alpine:init', () => {
       this.performOp("f", { 'cols': [col_name] });
     },
 
+    performExactFrequencyOp() {
+      // only frequency tables estimated from a sample have an exact version
+      if (document.getElementById('exact-freq') === null) {
+        return
+      }
+      this.performOp("exact", { 'params': '' });
+    },
+
     performFacetOp(key_cols) {
 
       // key_cols is a list of column indices
@@ -219,16 +310,155 @@ document.addEventListener('alpine:init', () => {
     },
 
     update_rowid(delta) {
-      this.rowidx = Math.max(Math.min(this.rowidx + delta, num_rows - 1), 0)
+      this.rowidx = Math.max(Math.min(this.rowidx + delta, this.num_rows - 1), 0)
+      this.showRow(this.rowidx)
+      if (this.rowidx >= this.num_rows - 5) {
+        this.fetchMoreRows()
+      }
     },
     update_colid(delta) {
       this.colidx = Math.max(Math.min(this.colidx + delta, num_cols - 1), 0)
     },
     update_rowid_to_max() {
-      this.rowidx = num_rows - 1;
+      this.rowidx = this.num_rows - 1;
+      this.showRow(this.rowidx)
+    },
+    fetchMoreRows() {
+      if (!this.has_more || this.fetching_rows || table_id === null) {
+        return
+      }
+      let params
+      if (next_after !== null) {
+        params = `after=${encodeURIComponent(next_after)}`
+      } else if (row_offset !== null) {
+        params = `offset=${row_offset + this.num_rows}`
+      } else {
+        this.has_more = false
+        return
+      }
+      this.fetching_rows = true
+      fetch(`/tables/${table_id}/rows?${params}&limit=${ROWS_PER_FETCH}`)
+        .then(response => response.json())
+        .then(body => {
+          const rows = rowsHtml(this.num_rows, body)
+          this.rows_html.push(...rows)
+          this.num_rows += rows.length
+          next_after = body.after
+          this.has_more = rows.length == ROWS_PER_FETCH && (next_after !== null || row_offset !== null)
+          this.updateNextPageLink()
+          // fills the window if it isn't full yet, and grows the
+          // spacer below it otherwise
+          this.renderWindow(this.view.start)
+        })
+        .finally(() => { this.fetching_rows = false })
+    },
+
+    updateNextPageLink() {
+      // so that the next page starts after the rows scrolled through
+      const link = document.getElementById('next-page')
+      if (link === null) {
+        return
+      }
+      if (!this.has_more) {
+        link.removeAttribute('href')
+        return
+      }
+      const next_page = page + Math.ceil(this.num_rows / ROWS_PER_PAGE)
+      let href = `/tables/${table_id}?page=${next_page}`
+      if (next_after !== null) {
+        href += `&after=${encodeURIComponent(next_after)}`
+      }
+      link.setAttribute('href', href)
+    },
+
+    renderWindow(start) {
+      // puts the rows from `start` in the DOM, and only those
+      start = Math.max(Math.min(start, this.num_rows - WINDOW_ROWS), 0)
+      const end = Math.min(start + WINDOW_ROWS, this.num_rows)
+
+      // drops the rows that left the window
+      while (this.view.start < Math.min(start, this.view.end)) {
+        this.view.top.nextElementSibling.remove()
+        this.view.start++
+      }
+      while (this.view.end > Math.max(end, this.view.start)) {
+        this.view.bottom.previousElementSibling.remove()
+        this.view.end--
+      }
+      if (this.view.start == this.view.end) {
+        this.view.start = this.view.end = start
+      }
+      // and adds the ones that entered it
+      if (start < this.view.start) {
+        this.view.top.insertAdjacentHTML('afterend', this.rows_html.slice(start, this.view.start).join(''))
+      }
+      if (end > this.view.end) {
+        this.view.bottom.insertAdjacentHTML('beforebegin', this.rows_html.slice(this.view.end, end).join(''))
+      }
+      this.view.start = start
+      this.view.end = end
+
+      this.resizeSpacers()
+      this.addClassToActiveCol('selected-col')
+      this.addClassToActiveRow('active')
+    },
+
+    resizeSpacers() {
+      // rows are assumed to be as high as the rendered ones on average
+      const num_rendered = this.view.end - this.view.start
+      if (num_rendered > 0) {
+        const top = this.view.top.nextElementSibling.getBoundingClientRect().top
+        const height = this.view.bottom.getBoundingClientRect().top - top
+        if (height > 0) {
+          this.view.row_height = height / num_rendered
+        }
+      }
+      this.view.top.firstChild.style.height = `${this.view.start * this.view.row_height}px`
+      this.view.bottom.firstChild.style.height = `${(this.num_rows - this.view.end) * this.view.row_height}px`
+    },
+
+    showRow(i) {
+      // moves the window so that row `i` is in the middle of it
+      if (i < this.view.start || i >= this.view.end) {
+        this.renderWindow(i - WINDOW_ROWS / 2)
+      }
+    },
+
+    onScroll() {
+      // the top spacer starts where the first row would be
+      const scrolled = -this.view.top.getBoundingClientRect().top
+      const first = Math.max(Math.floor(scrolled / this.view.row_height), 0)
+      const num_visible = Math.ceil(window.innerHeight / this.view.row_height)
+
+      const near_top = this.view.start > 0 && first < this.view.start + WINDOW_MARGIN
+      const near_bottom = this.view.end < this.num_rows && first + num_visible > this.view.end - WINDOW_MARGIN
+      if (near_top || near_bottom) {
+        this.renderWindow(first - Math.floor((WINDOW_ROWS - num_visible) / 2))
+      }
+      if (first + num_visible >= this.num_rows - FETCH_AHEAD) {
+        this.fetchMoreRows()
+      }
     },
+
+    windowRows() {
+      const rows = []
+      for (let tr = this.view.top.nextElementSibling; tr !== this.view.bottom; tr = tr.nextElementSibling) {
+        rows.push(tr)
+      }
+      return rows
+    },
+
+    rowEl(i) {
+      // the row element of row `i`, null if it's outside the window
+      if (i < this.view.start || i >= this.view.end) {
+        return null
+      }
+      return this.view.top.parentNode.rows[this.view.top.sectionRowIndex + 1 + i - this.view.start]
+    },
+
     update_rowid_to_min() {
       this.rowidx = 0;
+      this.showRow(this.rowidx)
     },
     toggle_key(colidx) {
       let index = this.key_cols.indexOf(colidx);
@@ -302,8 +532,9 @@ document.addEventListener('alpine:init', () => {
       const is_near_active_row = (this.rowidx <= i + 3 && this.rowidx >= i - 2)
       const is_near_active_col = this.colidx == j
 
-      if (is_near_active_row && is_near_active_col) {
-        this.$refs[`cell-${i}-${j}`].scrollIntoView({
+      const row_el = this.rowEl(i)
+      if (is_near_active_row && is_near_active_col && row_el !== null) {
+        row_el.cells[j].scrollIntoView({
           block: this.rowidx == 0 ? 'end' : 'nearest',
           inline: 'nearest'
         })
@@ -335,31 +566,33 @@ document.addEventListener('alpine:init', () => {
       }
     },
 
+    // these only touch the rows in the window, `renderWindow` applies
+    // them to the rows that enter it
     removeClassFromColCells(colidx, className) {
-      for (let i = 0; i < num_rows; i++) {
-        this.$refs[`cell-${i}-${colidx}`].classList.remove(className)
+      for (const tr of this.windowRows()) {
+        tr.cells[colidx].classList.remove(className)
       }
     },
 
     addClassToActiveCol(className) {
-      for (let i = 0; i < num_rows; i++) {
-        this.$refs[`cell-${i}-${this.colidx}`].classList.add(className)
+      for (const tr of this.windowRows()) {
+        tr.cells[this.colidx].classList.add(className)
       }
     },
 
     removeClassFromRow(rowidx, className) {
-      this.$refs[`row-${rowidx}`].classList.remove(className)
+      this.rowEl(rowidx)?.classList.remove(className)
     },
 
     addClassToActiveRow(className) {
-      for (let j = 0; j < num_cols; j++) {
-        this.$refs[`row-${this.rowidx}`].classList.add(className)
-      }
+      this.rowEl(this.rowidx)?.classList.add(className)
     },
 
     updateActiveRowOffset() {
-      const activeRow = this.$refs[`row-${this.rowidx}`]
-      this.$store.main.activeRowOffset = window.pageXOffset + activeRow.getBoundingClientRect().top
+      const activeRow = this.rowEl(this.rowidx)
+      if (activeRow !== null) {
+        this.$store.main.activeRowOffset = window.pageXOffset + activeRow.getBoundingClientRect().top
+      }
     },
 
     is_search_match(rowidx) {
@@ -423,6 +656,7 @@ document.addEventListener('alpine:init', () => {
         'N': openNextPage,
         'P': openPrevPage,
         'C': () => { this.performOpenColTableOp() },
+        'E': () => { this.performExactFrequencyOp() },
       }
       const key_map = {
         'g': () => { this.update_rowid_to_min() },
@@ -470,6 +704,9 @@ document.addEventListener('alpine:init', () => {
 
     "@keydown.window"(e) { this.handleKeydown(e) },
 
+    "@scroll.throttle"() { this.onScroll() },
+    "@scroll.window.throttle"() { this.onScroll() },
+
     // state is stored on every keydown event
     // after a delay of 250ms
     "@keydown.window.debounce"() {
@@ -480,6 +717,7 @@ document.addEventListener('alpine:init', () => {
     // all reactive cell updates are done using $watch
     // much more efficient this way
     'x-init'() {
+      this.resizeSpacers()
       this.addClassToActiveCol('selected-col')
       this.addClassToActiveRow('active')
 
@@ -673,6 +911,12 @@ document.addEventListener('alpine:init', () => {
     }
   }));
 
+  Alpine.bind('exact_freq', () => ({
+    'x-on:click.prevent'() {
+      window.dispatchEvent(new KeyboardEvent('keydown', { 'key': 'E', 'shiftKey': true }));
+    }
+  }));
+
   Alpine.bind('freq_hint', () => ({
     'x-show'() {
       const key_cols_selected = Object.keys(this.key_cols).length !== 0
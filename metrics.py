@@ -0,0 +1,181 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# seconds
+_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    return ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+
+
+class Histogram:
+    """
+    A histogram in the Prometheus text format, with one series per
+    combination of label values
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str],
+        buckets: Sequence[float] = _BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values: (count per bucket, sum, count)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total, count = self._series.get(
+                label_values, ([0] * len(self.buckets), 0.0, 0)
+            )
+            if idx < len(counts):
+                counts[idx] += 1
+            self._series[label_values] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = sorted(
+                (k, (list(c), s, n)) for k, (c, s, n) in self._series.items()
+            )
+        for label_values, (counts, total, count) in series:
+            labels = _format_labels(self.labels, label_values)
+            sep = "," if labels else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(
+                    f'{self.name}_bucket{{{labels}{sep}le="{bound}"}}'
+                    f" {cumulative}"
+                )
+            lines.append(
+                f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {count}'
+            )
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def gauges(name: str, documentation: str, values: Dict[str, Any]) -> List[str]:
+    """
+    Gauges named `{name}_{key}` for the numeric values of a stats dict
+    """
+    lines = []
+    for key, value in values.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        lines.append(f"# HELP {name}_{key} {documentation}")
+        lines.append(f"# TYPE {name}_{key} gauge")
+        lines.append(f"{name}_{key} {value}")
+    return lines
+
+
+span_seconds = Histogram(
+    "vow_span_seconds",
+    "Time spent in each stage of serving a table, excluding nested stages",
+    labels=("stage", "operation", "table_class"),
+)
+
+
+class RequestTimings:
+    """
+    Time spent per stage while serving one request, for Server-Timing
+    """
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def header(self) -> str:
+        with self._lock:
+            items = list(self.seconds.items())
+        return ", ".join(
+            f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in items
+        )
+
+
+class _Frame:
+    def __init__(self):
+        self.child_seconds = 0.0
+
+
+# the operation (or kind of request) that spans are attributed to
+current_operation: ContextVar[str] = ContextVar(
+    "current_operation", default=""
+)
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+_current_frame: ContextVar[Optional[_Frame]] = ContextVar(
+    "_current_frame", default=None
+)
+
+
+@contextmanager
+def span(stage: str, obj: Any = None) -> Iterator[None]:
+    """
+    Times a stage, e.g. "count", of work on `obj` (usually a table)
+
+    Stages nest, and each records only its own time: a render that
+    fetches rows records the rendering, and the fetch is a separate span
+    """
+    parent = _current_frame.get()
+    frame = _Frame()
+    token = _current_frame.set(frame)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _current_frame.reset(token)
+        if parent is not None:
+            parent.child_seconds += seconds
+        own_seconds = max(seconds - frame.child_seconds, 0.0)
+        table_class = "" if obj is None else type(obj).__name__
+        span_seconds.observe(
+            own_seconds, stage, current_operation.get(), table_class
+        )
+        timings = request_timings.get()
+        if timings is not None:
+            timings.add(stage, own_seconds)
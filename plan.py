@@ -0,0 +1,260 @@
+import re
+from copy import copy
+from typing import List, Optional, Tuple
+from pypika.queries import QueryBuilder
+from pypika.terms import Field, Star, Term
+
+
+def _is_plain_projection(query: QueryBuilder) -> bool:
+    """
+    Whether the query only selects `*` or columns by name, without
+    renaming or computing anything
+    """
+    return all(
+        isinstance(term, Star)
+        or (isinstance(term, Field) and term.alias is None)
+        for term in query._selects
+    )
+
+
+def _is_simple(query: QueryBuilder) -> bool:
+    """
+    Whether the query is a projection, filter and/or sort of one table
+    """
+    return (
+        len(query._from) == 1
+        and _is_plain_projection(query)
+        and not query._joins
+        and not query._groupbys
+        and not query._havings
+        and not query._distinct
+        and not query._with
+        and not query._prewheres
+        and query._limit is None
+        and query._offset is None
+    )
+
+
+def _inner(query: QueryBuilder) -> Optional[QueryBuilder]:
+    if len(query._from) != 1:
+        return None
+    inner = query._from[0]
+    return inner if isinstance(inner, QueryBuilder) else None
+
+
+def flatten(query: QueryBuilder) -> QueryBuilder:
+    """
+    Folds a filter, sort or projection of a subquery into the subquery
+
+    `SELECT * FROM (SELECT * FROM t WHERE a ORDER BY x) WHERE b ORDER BY y`
+    becomes `SELECT * FROM t WHERE a AND b ORDER BY y`. Every table's view
+    is flattened when it's created, so folding a single level is enough to
+    keep chains of operations from nesting.
+
+    Placeholders keep their order, since the conditions of the subquery
+    come before the ones of the outer query.
+    """
+    inner = _inner(query)
+    if inner is None or not _is_simple(query) or not _is_simple(inner):
+        return query
+
+    projected = not any(isinstance(term, Star) for term in query._selects)
+    if projected and not query._orderbys:
+        # the order of the subquery has to be on a column that's kept,
+        # otherwise the flattened view couldn't be paged by it
+        kept = {term.name for term in query._selects}
+        if any(field.name not in kept for field, _ in inner._orderbys):
+            return query
+
+    flat = copy(inner)
+    flat.alias = None
+
+    # columns of the outer query that refer to the subquery by its alias
+    # now refer to what the subquery selects from
+    source = inner._from[0]
+
+    def rebind(term: Term) -> Term:
+        return term.replace_table(inner, source)
+
+    if query._wheres is not None:
+        wheres = rebind(query._wheres)
+        flat._wheres = (
+            wheres if inner._wheres is None else inner._wheres & wheres
+        )
+
+    # a projection of a projection only keeps the outer columns
+    if projected:
+        flat._selects = [rebind(term) for term in query._selects]
+
+    # sorting again replaces the previous order
+    if query._orderbys:
+        flat._orderbys = [
+            (rebind(field), order) for field, order in query._orderbys
+        ]
+
+    return flat
+
+
+# escapes of a class of characters, or of a position, rather than of a
+# literal character
+_CLASS_ESCAPES = set("dDwWsSbBAz")
+_REPEAT = re.compile(r"\{(\d+)(,\d*)?\}")
+_FLAGS = re.compile(r"-?[msU]*(-[msU]*)?")
+
+
+def _skip_class(regex: str, i: int) -> int:
+    """
+    Index after the character class that starts at `regex[i]`, which may
+    contain POSIX classes like `[:digit:]`
+    """
+    i += 1
+    if regex.startswith("^", i):
+        i += 1
+    if regex.startswith("]", i):
+        i += 1
+    while i < len(regex):
+        if regex[i] == "\\":
+            i += 2
+        elif regex.startswith("[:", i):
+            end = regex.find(":]", i + 2)
+            if end < 0:
+                raise ValueError(regex)
+            i = end + 2
+        elif regex[i] == "]":
+            return i + 1
+        else:
+            i += 1
+    raise ValueError(regex)
+
+
+def _skip_group(regex: str, i: int) -> int:
+    """
+    Index after the group that starts at `regex[i]`
+    """
+    depth = 0
+    while i < len(regex):
+        if regex[i] == "\\":
+            i += 2
+            continue
+        if regex[i] == "[":
+            i = _skip_class(regex, i)
+            continue
+        if regex[i] == "(":
+            depth += 1
+        elif regex[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise ValueError(regex)
+
+
+def _min_repeats(regex: str, i: int) -> Tuple[int, int]:
+    """
+    The least number of times the quantifier at `regex[i]` (if there is
+    one) repeats what comes before it, and the index after the quantifier
+    """
+    if i >= len(regex) or regex[i] not in "*+?{":
+        return 1, i
+    if regex[i] == "{":
+        match = _REPEAT.match(regex, i)
+        if match is None:
+            raise ValueError(regex)
+        min_count, i = int(match.group(1)), match.end()
+    else:
+        min_count, i = (1 if regex[i] == "+" else 0), i + 1
+    # non-greedy
+    if regex.startswith("?", i):
+        i += 1
+    return min_count, i
+
+
+def _group_body(group: str) -> str:
+    """
+    The pattern inside a group, without its name or flags
+    """
+    body = group[1:-1]
+    if not body.startswith("?"):
+        return body
+    if body.startswith(("?P<", "?<")):
+        return body[body.index(">") + 1 :]
+    flags, colon, body = body[1:].partition(":")
+    if not _FLAGS.fullmatch(flags):
+        # e.g. case-insensitive, or syntax RE2 doesn't have
+        raise ValueError(group)
+    # flags without a colon apply to the rest of the enclosing group
+    return body if colon else ""
+
+
+def _literal_runs(regex: str) -> List[str]:
+    """
+    Runs of literal characters that every match of the RE2 `regex`
+    contains. Raises ValueError for syntax it isn't sure about
+    """
+    runs: List[str] = []
+    run = ""
+    i = 0
+    while i < len(regex):
+        char = regex[i]
+        literal: Optional[str] = None
+        group_runs: List[str] = []
+        if char == "|":
+            # a match only needs one side of an alternation
+            return []
+        if char == "(":
+            end = _skip_group(regex, i)
+            group_runs = _literal_runs(_group_body(regex[i:end]))
+        elif char == "[":
+            end = _skip_class(regex, i)
+        elif char == "\\":
+            escaped = regex[i + 1 : i + 2]
+            end = i + 2
+            if escaped in ("p", "P") and regex.startswith("{", end):
+                end = regex.index("}", end) + 1
+            elif escaped in ("p", "P"):
+                end += 1
+            elif escaped and escaped.isascii() and not escaped.isalnum():
+                literal = escaped
+            elif escaped not in _CLASS_ESCAPES:
+                # e.g. \x41, \Q...\E or \n, which could be literals
+                raise ValueError(regex)
+        elif char in ".^$":
+            end = i + 1
+        elif char in "*+?{)":
+            raise ValueError(regex)
+        else:
+            literal, end = char, i + 1
+
+        min_count, i = _min_repeats(regex, end)
+        if literal is not None and i == end:
+            run += literal
+            continue
+        if literal is not None and min_count > 0:
+            # there's at least one, but what follows isn't next to it
+            run += literal
+        if run:
+            runs.append(run)
+            run = ""
+        if min_count > 0:
+            runs.extend(group_runs)
+    if run:
+        runs.append(run)
+    return runs
+
+
+def required_literal(regex: str, min_length: int = 3) -> Optional[str]:
+    """
+    The longest string that every match of `regex` contains, if it is at
+    least `min_length` characters long
+
+    Checking for it with a plain substring search is a lot cheaper than
+    running the regex, so it's used to skip most of the rows first. This
+    errs on the side of returning None: for case-insensitive regexes, and
+    any syntax it doesn't know the RE2 meaning of
+    """
+    try:
+        runs = _literal_runs(regex)
+    except ValueError:
+        return None
+    longest = max(runs, key=len, default="")
+    return longest if len(longest) >= min_length else None
@@ -0,0 +1,221 @@
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, Iterator, List, Optional
+from duckdb import DuckDBPyConnection
+import duckdb
+
+
+class PoolTimeout(Exception):
+    """
+    No cursor became free within the pool's timeout
+    """
+
+
+@dataclass
+class PoolMetrics:
+    checkouts: int = 0
+    waits: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+    timeouts: int = 0
+    replaced: int = 0
+
+
+class ConnectionPool:
+    """
+    A fixed-size pool of cursors on a single read-only DuckDB database
+
+    All cursors share one database instance (and hence one buffer cache).
+    A thread checks out at most one cursor at a time: nested checkouts
+    from the same thread reuse the cursor it already holds
+
+    Up to `max_dedicated` more cursors can be opened outside of the pool
+    for callers that hold one for long, like streamed downloads
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: int = 4,
+        timeout: float = 30.0,
+        max_dedicated: int = 4,
+        health_check_interval: float = 60.0,
+        setup: Optional[Callable[[DuckDBPyConnection], None]] = None,
+    ):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.max_dedicated = max_dedicated
+        self.health_check_interval = health_check_interval
+        self.setup = setup
+        self.metrics = PoolMetrics()
+
+        self._base: Optional[DuckDBPyConnection] = None
+        self._idle: "queue.LifoQueue[DuckDBPyConnection]" = queue.LifoQueue()
+        self._last_checked: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._dedicated = threading.BoundedSemaphore(max_dedicated)
+        self._num_dedicated = 0
+        self._local = threading.local()
+
+    def _open(self) -> None:
+        # the database file may not exist when the module is imported
+        # so the pool is only opened on first checkout
+        with self._lock:
+            if self._base is not None:
+                return
+            self._base = duckdb.connect(self.path, read_only=True)
+            for _ in range(self.size):
+                self._idle.put(self._new_cursor())
+
+    def _new_cursor(self) -> DuckDBPyConnection:
+        assert self._base is not None
+        conn = self._base.cursor()
+        if self.setup is not None:
+            self.setup(conn)
+        self._last_checked[id(conn)] = time.monotonic()
+        return conn
+
+    def _is_healthy(self, conn: DuckDBPyConnection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchall()
+        except Exception:
+            return False
+        return True
+
+    def _checkout(self) -> DuckDBPyConnection:
+        self._open()
+        start = time.monotonic()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self.metrics.timeouts += 1
+                raise PoolTimeout(f"no cursor free after {self.timeout}s")
+            waited = time.monotonic() - start
+            with self._lock:
+                self.metrics.waits += 1
+                self.metrics.wait_seconds += waited
+                self.metrics.max_wait_seconds = max(
+                    self.metrics.max_wait_seconds, waited
+                )
+
+        now = time.monotonic()
+        last_checked = self._last_checked.get(id(conn), 0.0)
+        if now - last_checked > self.health_check_interval:
+            if self._is_healthy(conn):
+                self._last_checked[id(conn)] = now
+            else:
+                conn = self._replace(conn)
+
+        with self._lock:
+            self.metrics.checkouts += 1
+        return conn
+
+    def _replace(self, conn: DuckDBPyConnection) -> DuckDBPyConnection:
+        self._last_checked.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self.metrics.replaced += 1
+        return self._new_cursor()
+
+    def _checkin(self, conn: DuckDBPyConnection, failed: bool) -> None:
+        if failed and not self._is_healthy(conn):
+            conn = self._replace(conn)
+        self._idle.put(conn)
+
+    @contextmanager
+    def lease(self) -> Iterator[DuckDBPyConnection]:
+        """
+        Checks out a cursor without tying it to the current thread
+        """
+        conn = self._checkout()
+        failed = False
+        try:
+            yield conn
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._checkin(conn, failed)
+
+    @contextmanager
+    def connection(self) -> Iterator[DuckDBPyConnection]:
+        held: Optional[DuckDBPyConnection] = getattr(self._local, "conn", None)
+        if held is not None:
+            yield held
+            return
+
+        with self.lease() as conn:
+            self._local.conn = conn
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+
+    @contextmanager
+    def dedicated(self) -> Iterator[DuckDBPyConnection]:
+        """
+        Opens a cursor of its own, which isn't taken from the pool and is
+        closed afterwards. It may be used from any thread
+
+        A streamed download holds its cursor until the client has read
+        it all, which would otherwise starve the pooled queries
+        """
+        self._open()
+        if not self._dedicated.acquire(timeout=self.timeout):
+            with self._lock:
+                self.metrics.timeouts += 1
+            raise PoolTimeout(f"no dedicated cursor after {self.timeout}s")
+        try:
+            with self._lock:
+                self._num_dedicated += 1
+            conn = self._new_cursor()
+            try:
+                yield conn
+            finally:
+                self._last_checked.pop(id(conn), None)
+                conn.close()
+        finally:
+            with self._lock:
+                self._num_dedicated -= 1
+            self._dedicated.release()
+
+    def health_check(self) -> bool:
+        """
+        Checks all idle cursors, replacing the ones that fail
+        """
+        self._open()
+        checked: List[DuckDBPyConnection] = []
+        healthy = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if self._is_healthy(conn):
+                self._last_checked[id(conn)] = time.monotonic()
+            else:
+                healthy = False
+                conn = self._replace(conn)
+            checked.append(conn)
+        for conn in checked:
+            self._idle.put(conn)
+        return healthy
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = asdict(self.metrics)
+        stats["size"] = self.size
+        stats["idle"] = self._idle.qsize()
+        stats["dedicated"] = self._num_dedicated
+        return stats
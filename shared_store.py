@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+from typing import Optional, Protocol
+
+
+class StoreBackend(Protocol):
+    """
+    Storage for what `Store` needs to share between processes: recipes,
+    aliases, row counts and schemas, each a `kind` of key
+    """
+
+    def get(self, kind: str, key: str) -> Optional[bytes]:
+        ...
+
+    def put(self, kind: str, key: str, value: bytes) -> None:
+        ...
+
+    def count(self, kind: str) -> int:
+        ...
+
+
+class SQLiteBackend:
+    """
+    A store backend in a SQLite file, which every process on the host can
+    use at the same time, e.g. the workers of `uvicorn --workers N`
+
+    The file is in WAL mode, so reads don't wait for a write to finish
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " kind TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value BLOB NOT NULL,"
+                " PRIMARY KEY (kind, key)"
+                ") WITHOUT ROWID"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, kind: str, key: str) -> Optional[bytes]:
+        row = (
+            self._conn()
+            .execute(
+                "SELECT value FROM entries WHERE kind = ? AND key = ?",
+                (kind, key),
+            )
+            .fetchone()
+        )
+        return None if row is None else row[0]
+
+    def put(self, kind: str, key: str, value: bytes) -> None:
+        self._conn().execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+            (kind, key, value),
+        )
+
+    def count(self, kind: str) -> int:
+        return (
+            self._conn()
+            .execute("SELECT count(*) FROM entries WHERE kind = ?", (kind,))
+            .fetchone()[0]
+        )
+
+
+def backend_from_url(url: str) -> Optional[StoreBackend]:
+    """
+    The backend for VOW_STORE_URL, e.g. "sqlite:///var/lib/vow/store.db"
+    An empty url means tables are only stored in the process
+    """
+    if not url:
+        return None
+    if url.startswith("sqlite://"):
+        return SQLiteBackend(url.removeprefix("sqlite://"))
+    raise ValueError(f"Unsupported store url {url}")
@@ -0,0 +1,160 @@
+import os
+import json
+import random
+import logging
+import datetime
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+)
+
+# the table whose queries are running, for attributing slow ones to it
+querying_table: ContextVar[Optional[Any]] = ContextVar(
+    "querying_table", default=None
+)
+
+
+@contextmanager
+def querying(table: Any) -> Iterator[None]:
+    token = querying_table.set(table)
+    try:
+        yield
+    finally:
+        querying_table.reset(token)
+
+
+class SlowQueryLog:
+    """
+    Queries that took longer than `threshold` seconds, with the table
+    (and the chain of operations) they were run for
+
+    Entries are appended to a rotating JSON lines file at `path`, and the
+    latest `max_entries` are kept in memory. A `profile_rate` fraction of
+    them are run again with EXPLAIN ANALYZE in the background, and written
+    once that's done
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        threshold: float,
+        profile_rate: float,
+        max_entries: int = 200,
+        max_bytes: int = 10 * 2**20,
+        backups: int = 3,
+    ):
+        self.threshold = threshold
+        self.profile_rate = profile_rate
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=max_entries)
+        # changes whenever an entry is added or profiled
+        self.version = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="vow-slowlog"
+        )
+        self._logger: Optional[logging.Logger] = None
+        if path:
+            self._logger = logging.getLogger(f"vow.slow_queries.{path}")
+            self._logger.propagate = False
+            self._logger.setLevel(logging.INFO)
+            if not self._logger.handlers:
+                handler = RotatingFileHandler(
+                    path, maxBytes=max_bytes, backupCount=backups, delay=True
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self._logger.addHandler(handler)
+
+    def record(
+        self,
+        kind: str,
+        sql: str,
+        params: List[Any],
+        seconds: float,
+        num_rows: Optional[int],
+        table: Any = None,
+    ) -> None:
+        """
+        Logs the query if it was slow. It's attributed to `table`, or else
+        the table whose connection it was run on
+        """
+        if seconds < self.threshold:
+            return
+        if table is None:
+            table = querying_table.get()
+        lineage = [] if table is None else [str(t) for t in table.lineage]
+        with self._lock:
+            self._next_id += 1
+            entry_id = self._next_id
+        entry = {
+            "id": entry_id,
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "kind": kind,
+            "seconds": round(seconds, 4),
+            "uid": None if table is None else table.uid,
+            "lineage": lineage,
+            "sql": sql,
+            "params": [str(p) for p in params],
+            "num_rows": num_rows,
+            "profile": None,
+        }
+        with self._lock:
+            self.entries.append(entry)
+            self.version += 1
+        connect = None if table is None else table.get_db_connection
+        if connect is not None and random.random() < self.profile_rate:
+            self._executor.submit(self._profile, entry, connect)
+        else:
+            self._executor.submit(self._write, entry)
+
+    def _profile(
+        self, entry: Dict[str, Any], connect: Callable[[], ContextManager]
+    ) -> None:
+        try:
+            with connect() as conn:
+                rows = conn.execute(
+                    f"EXPLAIN ANALYZE {entry['sql']}", entry["params"]
+                ).fetchall()
+            entry["profile"] = "\n".join(row[1] for row in rows)
+        except Exception as e:
+            entry["profile"] = f"failed: {e!r}"
+        with self._lock:
+            self.version += 1
+        self._write(entry)
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        if self._logger is not None:
+            self._logger.info(json.dumps(entry, default=str))
+
+    def latest(self) -> List[Dict[str, Any]]:
+        """
+        The entries kept in memory, slowest first
+        """
+        with self._lock:
+            entries = list(self.entries)
+        return sorted(entries, key=lambda e: e["seconds"], reverse=True)
+
+    def flush(self) -> None:
+        """
+        Waits for pending profiles and writes
+        """
+        self._executor.submit(lambda: None).result()
+
+
+slow_queries = SlowQueryLog(
+    path=os.environ.get("VOW_SLOW_QUERY_LOG", "slow_queries.jsonl"),
+    threshold=float(os.environ.get("VOW_SLOW_QUERY_SECONDS", "1.0")),
+    profile_rate=float(os.environ.get("VOW_SLOW_QUERY_PROFILE_RATE", "0.1")),
+)
@@ -1,16 +1,28 @@
 import io
-import csv
+import os
+import sys
 import json
+import time
+import zlib
 import pickle
+import base64
 import hashlib
-from dataclasses import asdict, dataclass, field, fields
-from functools import lru_cache
+import weakref
+import datetime
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, fields
 from typing import (
     Any,
+    Callable,
+    ContextManager,
     Dict,
     Iterator,
     List,
     Optional,
+    Set,
     Union,
     Tuple,
     Literal,
@@ -19,9 +31,17 @@ from typing import (
 from duckdb import DuckDBPyConnection
 import duckdb
 from fastapi import HTTPException
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from pyarrow import ipc as pa_ipc
+from pyarrow import parquet as pq
 from pypika.queries import QueryBuilder
 from pypika.queries import Column as QueryColumn
-from pypika.functions import Cast, Count, Max
+from pypika.queries import Selectable
+from pypika.queries import Table as QueryTable
+from pypika.terms import LiteralValue, Star
+from pypika.functions import Avg, Cast, Coalesce, Count, Max, Min, Sqrt
+from pypika.functions import Sum
 from pypika.enums import Order
 from pypika import (
     Query,
@@ -33,7 +53,15 @@ from pypika import (
     analytics,
 )
 from pydantic import BaseModel
-from enum import StrEnum
+from enum import Enum, StrEnum
+from pool import ConnectionPool
+from cancel import cancellable, check_cancelled
+from governor import governor
+from metrics import span
+from slowlog import querying, slow_queries
+from plan import flatten, required_literal
+from cache import BoundedCache, EvictionPolicy
+from shared_store import StoreBackend, backend_from_url
 
 
 def load_demo_datasets():
@@ -78,46 +106,186 @@ duckdbtype_to_coltype = {
 }
 
 
-def get_conn() -> DuckDBPyConnection:
-    conn = duckdb.connect("vow.db", read_only=True)
+def _coltype(duckdb_type: str) -> ColType:
+    # e.g. DECIMAL(18,3), or nested types from files like STRUCT(...)[]
+    base_type = duckdb_type.split("(")[0]
+    return ColType(duckdbtype_to_coltype.get(base_type, "OTHER"))
+
+
+def _setup_conn(conn: DuckDBPyConnection):
     conn.execute("PRAGMA default_null_order='NULLS LAST'")
-    return conn
+
+
+# enough for a cursor per thread that queries the database: the page,
+# operation and download workers of the app, and background jobs
+disk_pool = ConnectionPool(
+    "vow.db",
+    size=int(os.environ.get("VOW_POOL_SIZE", "14")),
+    timeout=float(os.environ.get("VOW_POOL_TIMEOUT", "30")),
+    max_dedicated=int(os.environ.get("VOW_DOWNLOAD_CONNECTIONS", "4")),
+    setup=_setup_conn,
+)
+
+
+def get_conn() -> ContextManager[DuckDBPyConnection]:
+    """
+    Checks out a pooled cursor on the disk database for the current thread
+    """
+    return disk_pool.connection()
 
 
 _conn_memory = duckdb.connect(":memory:")
-_conn_memory.execute("PRAGMA default_null_order='NULLS LAST'")
+_setup_conn(_conn_memory)
 
 
 def get_in_memory_conn() -> DuckDBPyConnection:
     return _conn_memory.cursor()
 
 
+@contextmanager
+def in_memory_conn() -> Iterator[DuckDBPyConnection]:
+    conn = get_in_memory_conn()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
 class Store:
-    # TODO: for aliases/names, don't store copies
-    # store a pointer to uid?
-    def __init__(self):
-        self.in_memory_db: Dict[str, Any] = {}
+    """
+    Live `Table` objects are kept in a cache bounded by `max_bytes`
+    Every table also has a compressed recipe (its pickled constructor
+    arguments) that outlives eviction, so `Table.load` can re-create it
+
+    With a `backend`, recipes, aliases, counts and schemas are written to
+    it as well, so that a table created by one process can be loaded by
+    another. What's in the process is read first, except for aliases,
+    which another process may have re-bound
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        policy: EvictionPolicy = "lru",
+        backend: Optional[StoreBackend] = None,
+    ):
+        self.in_memory_db: BoundedCache[Any] = BoundedCache(
+            max_bytes=max_bytes, policy=policy
+        )
+        self.backend = backend
         self.db: Dict[str, bytes] = {}
+        # names are aliases for uids, to avoid storing copies
+        self.aliases: Dict[str, str] = {}
+        # a query key always refers to the same rows, so its count never
+        # changes
+        self.counts: Dict[str, int] = {}
+
+    def resolve(self, key: str) -> str:
+        if self.backend is not None:
+            uid = self.backend.get("alias", key)
+            if uid is not None:
+                self.aliases[key] = uid.decode("utf-8")
+        return self.aliases.get(key, key)
+
+    def alias(self, name: str, uid: str):
+        self.aliases[name] = uid
+        if self.backend is not None:
+            self.backend.put("alias", name, uid.encode("utf-8"))
+
+    def put_in_memory(self, key: str, obj: Any, size: int):
+        self.in_memory_db.put(key, obj, size=size)
+
+    def pin(self, key: str):
+        """
+        Pinned tables are never evicted
+        """
+        self.in_memory_db.pin(self.resolve(key))
+
+    def unpin(self, key: str):
+        self.in_memory_db.unpin(self.resolve(key))
 
-    def put_in_memory(self, key: str, obj: Any):
-        self.in_memory_db[key] = obj
+    def is_bound(self, name: str) -> bool:
+        """
+        Whether `name` is an alias, in this or another process
+        """
+        return self.resolve(name) != name
 
     def put(self, key: str, obj: bytes):
-        self.db[key] = obj
+        recipe = zlib.compress(obj)
+        self.db[key] = recipe
+        if self.backend is not None:
+            self.backend.put("recipe", key, recipe)
+
+    def put_count(self, key: str, num_rows: int):
+        self.counts[key] = num_rows
+        if self.backend is not None:
+            self.backend.put("count", key, str(num_rows).encode("utf-8"))
+
+    def get_count(self, key: str) -> Optional[int]:
+        num_rows = self.counts.get(key)
+        if num_rows is None and self.backend is not None:
+            value = self.backend.get("count", key)
+            if value is not None:
+                num_rows = self.counts[key] = int(value)
+        return num_rows
+
+    def put_schema(self, key: str, schema: List["Column"]):
+        if self.backend is not None:
+            self.backend.put("schema", key, pickle.dumps(schema))
+
+    def get_schema(self, key: str) -> Optional[List["Column"]]:
+        """
+        A schema another process has inferred, if there's a backend
+        """
+        if self.backend is None:
+            return None
+        value = self.backend.get("schema", key)
+        return None if value is None else pickle.loads(value)
 
     def get(self, key: str) -> Any:
-        if key in self.in_memory_db:
-            return self.in_memory_db[key]
+        """
+        Returns the live object if it is cached, otherwise its recipe
+        Raises KeyError if the table was never stored
+        """
+        key = self.resolve(key)
+        obj = self.in_memory_db.get(key)
+        if obj is not None:
+            return obj
 
-        return self.db[key]
+        recipe = self.db.get(key)
+        if recipe is None and self.backend is not None:
+            recipe = self.backend.get("recipe", key)
+        if recipe is None:
+            raise KeyError(key)
+        return zlib.decompress(recipe)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.in_memory_db.stats()
+        stats["counts"] = len(self.counts)
+        stats["recipes"] = len(self.db)
+        stats["recipe_bytes"] = sum(len(r) for r in self.db.values())
+        if self.backend is not None:
+            stats["shared_recipes"] = self.backend.count("recipe")
+        return stats
 
     def __repr__(self) -> str:
         return (
-            f"In-memory: {self.in_memory_db.keys()}\nOthers: {self.db.keys()}"
+            f"In-memory: {self.in_memory_db.stats()}\nOthers: {len(self.db)}"
         )
 
 
-table_store = Store()
+# set while a table is re-created from its recipe: its name may have been
+# bound to a newer table since, which keeps it
+_restoring: ContextVar[bool] = ContextVar("restoring", default=False)
+
+_store_policy: EvictionPolicy = (
+    "lfu" if os.environ.get("VOW_STORE_POLICY") == "lfu" else "lru"
+)
+table_store = Store(
+    max_bytes=int(os.environ.get("VOW_STORE_MAX_MB", "256")) * 2**20,
+    policy=_store_policy,
+    backend=backend_from_url(os.environ.get("VOW_STORE_URL", "")),
+)
 
 
 class FreqOperation(BaseModel):
@@ -128,6 +296,8 @@ class FreqOperation(BaseModel):
     # TODO: separate sort operation
     operation_type: str = "f"
     cols: List[str]
+    # None leaves it to the size of the table
+    approx: Optional[bool] = None
 
 
 class FilterOperation(BaseModel):
@@ -147,11 +317,23 @@ class OpenOperation(BaseModel):
     rowid: int
 
 
+AggFunc = Literal["max", "min", "sum", "avg", "count"]
+
+_agg_funcs = {
+    "max": Max,
+    "min": Min,
+    "sum": Sum,
+    "avg": Avg,
+    "count": Count,
+}
+
+
 class PivotOperation(BaseModel):
     operation_type: str = "pivot"
     key_cols: List[str]
     pivot_col: str
     agg_col: str
+    agg_func: AggFunc = "max"
 
 
 class RegexSearchOperation(BaseModel):
@@ -182,6 +364,28 @@ OperationsType = Union[
 ]
 
 regexp_matches = CustomFunction("regexp_matches", ["string", "regex"])
+contains = CustomFunction("contains", ["string", "search_string"])
+approx_count_distinct = CustomFunction("approx_count_distinct", ["value"])
+
+
+class _ReservoirSample(Selectable):
+    """
+    `num_rows` rows of `view`, picked at random but the same every time
+    """
+
+    def __init__(self, view: QueryBuilder, num_rows: int, seed: int = 0):
+        super().__init__(alias=None)
+        self.view = view
+        self.num_rows = num_rows
+        self.seed = seed
+
+    def get_sql(self, **kwargs: Any) -> str:
+        kwargs.update(subquery=True, with_alias=True)
+        return (
+            f"{self.view.get_sql(**kwargs)}"
+            f" TABLESAMPLE reservoir({self.num_rows} ROWS)"
+            f" REPEATABLE ({self.seed})"
+        )
 
 
 @dataclass(frozen=True)
@@ -200,6 +404,7 @@ def _get_schema_for_view(
     if query_params is None:
         query_params = []
 
+    start = time.perf_counter()
     try:
         conn.execute(sql_query, query_params)
     except Exception as e:
@@ -213,10 +418,16 @@ def _get_schema_for_view(
             return []
         else:
             raise e
+    slow_queries.record(
+        "describe",
+        sql_query,
+        query_params,
+        time.perf_counter() - start,
+        len(rows),
+    )
 
     schema: List[Column] = [
-        Column(name=row[0], type=ColType(duckdbtype_to_coltype[row[1]]))
-        for row in rows
+        Column(name=row[0], type=_coltype(row[1])) for row in rows
     ]
     return schema
 
@@ -231,65 +442,508 @@ def _execute_query(
     if query_params is None:
         query_params = []
 
-    try:
-        conn.execute(sql_query, query_params)
-    except Exception as e:
-        print(sql_query)
-        raise e
+    start = time.perf_counter()
+    with cancellable(conn):
+        try:
+            conn.execute(sql_query, query_params)
+        except Exception as e:
+            print(sql_query)
+            raise e
 
-    columns = [col[0] for col in conn.description]
-    try:
-        rows = conn.fetchall()
+        columns = [col[0] for col in conn.description]
+        try:
+            rows = conn.fetchall()
 
-    except RuntimeError as e:
-        if e.args[0] == "no open result set":
-            return [], []
-        else:
-            raise e
+        except RuntimeError as e:
+            if e.args[0] == "no open result set":
+                return [], []
+            else:
+                raise e
 
+    seconds = time.perf_counter() - start
+    slow_queries.record("query", sql_query, query_params, seconds, len(rows))
     return rows, columns
 
 
-def _execute_query_csv_stream(
+_EXPORT_BATCH_ROWS = int(os.environ.get("VOW_EXPORT_BATCH_ROWS", "65536"))
+
+
+FileType = Literal["csv", "parquet", "arrow"]
+
+
+def _csv_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    The schema batches are written to CSV with. The CSV writer only writes
+    primitive types, so nested columns (lists, structs, maps) are text
+    """
+    for i, col in enumerate(schema):
+        if pa.types.is_nested(col.type):
+            schema = schema.set(i, pa.field(col.name, pa.string()))
+    return schema
+
+
+def _csv_batch(batch: pa.RecordBatch, schema: pa.Schema) -> pa.RecordBatch:
+    if batch.schema == schema:
+        return batch
+    arrays = [
+        pa.array(
+            [None if val is None else str(val) for val in array.to_pylist()],
+            pa.string(),
+        )
+        if pa.types.is_nested(array.type)
+        else array
+        for array in batch.columns
+    ]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _csv_writer(sink: io.BytesIO, schema: pa.Schema):
+    write_options = pa_csv.WriteOptions(quoting_style="needed")
+    return pa_csv.CSVWriter(sink, schema, write_options=write_options)
+
+
+def _parquet_writer(sink: io.BytesIO, schema: pa.Schema):
+    # every record batch becomes a row group
+    return pq.ParquetWriter(sink, schema)
+
+
+def _arrow_writer(sink: io.BytesIO, schema: pa.Schema):
+    return pa_ipc.new_stream(sink, schema)
+
+
+_file_writers = {
+    "csv": _csv_writer,
+    "parquet": _parquet_writer,
+    "arrow": _arrow_writer,
+}
+
+
+def _execute_query_stream(
     conn: DuckDBPyConnection,
     view: QueryBuilder,
     query_params: Optional[List[str]] = None,
-) -> Iterator[str]:
+    file_type: FileType = "csv",
+    table: Optional["Table"] = None,
+) -> Iterator[bytes]:
+    """
+    Streams the result of the query as a file, one chunk per record batch
+    `table` is what the query is attributed to in the slow query log
+    """
     sql_query = view.get_sql()
 
     if query_params is None:
         query_params = []
 
+    start = time.perf_counter()
+    with cancellable(conn):
+        try:
+            conn.execute(sql_query, query_params)
+        except Exception as e:
+            print(sql_query)
+            raise e
+
+    reader = conn.fetch_record_batch(_EXPORT_BATCH_ROWS)
+    num_rows = 0
+    # the time spent waiting for the client to read each chunk isn't the
+    # query's, so only the time spent producing them is counted
+    seconds = time.perf_counter() - start
+    sink = io.BytesIO()
+
+    def _flush() -> bytes:
+        chunk = sink.getvalue()
+        sink.seek(0)
+        sink.truncate(0)
+        return chunk
+
+    schema = reader.schema
+    if file_type == "csv":
+        schema = _csv_schema(schema)
+    with _file_writers[file_type](sink, schema) as writer:
+        batches = iter(reader)
+        while True:
+            start = time.perf_counter()
+            batch = next(batches, None)
+            if batch is None:
+                break
+            # the stream may be resumed after the client has gone
+            check_cancelled()
+            if file_type == "csv":
+                batch = _csv_batch(batch, schema)
+            writer.write_batch(batch)
+            num_rows += batch.num_rows
+            chunk = _flush()
+            seconds += time.perf_counter() - start
+            yield chunk
+
+    slow_queries.record(
+        "stream", sql_query, query_params, seconds, num_rows, table
+    )
+    # whatever is written on close, e.g. a header or footer
+    chunk = _flush()
+    if chunk:
+        yield chunk
+
+
+_ESTIMATED_COUNTS = bool(os.environ.get("VOW_ESTIMATED_COUNTS"))
+# frequency tables of bigger tables are estimated from a sample
+_APPROX_FREQ_MIN_ROWS = int(
+    os.environ.get("VOW_APPROX_FREQ_MIN_ROWS", "10000000")
+)
+_APPROX_FREQ_SAMPLE_ROWS = int(
+    os.environ.get("VOW_APPROX_FREQ_SAMPLE_ROWS", "500000")
+)
+_COUNT_PROBE_ROWS = int(os.environ.get("VOW_COUNT_PROBE_ROWS", "100000"))
+
+
+def _samples_frequency(num_rows: int, approx: Optional[bool]) -> bool:
+    """
+    Whether a frequency table of `num_rows` rows is estimated from a
+    sample, where `approx` is what was asked for
+    """
+    return num_rows > _APPROX_FREQ_SAMPLE_ROWS and (
+        approx is True or num_rows > _APPROX_FREQ_MIN_ROWS
+    )
+
+
+background = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("VOW_BACKGROUND_WORKERS", "2")),
+    thread_name_prefix="vow-background",
+)
+_in_flight: Dict[str, Future] = {}
+_in_flight_lock = threading.Lock()
+
+
+def _submit_once(key: str, fn, *args) -> Future:
+    """
+    Runs `fn` in the background unless a job with the same key is running
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        if future is not None:
+            return future
+        future = background.submit(fn, *args)
+        _in_flight[key] = future
+
+    def _done(_):
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+
+    future.add_done_callback(_done)
+    return future
+
+
+def _page_size(page: Tuple[List, List]) -> int:
+    """
+    Rough estimate of the memory held by a page of rows
+    """
+    rows, columns = page
+    size = sys.getsizeof(rows) + sum(sys.getsizeof(col) for col in columns)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(val) for val in row)
+    return size
+
+
+class _NullsLast(Enum):
+    asc = "ASC NULLS LAST"
+    desc = "DESC NULLS LAST"
+
+
+class _NullsFirst(Enum):
+    asc = "ASC NULLS FIRST"
+    desc = "DESC NULLS FIRST"
+
+
+def _encode_page_token(value: Any, ties: int) -> str:
+    """
+    A page token holds the sort key of the last row of a page, and the
+    number of rows with that key up to and including that row
+    """
+    if isinstance(value, datetime.datetime):
+        value = {"datetime": value.isoformat()}
+    elif isinstance(value, datetime.date):
+        value = {"date": value.isoformat()}
+    elif not isinstance(value, (str, int, float, type(None))):
+        value = str(value)
+    token = json.dumps([value, ties], separators=(",", ":"))
+    token = base64.urlsafe_b64encode(token.encode("utf-8")).decode("ascii")
+    return token.rstrip("=")
+
+
+def _decode_page_token(token: str) -> Tuple[Any, int]:
     try:
-        conn.execute(sql_query, query_params)
-    except RuntimeError as e:
-        print(sql_query)
-        raise e
+        padding = "=" * (-len(token) % 4)
+        value, ties = json.loads(base64.urlsafe_b64decode(token + padding))
+        if isinstance(value, dict) and "datetime" in value:
+            value = datetime.datetime.fromisoformat(value["datetime"])
+        elif isinstance(value, dict):
+            value = datetime.date.fromisoformat(value["date"])
+        if not isinstance(ties, int) or ties < 0:
+            raise ValueError(ties)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid page token")
+    return value, ties
+
+
+def _count_rows(
+    conn: DuckDBPyConnection,
+    view: QueryBuilder,
+    query_params: List,
+    limit: Optional[int],
+) -> int:
+    view = view if limit is None else view[:limit]
+    view = Query.from_(view).select(
+        Count("*").as_("num_rows"),
+    )
+    rows, _ = _execute_query(conn, view, query_params=query_params)
+    first_row = rows[0]
+    return first_row[0]
+
+
+def _has_contiguous_rowids(conn: DuckDBPyConnection, name: str) -> bool:
+    rows, _ = _execute_query(
+        conn,
+        Query.from_(QueryTable("tables", schema="information_schema"))
+        .select("*")
+        .where(Field("table_name") == Parameter("?"))
+        .where(Field("table_type") == "BASE TABLE"),
+        query_params=[name],
+    )
+    if not rows:
+        return False
+
+    rows, _ = _execute_query(
+        conn,
+        Query.from_(name).select(Count("*"), Max(Field("rowid"))),
+    )
+    num_rows, max_rowid = rows[0]
+    return num_rows == 0 or max_rowid == num_rows - 1
+
+
+# by (dbtype, table name), dropped along with the table
+_contiguous_rowids: BoundedCache[bool] = BoundedCache(
+    max_bytes=int(os.environ.get("VOW_ROWID_CACHE_ENTRIES", "10000"))
+)
 
-    buffer = io.StringIO()
-    csv_writer = csv.writer(buffer)
 
-    def _row_to_csv_str(seq):
-        csv_writer.writerow(seq)
-        value = buffer.getvalue().strip("\r\n")
-        buffer.seek(0)
-        buffer.truncate(0)
-        return value + "\n"
+def _drop_table(conn: DuckDBPyConnection, dbtype: DBType, name: str):
+    conn.execute(f'DROP TABLE IF EXISTS "{name}"')
+    _contiguous_rowids.pop((dbtype, name))
 
-    yield _row_to_csv_str((col_info[0] for col_info in conn.description))
 
-    while True:
-        try:
-            row = conn.fetchone()
-            if row is None:
-                continue
-            yield _row_to_csv_str(row)
-        except RuntimeError as e:
-            if e.args[0].startswith(
-                "Invalid Input Error: Attempting to execute an unsuccessful or closed pending query result"
-            ):
-                break
-            raise e
+# pages are shared by every Table object with the same uid
+page_cache: BoundedCache[Tuple[List, List]] = BoundedCache(
+    max_bytes=int(os.environ.get("VOW_PAGE_CACHE_MB", "128")) * 2**20
+)
+
+# fold filters, sorts and projections into the view they're applied to
+# instead of nesting a subquery per operation
+_FLATTEN_QUERIES = os.environ.get("VOW_FLATTEN_QUERIES", "1") != "0"
+
+# rule out rows for a regex search by a literal that every match contains
+_REGEX_PREFILTER = os.environ.get("VOW_REGEX_PREFILTER", "1") != "0"
+
+_schema_cache: BoundedCache[List[Column]] = BoundedCache(
+    max_bytes=int(os.environ.get("VOW_SCHEMA_CACHE_ENTRIES", "10000"))
+)
+
+# distinct values of pivot columns, by (query key, column)
+_pivot_domains: BoundedCache[List] = BoundedCache(
+    max_bytes=int(os.environ.get("VOW_PIVOT_DOMAIN_ENTRIES", "10000"))
+)
+
+
+def _frequency_query(view: Selectable, cols: List[str]) -> QueryBuilder:
+    """
+    Number of rows of `view` for each value of `cols`, most common first
+    """
+    # can check if column name is in self.columns
+    res = (
+        Query.from_(view)
+        .groupby(*cols)
+        .select(
+            *cols,
+            Count("*").as_("num_rows"),
+        )
+    )
+    # Instead of making the `orderby` clause part of the previous query
+    # I'm putting the clause in a new query below
+    # By doing I can use "num_rows" as the field to sort on, and can access
+    # it from self.orderbys
+    # TODO: make a test case for this
+    num_rows = QueryColumn("num_rows")
+    percentage = 100 * Cast(num_rows, "REAL") / analytics.Sum(num_rows).over()
+    percentage = percentage.as_("percentage")
+    return (
+        Query.from_(res)
+        .select(
+            "*",
+            percentage,
+        )
+        .orderby("num_rows", order=Order.desc)
+    )
+
+
+# column holding the aggregate of each group, before a pivot reshapes it
+_PIVOT_VALUE = "_pivot_value"
+
+
+def _reshape(
+    grouped: Selectable,
+    key_cols: List[str],
+    pivot_col: str,
+    pivot_vals: List,
+    agg_func: AggFunc,
+) -> QueryBuilder:
+    """
+    Turns rows aggregated by the key columns and `pivot_col` into one row
+    per key, with a column per value of `pivot_col`
+    """
+    cases = []
+    for val in pivot_vals:
+        # handling NULL in pivot_vals
+        is_val = (
+            Field(pivot_col).isnull()
+            if val is None
+            else Field(pivot_col) == val
+        )
+        case = Max(Case().when(is_val, Field(_PIVOT_VALUE)))
+        if agg_func == "count":
+            # keys without a row of the value counted none
+            case = Coalesce(case, 0)
+        cases.append(case.as_("NaN" if val is None else val))
+    return Query.from_(grouped).groupby(*key_cols).select(*key_cols, *cases)
+
+
+# read counts are kept for at most this many query keys at a time
+_MATERIALIZE_TRACKED_KEYS = 100000
+
+
+class Materializer:
+    """
+    Copies the rows of derived tables that are read often, or are slow to
+    compute, into tables of the in-memory database
+
+    Materialized tables are kept within a memory budget, least recently
+    used first out. Reads of an evicted (or not yet materialized) table
+    fall back to running its view
+    """
+
+    def __init__(self, max_bytes: int, min_hits: int, min_seconds: float):
+        self.min_hits = min_hits
+        self.min_seconds = min_seconds
+        self.tables: BoundedCache[str] = BoundedCache(
+            max_bytes=max_bytes, on_evict=self._drop
+        )
+        self._hits: Dict[str, int] = {}
+        # query keys of tables that are too big or can't be stored
+        self._skipped: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Name of the in-memory table holding the rows of the query `key`
+        """
+        return self.tables.get(key)
+
+    def record(self, table: "Table", seconds: Optional[float]):
+        """
+        Records a read of a page of `table`, and how long its query took if
+        it was run. Materializes the table once it crosses a threshold
+        """
+        key = table.query_key
+        if table.source is None or key in self.tables:
+            return
+        with self._lock:
+            if key in self._skipped:
+                return
+            if len(self._hits) > _MATERIALIZE_TRACKED_KEYS:
+                self._hits.clear()
+            hits = self._hits[key] = self._hits.get(key, 0) + 1
+        if hits >= self.min_hits or (
+            seconds is not None and seconds >= self.min_seconds
+        ):
+            _submit_once(f"materialize:{key}", self.materialize, table)
+
+    def materialize(self, table: "Table") -> Optional[str]:
+        key = table.query_key
+        name = self.get(key)
+        if name is not None:
+            return name
+
+        # rows are stored in the order pages are read in, so that pages of
+        # the materialized table can be read by rowid
+        query = table._ordered() if table._sort_key() else table.view
+        rows = table._read_arrow(query, self.tables.max_bytes)
+        if rows is None:
+            return self._skip(key)
+        return self.store(table, rows)
+
+    def store(self, table: "Table", rows: pa.Table) -> Optional[str]:
+        """
+        Keeps `rows`, which were computed some other way, as the rows of
+        `table`. They need to be in the order `materialize` would store
+        """
+        key = table.query_key
+        if rows.nbytes > self.tables.max_bytes:
+            return self._skip(key)
+        name = f"_mat_{key}"
+        with in_memory_conn() as conn:
+            conn.register("_mat_rows", rows)
+            try:
+                conn.execute(
+                    f'CREATE OR REPLACE TABLE "{name}" AS'
+                    " SELECT * FROM _mat_rows"
+                )
+            except duckdb.Error:
+                # e.g. duplicate column names
+                return self._skip(key)
+            finally:
+                conn.unregister("_mat_rows")
+
+        table._store_len(rows.num_rows)
+        self.tables.put(key, name, size=rows.nbytes)
+        with self._lock:
+            self._hits.pop(key, None)
+        return name
+
+    def _skip(self, key: str) -> None:
+        with self._lock:
+            self._skipped.add(key)
+            self._hits.pop(key, None)
+        return None
+
+    def _drop(self, key: str, name: str):
+        with in_memory_conn() as conn:
+            _drop_table(conn, "memory", name)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.tables.stats()
+        with self._lock:
+            stats["tracked"] = len(self._hits)
+            stats["skipped"] = len(self._skipped)
+        return stats
+
+
+materializer = Materializer(
+    max_bytes=int(os.environ.get("VOW_MATERIALIZE_MB", "256")) * 2**20,
+    min_hits=int(os.environ.get("VOW_MATERIALIZE_HITS", "20")),
+    min_seconds=float(os.environ.get("VOW_MATERIALIZE_SECONDS", "1.0")),
+)
+
+
+# fields that are implied by the query key, or only help to compute things
+# the table would otherwise have to query for
+_NON_IDENTITY_FIELDS = {
+    "view",
+    "source",
+    "query_params",
+    "dbtype",
+    "schema",
+    "count_key",
+    "cols",
+    "rows",
+    "kind",
+}
 
 
 @dataclass(kw_only=True, eq=False)
@@ -301,16 +955,48 @@ class Table:
     name: Optional[str] = None
     desc: Optional[str] = None
     dbtype: Optional[DBType] = None
-    columns: List[Column] = field(init=False)
+    # inferred lazily by `columns` when not known up front
+    schema: Optional[List[Column]] = field(default=None, repr=False)
+    # query key of a table known to have the same number of rows, e.g. the
+    # unsorted version of a sorted table
+    count_key: Optional[str] = None
     wrapped_col_indices: List[int] = field(default_factory=list)
+    # the kind of operation (see `governor`) whose queries run when the
+    # rows are read, e.g. the GROUP BY of a frequency table. Deriving a
+    # table doesn't query, so its first read is what has to be governed
+    kind: Optional[str] = None
 
     def __post_init__(self):
         self.query_params = self.query_params or []
+        if _FLATTEN_QUERIES:
+            self.view = flatten(self.view)
 
-        source_uid = self.source.uid if self.source else ""
-        query_params_str = ",".join(self.query_params)
+        # Try to infer dbtype from source if not provided
+        if self.dbtype is None:
+            if self.source is None:
+                raise ValueError(f"Unable to infer dbtype for {self}")
+            elif self.source is not None:
+                self.dbtype = self.source.dbtype
+        # views of derived tables query the view of their source too
+        if self.kind is None and self.source is not None:
+            self.kind = self.source.kind
+
+        # the SQL and its parameters identify the rows, so that chains of
+        # operations which flatten to the same query share cached counts
+        # and pages
+        query_params_str = json.dumps(self.all_query_params())
         query_str = self.view.get_sql()
-        hash_str = source_uid + query_params_str + query_str
+        # pypika assigns an alias to a subquery the first time it is wrapped
+        # in another query, which changes the SQL of every query wrapping it
+        # afterwards. Fixing the alias up front keeps the SQL (and uid) of
+        # derived tables independent of what was done with this one before
+        if self.view.alias is None:
+            self.view.alias = "sq0"
+        hash_str = f"{self.dbtype}|{query_params_str}|{query_str}"
+        self.query_key = hashlib.md5(hash_str.encode("utf-8")).hexdigest()[:15]
+        # whereas the uid identifies the table itself: its class, fields and
+        # source, which its page shows (breadcrumbs, links, ...) too
+        hash_str = self._identity()
         self.uid = hashlib.md5(hash_str.encode("utf-8")).hexdigest()[:15]
 
         self.orderbys = {
@@ -318,97 +1004,460 @@ class Table:
             for field, order in self.view._orderbys
         }
 
-        # Try to infer dbtype from source if not provided
-        if self.dbtype is None:
-            if self.source is None:
-                raise ValueError(f"Unable to infer dbtype for {self}")
-            elif self.source is not None:
-                self.dbtype = self.source.dbtype
+        self._connect = get_conn if self.dbtype == "disk" else in_memory_conn
 
-        self.get_db_connection = (
-            get_conn if self.dbtype == "disk" else get_in_memory_conn
-        )
-
-        self.columns = _get_schema_for_view(
-            self.get_db_connection(),
-            self.view,
-            query_params=self.all_query_params(),
-        )
-        # TODO: refactor: don't do IO in table constructor
         self.persist()
 
-    def _persist(self, key):
-        if self.dbtype == "memory":
-            table_store.put_in_memory(key, self)
+    def _identity(self) -> str:
+        data = {
+            f.name: getattr(self, f.name)
+            for f in fields(self)
+            if f.init and f.name not in _NON_IDENTITY_FIELDS
+        }
+        data["class"] = self.__class__.__name__
+        data["source_uid"] = None if self.source is None else self.source.uid
+        data["query_key"] = self.query_key
+        return json.dumps(data, sort_keys=True, default=str)
+
+    @contextmanager
+    def get_db_connection(self) -> Iterator[DuckDBPyConnection]:
+        """
+        A connection to the database of this table. Queries run on it are
+        attributed to this table in the slow query log
+        """
+        with querying(self), self._connect() as conn:
+            yield conn
 
-        data = asdict(self)
+    @property
+    def columns(self) -> List[Column]:
+        if self.schema is None:
+            self.schema = self._infer_schema()
+        return self.schema
+
+    def _infer_schema(self) -> List[Column]:
+        # the schema only depends on the query, not on the lineage or
+        # the values of the query params
+        key = hashlib.md5(
+            f"{self.dbtype}:{self.view.get_sql()}".encode("utf-8")
+        ).hexdigest()
+        schema = _schema_cache.get(key)
+        if schema is None:
+            # another process may have inferred it
+            schema = table_store.get_schema(key)
+            if schema is not None:
+                _schema_cache.put(key, schema, size=1)
+        if schema is not None:
+            return schema
+
+        with span("describe", self), self.get_db_connection() as conn:
+            schema = _get_schema_for_view(
+                conn,
+                self.view,
+                query_params=self.all_query_params(),
+            )
+        _schema_cache.put(key, schema, size=1)
+        table_store.put_schema(key, schema)
+        return schema
 
-        # exclude fields that have init=False, e.g. columns
+    def _projected_schema(
+        self, cols: Optional[List[str]]
+    ) -> Optional[List[Column]]:
+        """
+        Schema of a table that selects `cols` (or all columns) from this one
+        Returns None if a column is unknown, so it's left to inference
+        """
+        if cols is None:
+            return self.columns
+        by_name = {c.name: c for c in self.columns}
+        if any(col not in by_name for col in cols):
+            return None
+        return [by_name[col] for col in cols]
+
+    def _record(self) -> bytes:
+        # fields that have init=False, e.g. columns, are excluded
         # these are initialized in __post_init__
-        for field in fields(self):
-            if not field.init:
-                del data[field.name]
-
+        data = {f.name: getattr(self, f.name) for f in fields(self) if f.init}
         data.pop("source")
-        data["source_uid"] = self.source.uid if self.source else None
+        data["source_uid"] = None if self.source is None else self.source.uid
         record = {"class": self.__class__.__name__, "data": data}
-        table_store.put(key, pickle.dumps(record))
+        return pickle.dumps(record)
 
     def persist(self):
-        self._persist(key=self.uid)
-        if self.name is not None:
-            self._persist(key=self.name)
+        with span("persist", self):
+            record = self._record()
+            table_store.put(self.uid, record)
+        table_store.put_in_memory(self.uid, self, size=len(record))
+        if self.name is not None and not _restoring.get():
+            table_store.alias(self.name, self.uid)
 
     @classmethod
     def load(cls, uid: str) -> "Table":
-        obj = table_store.get(uid)
+        try:
+            obj = table_store.get(uid)
+        except KeyError:
+            if uid not in catalog:
+                raise
+            return catalog.get(uid)
         if isinstance(obj, Table):
             return obj
-        record = pickle.loads(table_store.get(uid))
+        record = pickle.loads(obj)
         class_ = globals()[record["class"]]
         data = record["data"]
         source_uid = data.pop("source_uid")
         source = None if source_uid is None else Table.load(source_uid)
         data["source"] = source
-        return class_(**data)
+        token = _restoring.set(True)
+        try:
+            return class_(**data)
+        finally:
+            _restoring.reset(token)
+
+    def _known_len(self) -> Optional[int]:
+        num_rows = table_store.get_count(self.query_key)
+        if num_rows is None and self.count_key is not None:
+            num_rows = table_store.get_count(self.count_key)
+        return num_rows
+
+    def _count(self, limit: Optional[int] = None) -> int:
+        materialized = materializer.get(self.query_key)
+        if materialized is not None:
+            try:
+                with in_memory_conn() as conn:
+                    return _count_rows(
+                        conn, Query.from_(materialized).select("*"), [], limit
+                    )
+            except duckdb.CatalogException:
+                # evicted since it was looked up
+                pass
+        with span("count", self), self.get_db_connection() as conn:
+            return _count_rows(conn, self.view, self.all_query_params(), limit)
+
+    def _store_len(self, num_rows: int):
+        table_store.put_count(self.query_key, num_rows)
+        if self.count_key is not None:
+            table_store.put_count(self.count_key, num_rows)
 
     def __len__(self):
-        view = Query.from_(self.view).select(
-            Count("*").as_("num_rows"),
-        )
-        rows, _ = _execute_query(
-            self.get_db_connection(),
-            view,
-            query_params=self.all_query_params(),
-        )
-        first_row = rows[0]
-        return first_row[0]
+        num_rows = self._known_len()
+        if num_rows is None:
+            num_rows = self._count()
+            self._store_len(num_rows)
+        return num_rows
 
-    # Note: this depends on implementation of __hash__
-    @lru_cache
-    def __getitem_cached__(self, slice_rep):
-        s = slice(*slice_rep[1])
+    def estimated_len(self) -> Tuple[int, bool]:
+        """
+        Returns (num_rows, is_exact)
 
-        limit, offset = s.stop - s.start, s.start
-        # pypika seems to have a different understanding of
-        # the start and stop attributes of a slice
-        view = self.view[offset:limit]
+        With VOW_ESTIMATED_COUNTS set, a table with an unknown count only
+        counts up to VOW_COUNT_PROBE_ROWS rows, which is returned as a lower
+        bound while the exact count is computed in the background
+        """
+        num_rows = self._known_len()
+        if num_rows is not None:
+            return num_rows, True
+        if not _ESTIMATED_COUNTS:
+            return len(self), True
+
+        num_rows = self._count(limit=_COUNT_PROBE_ROWS)
+        if num_rows < _COUNT_PROBE_ROWS:
+            self._store_len(num_rows)
+            return num_rows, True
+
+        _submit_once(f"len:{self.query_key}", len, self)
+        return num_rows, False
+
+    def _scanned_rows(self) -> int:
+        """
+        Rough cost of an operation on this table: the number of rows of the
+        base table it reads from, which is usually cached
+        """
+        base = self
+        # tables opened from a catalog don't read from the catalog
+        while base.source is not None and not isinstance(
+            base.source, TableOfTables
+        ):
+            base = base.source
+        num_rows, _ = base.estimated_len()
+        return num_rows
+
+    def _sort_key(self) -> Optional[Tuple[str, bool]]:
+        if len(self.orderbys) != 1:
+            return None
+        return next(iter(self.orderbys.items()))
+
+    def _ordered(
+        self, reverse: bool = False, view: Optional[QueryBuilder] = None
+    ) -> QueryBuilder:
+        """
+        The view (or `view`, which has the same rows) in a total order: by
+        the sort key, then by every other column, so that pages read from
+        either end, or after a page token, line up with each other
+        """
+        sort_key = self._sort_key()
+        if sort_key is None:
+            raise ValueError(f"{self} is not sorted")
+        col, ascending = sort_key
+
+        # the other columns are referred to by position, which works for
+        # duplicate names as well
+        tiebreakers = [
+            LiteralValue(str(i + 1))
+            for i, c in enumerate(self.columns)
+            if c.name != col
+        ]
+
+        nulls = _NullsFirst if reverse else _NullsLast
+        qry = Query.from_(view or self.view).select("*")
+        qry = qry.orderby(
+            Field(col), order=nulls.asc if ascending != reverse else nulls.desc
+        )
+        for position in tiebreakers:
+            qry = qry.orderby(
+                position, order=nulls.desc if reverse else nulls.asc
+            )
+        return qry
+
+    def _rowid_table(self) -> Optional[str]:
+        """
+        Name of the table if the view is a plain scan of a base table whose
+        rowids are 0..n-1, so that its pages can be read by rowid range
+        """
+        view = self.view
+        is_plain_scan = (
+            len(view._from) == 1
+            and isinstance(view._from[0], QueryTable)
+            and len(view._selects) == 1
+            and isinstance(view._selects[0], Star)
+            and not view._wheres
+            and not view._groupbys
+            and not view._orderbys
+            and not view._joins
+            and not view._distinct
+        )
+        if not is_plain_scan:
+            return None
+
+        name = view._from[0].get_table_name()
+        key = (self.dbtype, name)
+        contiguous = _contiguous_rowids.get(key)
+        if contiguous is None:
+            with self.get_db_connection() as conn:
+                contiguous = _has_contiguous_rowids(conn, name)
+            _contiguous_rowids.put(key, contiguous, size=1)
+        return name if contiguous else None
+
+    def _fetch_materialized(
+        self, name: str, offset: int, limit: int
+    ) -> Tuple[List, List]:
+        rowid = Field("rowid")
+        view = (
+            Query.from_(name)
+            .select("*")
+            .where((rowid >= offset) & (rowid < offset + limit))
+            .orderby(rowid)
+        )
+        with in_memory_conn() as conn:
+            return _execute_query(conn, view)
+
+    def _fetch_page(self, offset: int, limit: int) -> Tuple[List, List]:
+        materialized = materializer.get(self.query_key)
+        if materialized is not None:
+            try:
+                return self._fetch_materialized(materialized, offset, limit)
+            except duckdb.CatalogException:
+                # evicted since it was looked up
+                pass
+
+        reverse = False
+        rowid_table = self._rowid_table()
+        num_rows = self._known_len()
+
+        if rowid_table is not None:
+            rowid = Field("rowid")
+            view = (
+                Query.from_(rowid_table)
+                .select("*")
+                .where((rowid >= offset) & (rowid < offset + limit))
+                .orderby(rowid)
+            )
+        elif self._sort_key() is None:
+            # pypika seems to have a different understanding of
+            # the start and stop attributes of a slice
+            view = self.view[offset:limit]
+        elif num_rows is not None and 2 * offset + limit > num_rows:
+            # the page is closer to the end, so it is cheaper to read
+            # the rows in reverse order and flip them
+            reverse = True
+            end = min(offset + limit, num_rows)
+            view = self._ordered(reverse=True)[
+                num_rows - end : max(end - offset, 0)
+            ]
+        else:
+            view = self._ordered()[offset:limit]
 
         if not isinstance(view, QueryBuilder):
             raise Exception(f"view has unexpected type {type(view)}")
-        rows, columns = _execute_query(
-            self.get_db_connection(),
-            view,
-            query_params=self.all_query_params(),
-        )
+        with self.get_db_connection() as conn:
+            rows, columns = _execute_query(
+                conn,
+                view,
+                query_params=(
+                    [] if rowid_table is not None else self.all_query_params()
+                ),
+            )
+        if reverse:
+            rows.reverse()
+        return rows, columns
+
+    def _seek(self, after: str, limit: int) -> Tuple[List, List]:
+        sort_key = self._sort_key()
+        if sort_key is None:
+            raise HTTPException(
+                status_code=400, detail="Only sorted tables have page tokens"
+            )
+        col, ascending = sort_key
+        value, ties = _decode_page_token(after)
+
+        # rows at or after `value` in the order of the sort key (where
+        # NULLs are last), skipping the ties that were on earlier pages
+        field_ = Field(col)
+        if value is None:
+            criterion = field_.isnull()
+        elif ascending:
+            criterion = (field_ >= Parameter("?")) | field_.isnull()
+        else:
+            criterion = (field_ <= Parameter("?")) | field_.isnull()
+        value_params = [] if value is None else [value]
+
+        materialized = materializer.get(self.query_key)
+        if materialized is not None:
+            view = self._ordered(view=Query.from_(materialized).select("*"))
+            try:
+                with in_memory_conn() as conn:
+                    return _execute_query(
+                        conn,
+                        view.where(criterion)[ties:limit],
+                        query_params=value_params,
+                    )
+            except duckdb.CatalogException:
+                pass
+
+        view = self._ordered().where(criterion)[ties:limit]
+        with self.get_db_connection() as conn:
+            rows, columns = _execute_query(
+                conn,
+                view,
+                query_params=self.all_query_params() + value_params,
+            )
         return rows, columns
 
-    def __getitem__(self, s):
-        # slice_rep is a hashable version of s
-        # which makes it compatible with lru_cache
-        slice_rep = s.__reduce__()
+    def _page_key(
+        self, offset: int, limit: int, after: Optional[str]
+    ) -> Tuple[str, Union[int, str], int]:
+        return (self.query_key, offset if after is None else after, limit)
+
+    def read_kind(
+        self, offset: int, limit: int, after: Optional[str] = None
+    ) -> str:
+        """
+        The kind of operation reading a page of rows amounts to: a page
+        view, unless the rows still have to be queried by `kind`
+        """
+        if self.kind is None or materializer.get(self.query_key) is not None:
+            return "page"
+        key = self._page_key(offset, limit, after)
+        if key in page_cache and self._known_len() is not None:
+            return "page"
+        return self.kind
+
+    def _page(
+        self, offset: int, limit: int, after: Optional[str] = None
+    ) -> Tuple[List, List]:
+        key = self._page_key(offset, limit, after)
+        page = page_cache.get(key)
+        seconds = None
+        if page is None:
+            start = time.perf_counter()
+            with span("page_query", self):
+                if after is None:
+                    page = self._fetch_page(offset, limit)
+                else:
+                    page = self._seek(after, limit)
+            seconds = time.perf_counter() - start
+            page_cache.put(key, page, size=_page_size(page))
+        materializer.record(self, seconds)
+        rows, columns = page
+        self._on_rows_fetched(
+            rows, columns, offset if after is None else None, limit
+        )
+        return page
 
-        return self.__getitem_cached__(slice_rep)
+    def _on_rows_fetched(
+        self,
+        rows: List,
+        columns: List[str],
+        offset: Optional[int],
+        limit: int,
+    ):
+        if offset == 0 and len(rows) < limit:
+            self._store_len(len(rows))
+
+    def __getitem__(self, s: slice) -> Tuple[List, List]:
+        limit, offset = s.stop - s.start, s.start
+        return self._page(offset, limit)
+
+    def seek(self, after: str, limit: int) -> Tuple[List, List]:
+        """
+        Returns `limit` rows following the position encoded by the page
+        token `after`. Unlike a slice, this doesn't need the database to
+        produce and discard all the rows before the page
+        """
+        return self._page(0, limit, after=after)
+
+    def page_token(
+        self, rows: List, columns: List[str], after: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Token for the page that follows `rows`, where `after` is the token
+        `rows` were fetched with. Returns None if the table isn't sorted or
+        the position of the page can't be told from its rows
+        """
+        sort_key = self._sort_key()
+        if sort_key is None or not rows or sort_key[0] not in columns:
+            return None
+        idx = columns.index(sort_key[0])
+        last = rows[-1][idx]
+
+        ties = 0
+        for row in reversed(rows):
+            if row[idx] != last:
+                break
+            ties += 1
+
+        if ties == len(rows):
+            # the page is all ties, earlier pages might have some too
+            if after is None:
+                return None
+            prev_value, prev_ties = _decode_page_token(after)
+            if prev_value == last:
+                ties += prev_ties
+        return _encode_page_token(last, ties)
+
+    def prefetch(self, s: slice, after: Optional[str] = None):
+        """
+        Fetches a page into the page cache in the background
+        """
+        limit, offset = s.stop - s.start, s.start
+        key = (self.query_key, offset if after is None else after, limit)
+        if key in page_cache:
+            return
+        _submit_once(
+            f"page:{self.query_key}:{key[1]}:{limit}",
+            self._page,
+            offset,
+            limit,
+            after,
+        )
 
     def __hash__(self):
         return hash(self.uid)
@@ -438,44 +1487,100 @@ class Table:
         return self.source.all_query_params() + self.query_params
 
     def __str__(self):
-        match(self.source, self.name, self.desc):
-            case(None, None, None):
+        match (self.source, self.name, self.desc):
+            case (None, None, None):
                 return "unk"
-            case(_, str(n), None):
+            case (_, str(n), None):
                 return n
-            case(_, _, str(d)):
+            case (_, _, str(d)):
                 return d
         return "unk"
 
-    def frequency(self, cols: List[str]) -> "FreqTable":
-        # can check if column name is in self.columns
+    def frequency(
+        self, cols: List[str], approx: Optional[bool] = None
+    ) -> "FreqTable":
+        """
+        Number of rows for each value of `cols`. With `approx`, or by
+        default when the table has more than VOW_APPROX_FREQ_MIN_ROWS rows,
+        the counts are estimated from a sample
+        """
+        if approx is None or approx:
+            # rather than counting the rows, the number of rows of the base
+            # table bounds them, which is usually cached
+            num_rows = self._known_len()
+            if num_rows is None:
+                num_rows = self._scanned_rows()
+            if _samples_frequency(num_rows, approx):
+                freq = self._approx_frequency(cols, approx)
+                if freq is not None:
+                    return freq
+
+        # the schema is inferred lazily, but the position of
+        # the percentage column is known already
+        return FreqTable(
+            view=_frequency_query(self.view, cols),
+            key_cols=cols,
+            source=self,
+            desc="freq",
+            wrapped_col_indices=[len(cols) + 1],
+            sums_to_source=True,
+        )
+
+    def _approx_frequency(
+        self, cols: List[str], approx: Optional[bool]
+    ) -> Optional["FreqTable"]:
+        """
+        Counts in a reservoir sample of the table, scaled up to the whole
+        table, along with the half-width of their 95% confidence interval
+
+        Returns None if the table turns out to have too few rows to sample
+        """
+        # the number of distinct values is estimated from the whole table,
+        # which is a lot cheaper than grouping by them. The same scan
+        # counts the rows the sample is scaled up to
+        row = CustomFunction("row", [f"col{i}" for i in range(len(cols))])
+        distinct = Query.from_(self.view).select(
+            approx_count_distinct(row(*[Field(col) for col in cols])),
+            Count("*"),
+        )
+        with self.get_db_connection() as conn:
+            rows, _ = _execute_query(
+                conn, distinct, query_params=self.all_query_params()
+            )
+        distinct_estimate, num_rows = rows[0]
+        self._store_len(num_rows)
+        if not _samples_frequency(num_rows, approx):
+            return None
+
+        sample_size = _APPROX_FREQ_SAMPLE_ROWS
         res = (
-            Query.from_(self.view)
+            Query.from_(_ReservoirSample(self.view, sample_size))
             .groupby(*cols)
-            .select(
-                *cols,
-                Count("*").as_("num_rows"),
-            )
+            .select(*cols, Count("*").as_("sample_rows"))
         )
-        # Instead of making the `orderby` clause part of the previous query
-        # I'm putting the clause in a new query below
-        # By doing I can use "num_rows" as the field to sort on, and can access
-        # it from self.orderbys
-        # TODO: make a test case for this
-        num_rows = QueryColumn("num_rows")
-        percentage = (
-            100 * Cast(num_rows, "REAL") / analytics.Sum(num_rows).over()
+
+        scale = num_rows / sample_size
+        sample_rows = Cast(QueryColumn("sample_rows"), "DOUBLE")
+        share = sample_rows / sample_size
+        error = 1.96 * scale * Sqrt(sample_rows * (1 - share))
+        res = Query.from_(res).select(
+            *cols,
+            Cast(sample_rows * scale, "BIGINT").as_("num_rows"),
+            Cast(error, "BIGINT").as_("error"),
+            (100 * share).as_("percentage"),
         )
-        percentage = percentage.as_("percentage")
         res = (
-            Query.from_(res)
-            .select(
-                "*",
-                percentage,
-            )
-            .orderby("num_rows", order=Order.desc)
+            Query.from_(res).select("*").orderby("num_rows", order=Order.desc)
+        )
+        return FreqTable(
+            view=res,
+            key_cols=cols,
+            source=self,
+            desc="~freq",
+            wrapped_col_indices=[len(cols) + 2],
+            sample_rows=sample_size,
+            distinct_estimate=distinct_estimate,
         )
-        return FreqTable(view=res, key_cols=cols, source=self, desc="freq")
 
     def sort(self, col_name: str, ascending: bool = True) -> "Table":
         order = Order.asc if ascending else Order.desc
@@ -486,6 +1591,8 @@ class Table:
             desc=self.desc,
             query_params=self.query_params,
             dbtype=self.dbtype,
+            schema=self.columns,
+            count_key=self.count_key or self.query_key,
         )
 
     def _filter_exact(
@@ -514,7 +1621,12 @@ class Table:
     ) -> "Table":
         qry = self._filter_exact(self.view, filters, cols_to_return)
 
-        return Table(view=qry, source=self, desc="fil")
+        return Table(
+            view=qry,
+            source=self,
+            desc="fil",
+            schema=self._projected_schema(cols_to_return),
+        )
 
     def _filter_except(
         self,
@@ -545,7 +1657,12 @@ class Table:
         if cols_to_return is None, then return all columns
         """
         res = self._filter_except(self.view, filters, cols_to_return)
-        return Table(view=res, source=self, desc="fil2")
+        return Table(
+            view=res,
+            source=self,
+            desc="fil2",
+            schema=self._projected_schema(cols_to_return),
+        )
 
     def _filter_regex(
         self,
@@ -554,9 +1671,13 @@ class Table:
         regex: str,
         cols_to_return: Optional[List[str]],
     ) -> QueryBuilder:
-        qry = Query.from_(view).where(
-            regexp_matches(Field(column), Parameter("?"))
-        )
+        criterion = regexp_matches(Field(column), Parameter("?"))
+        literal = required_literal(regex) if _REGEX_PREFILTER else None
+        if literal is not None:
+            # rows without the literal can't match, and are much cheaper
+            # to rule out with a substring search
+            criterion = contains(Field(column), literal) & criterion
+        qry = Query.from_(view).where(criterion)
 
         if cols_to_return is None:
             qry = qry.select("*")
@@ -570,21 +1691,98 @@ class Table:
     ) -> "Table":
         qry = self._filter_regex(self.view, column, regex, cols_to_return)
         return Table(
-            view=qry, source=self, query_params=[regex], desc="search"
+            view=qry,
+            source=self,
+            query_params=[regex],
+            desc="search",
+            schema=self._projected_schema(cols_to_return),
+            kind="search",
         )
 
-    def pivot(self, key_cols: List[str], pivot_col: str, agg_col: str):
+    def _pivot_domain(self, pivot_col: str, limit: int) -> List:
         """
-        aggs: (field, aggfunction)
+        Distinct values of `pivot_col`, up to `limit + 1` of them
         """
-        col_limit = 35
-        temp = Query.from_(self.view)
-        temp = temp.select(pivot_col).distinct()
-        rows, cols = _execute_query(
-            self.get_db_connection(), temp[: col_limit + 1]
+        key = (self.query_key, pivot_col)
+        domain = _pivot_domains.get(key)
+        if domain is not None:
+            return domain
+
+        temp = (
+            Query.from_(self.view)
+            .select(pivot_col)
+            .distinct()
+            .orderby(pivot_col)
         )
+        with self.get_db_connection() as conn:
+            rows, cols = _execute_query(
+                conn,
+                temp[: limit + 1],
+                query_params=self.all_query_params(),
+            )
         assert len(cols) == 1
-        if len(rows) > col_limit:
+        domain = [row[0] for row in rows]
+        _pivot_domains.put(key, domain, size=1)
+        return domain
+
+    def _read_arrow(
+        self, query: QueryBuilder, max_bytes: int
+    ) -> Optional[pa.Table]:
+        """
+        Rows of `query`, which reads from this table's view, or None if
+        they take more than `max_bytes`
+        """
+        batches, num_bytes = [], 0
+        with self.get_db_connection() as conn:
+            conn.execute(query.get_sql(), self.all_query_params())
+            reader = conn.fetch_record_batch(_EXPORT_BATCH_ROWS)
+            for batch in reader:
+                num_bytes += batch.nbytes
+                if num_bytes > max_bytes:
+                    return None
+                batches.append(batch)
+        return pa.Table.from_batches(batches, schema=reader.schema)
+
+    def pivot(
+        self,
+        key_cols: List[str],
+        pivot_col: str,
+        agg_col: str,
+        agg_func: AggFunc = "max",
+    ):
+        """
+        One column per value of `pivot_col`, holding `agg_func` of
+        `agg_col` over the rows with that value
+
+        The rows are aggregated by the key columns and `pivot_col` in one
+        scan, and the result reshaped. The first time a column is pivoted,
+        once its values are known to be few enough, that scan is run here
+        and its reshaped result is materialized
+        """
+        col_type = {c.name: c.type for c in self.columns}.get(agg_col)
+        if agg_func in ("sum", "avg") and col_type not in (
+            ColType.INT,
+            ColType.FLOAT,
+        ):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Can't {agg_func} {agg_col}, which isn't a number",
+            )
+
+        col_limit = 35
+        grouped = (
+            Query.from_(self.view)
+            .groupby(*key_cols, pivot_col)
+            .select(
+                *key_cols,
+                pivot_col,
+                _agg_funcs[agg_func](Field(agg_col)).as_(_PIVOT_VALUE),
+            )
+        )
+        # too many values are refused before anything is aggregated
+        first_pivot = (self.query_key, pivot_col) not in _pivot_domains
+        pivot_vals = self._pivot_domain(pivot_col, col_limit)
+        if len(pivot_vals) > col_limit:
             raise HTTPException(
                 status_code=400,
                 detail=(
@@ -592,19 +1790,35 @@ class Table:
                     f" {col_limit} unique values"
                 ),
             )
-        pivot_vals = [row[0] for row in rows]
 
-        # handling NULL in pivot_vals
-        cases = [
-            Max(Case().when(Field(pivot_col) == val, Field(agg_col))).as_(
-                ("NaN" if val is None else val)
-            )
-            for val in pivot_vals
-        ]
-        res = (
-            Query.from_(self.view).groupby(*key_cols).select(*key_cols, *cases)
+        res = Table(
+            view=_reshape(grouped, key_cols, pivot_col, pivot_vals, agg_func),
+            source=self,
+            desc="piv",
+            kind="pivot",
         )
-        return Table(view=res, source=self, desc="piv")
+        grouped_rows = None
+        if first_pivot:
+            grouped_rows = self._read_arrow(
+                grouped, materializer.tables.max_bytes
+            )
+        if grouped_rows is not None:
+            reshaped = _reshape(
+                QueryTable("_pivot_rows"),
+                key_cols,
+                pivot_col,
+                pivot_vals,
+                agg_func,
+            )
+            with in_memory_conn() as conn:
+                conn.register("_pivot_rows", grouped_rows)
+                try:
+                    conn.execute(reshaped.get_sql())
+                    rows = conn.fetch_arrow_table()
+                finally:
+                    conn.unregister("_pivot_rows")
+            materializer.store(res, rows)
+        return res
 
     def open_column_table(self) -> "MemoryTable":
         name: str = self.name or self.uid
@@ -625,7 +1839,15 @@ class Table:
         operation: OperationsType,
     ) -> "Table":
         if isinstance(operation, FreqOperation):
-            return self.frequency(operation.cols)
+            approx = operation.approx
+            if approx is not True and not governor.allows(
+                "f", self._scanned_rows()
+            ):
+                if approx is False:
+                    governor.admit("f", self._scanned_rows())
+                # too big to count exactly, so sample instead
+                approx = True
+            return self.frequency(operation.cols, approx=approx)
 
         if isinstance(operation, FilterOperation):
             filters = operation.filters
@@ -642,11 +1864,16 @@ class Table:
             return res
 
         if isinstance(operation, PivotOperation):
+            governor.admit("pivot", self._scanned_rows())
             return self.pivot(
-                operation.key_cols, operation.pivot_col, operation.agg_col
+                operation.key_cols,
+                operation.pivot_col,
+                operation.agg_col,
+                operation.agg_func,
             )
 
         if isinstance(operation, RegexSearchOperation):
+            governor.admit("search", self._scanned_rows())
             return self.filter_regex(
                 column=operation.col,
                 regex=operation.regex,
@@ -678,25 +1905,123 @@ class Table:
             detail=f"Unsupported operation",
         )
 
-    def iter_csv(self):
-        return _execute_query_csv_stream(
-            self.get_db_connection(), self.view, self.all_query_params()
-        )
+    def iter_file(self, file_type: FileType = "csv") -> Iterator[bytes]:
+        # a streamed response is resumed on arbitrary threads and holds its
+        # cursor until the client has read it all, so it gets one of its
+        # own rather than keeping a pooled cursor from other queries
+        if self.dbtype == "disk":
+            cursor = disk_pool.dedicated
+        else:
+            cursor = in_memory_conn
+        with cursor() as conn:
+            yield from _execute_query_stream(
+                conn, self.view, self.all_query_params(), file_type, self
+            )
 
 
 @dataclass(kw_only=True, eq=False)
 class FreqTable(Table):
     key_cols: List[str]
+    # whether `num_rows` adds up to the number of rows in `source`
+    # i.e. the frequency table hasn't been filtered
+    sums_to_source: bool = False
+    # size of the sample the counts were estimated from, if they were
+    sample_rows: Optional[int] = None
+    distinct_estimate: Optional[int] = None
+    # its rows are grouped by `key_cols`
+    kind: Optional[str] = "f"
 
     def __post_init__(self):
+        # number of rows in `source` for each facet seen on a page
+        self._facet_counts: Dict[frozenset, int] = {}
         super().__post_init__()
-        col_names = [c.name for c in self.columns]
+        if self.schema is None:
+            return
+        col_names = [c.name for c in self.schema]
         self.wrapped_col_indices = (
             [col_names.index("percentage")]
             if "percentage" in col_names
             else []
         )
 
+    @property
+    def is_approx(self) -> bool:
+        return self.sample_rows is not None
+
+    @property
+    def _estimate_fields(self) -> Dict[str, Any]:
+        """
+        Fields that tables derived from this one keep
+        """
+        return dict(
+            sample_rows=self.sample_rows,
+            distinct_estimate=self.distinct_estimate,
+        )
+
+    def _from_materialized_source(self) -> Optional["FreqTable"]:
+        """
+        The same table counted from the materialized rows of the source,
+        unless this table is materialized itself, or isn't a plain count
+        of the source's rows (e.g. it's been filtered, or is estimated)
+        """
+        if self.source is None or self.is_approx:
+            return None
+        if materializer.get(self.query_key) is not None:
+            return None
+        name = materializer.get(self.source.query_key)
+        if name is None:
+            return None
+        view = _frequency_query(self.source.view, self.key_cols)
+        if _FLATTEN_QUERIES:
+            view = flatten(view)
+        if view.get_sql() != self.view.get_sql():
+            return None
+        return FreqTable(
+            view=_frequency_query(
+                Query.from_(name).select("*"), self.key_cols
+            ),
+            key_cols=self.key_cols,
+            source=None,
+            dbtype="memory",
+            schema=self.schema,
+        )
+
+    def _fetch_page(self, offset: int, limit: int) -> Tuple[List, List]:
+        rebased = self._from_materialized_source()
+        if rebased is not None:
+            try:
+                return rebased._fetch_page(offset, limit)
+            except duckdb.CatalogException:
+                # the source was evicted since it was looked up
+                pass
+        return super()._fetch_page(offset, limit)
+
+    def _seek(self, after: str, limit: int) -> Tuple[List, List]:
+        rebased = self._from_materialized_source()
+        if rebased is not None:
+            try:
+                return rebased._seek(after, limit)
+            except duckdb.CatalogException:
+                pass
+        return super()._seek(after, limit)
+
+    def _count(self, limit: Optional[int] = None) -> int:
+        rebased = self._from_materialized_source()
+        if rebased is not None:
+            try:
+                return rebased._count(limit)
+            except duckdb.CatalogException:
+                pass
+        return super()._count(limit)
+
+    def exact(self) -> "FreqTable":
+        """
+        The frequency table this one estimates, computed exactly
+        """
+        if self.source is None:
+            raise ValueError("source cannot be None for freq table")
+        return self.source.frequency(self.key_cols, approx=False)
+
     def check_for_key_cols(self, cols: List[str]):
         """
         checks whether `cols` contains all the self.key_cols
@@ -717,7 +2042,38 @@ class FreqTable(Table):
         """
         if self.source is None:
             raise ValueError("source cannot be None for freq table")
-        return self.source.filter_exact(filters, cols_to_return=None)
+        res = self.source.filter_exact(filters, cols_to_return=None)
+        num_rows = self._facet_counts.get(frozenset(filters))
+        if num_rows is not None:
+            res._store_len(num_rows)
+        return res
+
+    def _on_rows_fetched(
+        self, rows: List, columns: List[str], offset: int, limit: int
+    ):
+        super()._on_rows_fetched(rows, columns, offset, limit)
+        if "num_rows" not in columns or self.is_approx:
+            return
+        num_rows_idx = columns.index("num_rows")
+        key_indices = [
+            (col, columns.index(col))
+            for col in self.key_cols
+            if col in columns
+        ]
+        if len(key_indices) < len(self.key_cols):
+            return
+
+        # facet filters hold values as they are rendered in the page
+        for row in rows:
+            facet = frozenset(
+                (col, None if row[idx] is None else str(row[idx]))
+                for col, idx in key_indices
+            )
+            self._facet_counts[facet] = row[num_rows_idx]
+
+        seen_all = offset == 0 and len(rows) < limit
+        if self.sums_to_source and seen_all and self.source is not None:
+            self.source._store_len(sum(row[num_rows_idx] for row in rows))
 
     def filter_exact(
         self,
@@ -733,7 +2089,12 @@ class FreqTable(Table):
             self.check_for_key_cols(cols_to_return)
         res = self._filter_exact(self.view, filters, cols_to_return)
         return FreqTable(
-            view=res, key_cols=self.key_cols, source=self.source, desc="ffil"
+            view=res,
+            key_cols=self.key_cols,
+            source=self.source,
+            desc="ffil",
+            schema=self._projected_schema(cols_to_return),
+            **self._estimate_fields,
         )
 
     def filter_except(
@@ -749,19 +2110,26 @@ class FreqTable(Table):
             self.check_for_key_cols(cols_to_return)
         res = self._filter_except(self.view, filters, cols_to_return)
         return FreqTable(
-            view=res, key_cols=self.key_cols, source=self.source, desc="ffil"
+            view=res,
+            key_cols=self.key_cols,
+            source=self.source,
+            desc="ffil",
+            schema=self._projected_schema(cols_to_return),
+            **self._estimate_fields,
         )
 
     def filter_regex(
-        self, column: str, regex: str, *args, **kwargs
+        self, column: str, regex: str, cols_to_return: Optional[List[str]]
     ) -> "FreqTable":
-        res = self._filter_regex(self.view, column, regex, *args, **kwargs)
+        res = self._filter_regex(self.view, column, regex, cols_to_return)
         return FreqTable(
             view=res,
             key_cols=self.key_cols,
             source=self.source,
             query_params=[regex],
             desc="fsearch",
+            schema=self._projected_schema(cols_to_return),
+            **self._estimate_fields,
         )
 
     def sort(self, col_name: str, ascending: bool = True) -> "FreqTable":
@@ -772,6 +2140,10 @@ class FreqTable(Table):
             key_cols=self.key_cols,
             source=self.source,
             query_params=self.query_params,
+            schema=self.columns,
+            count_key=self.count_key or self.query_key,
+            sums_to_source=self.sums_to_source,
+            **self._estimate_fields,
         )
 
     @property
@@ -786,37 +2158,124 @@ class FreqTable(Table):
         if isinstance(operation, FacetOperation):
             return self.facet_search(operation.facets)
 
+        if (
+            isinstance(operation, Operation)
+            and operation.operation_type == "exact"
+        ):
+            if not self.is_approx:
+                return self
+            if self.source is not None:
+                governor.admit("f", self.source._scanned_rows())
+            return self.exact()
+
         return super().run_op(operation)
 
 
+_memory_tables_lock = threading.Lock()
+# live MemoryTable objects reading each in-memory table, which is dropped
+# once none are left. Finalizers may run on any thread, even one holding
+# a lock, so they only queue the name, and the count is taken down (and
+# the table dropped) the next time a memory table is created
+_memory_table_objects: Dict[str, int] = {}
+_released_memory_tables: List[str] = []
+
+
+def _memory_table_name(name: str, cols: List[str], rows: List) -> str:
+    """
+    Name of the in-memory table holding `rows`. Tables are never replaced:
+    new contents get a new table (and with it a new uid), so a table being
+    read is never changed or dropped under the reader
+    """
+    contents = json.dumps([cols, rows], default=str).encode("utf-8")
+    return f"{name}_{hashlib.md5(contents).hexdigest()[:12]}"
+
+
+def _create_memory_table(table_name: str, cols: List[str], rows: List):
+    """
+    Creates a table of VARCHAR columns in the in-memory database, unless
+    one with the same contents exists already
+    """
+    # a table is only read once it's been created here, so readers
+    # don't need the lock, only writers creating the same table do
+    with _memory_tables_lock, in_memory_conn() as conn:
+        conn.execute(
+            "SELECT count(*) FROM information_schema.tables"
+            " WHERE table_name = ?",
+            [table_name],
+        )
+        if conn.fetchone()[0]:
+            return
+        col_str = ", ".join([f"{col} VARCHAR" for col in cols])
+        # insert rows into db
+        conn.begin()
+        conn.execute(f'CREATE TABLE "{table_name}" ({col_str});')
+        num_cols = len(cols)
+        conn.executemany(
+            f"""INSERT INTO "{table_name}" VALUES"""
+            f" ({','.join(['?'] * num_cols)});",
+            rows,
+        )
+        conn.commit()
+
+
+def _drop_released_memory_tables():
+    with _memory_tables_lock:
+        while _released_memory_tables:
+            table_name = _released_memory_tables.pop()
+            num_objects = _memory_table_objects[table_name] - 1
+            if num_objects:
+                _memory_table_objects[table_name] = num_objects
+                continue
+            del _memory_table_objects[table_name]
+            with in_memory_conn() as conn:
+                _drop_table(conn, "memory", table_name)
+
+
+def _retain_memory_table(table: "MemoryTable"):
+    """
+    Creates the in-memory table of `table` unless it exists, and keeps it
+    for as long as `table` (or another object reading it) is alive
+    """
+    _drop_released_memory_tables()
+    table_name = table.table_name
+    with _memory_tables_lock:
+        num_objects = _memory_table_objects.get(table_name, 0)
+        _memory_table_objects[table_name] = num_objects + 1
+    weakref.finalize(table, _released_memory_tables.append, table_name)
+    _create_memory_table(table_name, table.cols, table.rows)
+
+
 @dataclass(kw_only=True, eq=False)
 class MemoryTable(Table):
     cols: List[str] = field(hash=False)
     rows: List = field(hash=False)
+    table_name: str = field(init=False, hash=False)
+
+    def __post_init__(self):
+        self.table_name = _memory_table_name(self.name, self.cols, self.rows)
+        # derived tables hold on to their source, so the rows stay for as
+        # long as anything reads them
+        _retain_memory_table(self)
+        super().__post_init__()
 
     @classmethod
     def from_records(cls, name: str, cols: List[str], rows: List, **kwargs):
         """
         The name should be unique
-        If a table with same name is created again, it overwrites the previous
+        If a table with same name is created again, the name refers to the
+        new one from then on, while the previous one is left as it was
+        for as long as it's read
         """
-        conn = get_in_memory_conn()
-        col_str = ", ".join([f"{col} VARCHAR" for col in cols])
-        # insert rows into db
-        conn.execute(f"CREATE OR REPLACE TABLE {name} ({col_str});")
-        num_cols = len(cols)
-        conn.executemany(
-            f"INSERT INTO {name} VALUES ({','.join(['?'] * num_cols)});", rows
-        )
-
+        table_name = _memory_table_name(name, cols, rows)
         return cls(
             name=name,
             cols=cols,
             rows=rows,
-            view=Query.from_(name).select("*"),
+            view=Query.from_(table_name).select("*"),
             source=None,
             desc=name,
             dbtype="memory",
+            schema=[Column(name=col, type=ColType.STRING) for col in cols],
             **kwargs,
         )
 
@@ -824,15 +2283,20 @@ class MemoryTable(Table):
 @dataclass(kw_only=True, eq=False)
 class TableOfTables(MemoryTable):
     table_names: List[str]
+    # where each table is, all of them are on disk if not set
+    table_dbtypes: Optional[List[DBType]] = None
 
     def run_op(self, operation: OperationsType) -> "Table":
         if isinstance(operation, OpenOperation):
             table_name = self.table_names[operation.rowid]
+            dbtype = "disk"
+            if self.table_dbtypes is not None:
+                dbtype = self.table_dbtypes[operation.rowid]
             return Table(
                 view=Query.from_(table_name).select("*"),
                 source=self,
                 name=table_name,
-                dbtype="disk",
+                dbtype=dbtype,
             )
 
         return super().run_op(operation)
@@ -844,21 +2308,90 @@ class MarkdownTable(MemoryTable):
         return cls.from_records(name=name, cols=["md"], rows=[(text,)])
 
 
-demo_datasets = load_demo_datasets()
-main_table = TableOfTables.from_records(
-    name="main",
-    cols=["name", "details", "date"],
-    rows=[
-        (dataset["display_name"], dataset["details"], dataset["date"])
-        for dataset in demo_datasets
-    ],
-    table_names=[dataset["table_name"] for dataset in demo_datasets],
-    wrapped_col_indices=[1],
-)
+class LazyCatalog:
+    """
+    Tables that are always available by name, e.g. the list of datasets
+    They are created (and pinned) on first use rather than on import
+    """
+
+    def __init__(self):
+        self.builders: Dict[str, Callable[[], Table]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str):
+        def decorator(builder: Callable[[], Table]) -> Callable[[], Table]:
+            self.builders[name] = builder
+            return builder
+
+        return decorator
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.builders
+
+    def get(self, name: str) -> Table:
+        with self._lock:
+            # another process may have built (or replaced) it already
+            if not table_store.is_bound(name):
+                table = self.builders[name]()
+                table_store.pin(table.uid)
+                return table
+        return Table.load(name)
+
+
+catalog = LazyCatalog()
+
+
+@catalog.register("main")
+def _main_table() -> TableOfTables:
+    demo_datasets = load_demo_datasets()
+    return TableOfTables.from_records(
+        name="main",
+        cols=["name", "details", "date"],
+        rows=[
+            (dataset["display_name"], dataset["details"], dataset["date"])
+            for dataset in demo_datasets
+        ],
+        table_names=[dataset["table_name"] for dataset in demo_datasets],
+        wrapped_col_indices=[1],
+    )
+
+
+_catalog_update_lock = threading.Lock()
+
+
+def register_dataset(
+    table_name: str,
+    display_name: str,
+    details: str,
+    dbtype: DBType = "memory",
+) -> TableOfTables:
+    """
+    Adds a table to the list of datasets, which is replaced by a new
+    version of it
+
+    The table has to be in the database of every process serving the
+    list, so this isn't for tables in memory when there's a shared store
+    """
+    with _catalog_update_lock:
+        main = catalog.get("main")
+        assert isinstance(main, TableOfTables)
+        table_dbtypes = main.table_dbtypes or ["disk"] * len(main.table_names)
+        date = datetime.date.today().isoformat()
+        new_main = TableOfTables.from_records(
+            name="main",
+            cols=main.cols,
+            rows=[*main.rows, (display_name, details, date)],
+            table_names=[*main.table_names, table_name],
+            table_dbtypes=[*table_dbtypes, dbtype],
+            wrapped_col_indices=main.wrapped_col_indices,
+        )
+        table_store.pin(new_main.uid)
+        if main.uid != new_main.uid:
+            table_store.unpin(main.uid)
+        return new_main
+
 
-about_table = MarkdownTable.from_markdown_str(
-    name="about",
-    text="""Tablehub is a tool for sharing and exploring tables
+_ABOUT_TEXT = """Tablehub is a tool for sharing and exploring tables
 
 The UX is heavily inspired by the amazing terminal-tool [Visidata](https://www.visidata.org)
 
@@ -907,5 +2440,58 @@ The keybindings are likely to change to mantain parity with Visidata
 You will need to disable **Vimium** for [Tablehub.io](/tables/about) if you want to make use of the keybindings implemented here.
 
 Navigation experience for you will be slower since vimium disables browsers' backward-forward cache. The only way to get around this is to delete/disable the Vimium plugin entirely.
-    """,
-)
+    """
+
+
+@catalog.register("about")
+def _about_table() -> MarkdownTable:
+    return MarkdownTable.from_markdown_str(name="about", text=_ABOUT_TEXT)
+
+
+_slow_query_cols = [
+    "seconds",
+    "kind",
+    "time",
+    "uid",
+    "lineage",
+    "num_rows",
+    "sql",
+    "params",
+    "profile",
+]
+# the latest slow queries table and the version of the log it shows
+_slow_query_table: Optional[Tuple[int, MemoryTable]] = None
+_slow_query_table_lock = threading.Lock()
+
+
+def slow_queries_table() -> MemoryTable:
+    """
+    The latest slow queries, slowest first
+    """
+    global _slow_query_table
+    version = slow_queries.version
+    with _slow_query_table_lock:
+        if _slow_query_table is not None and _slow_query_table[0] == version:
+            return _slow_query_table[1]
+        rows = [
+            (
+                str(entry["seconds"]),
+                entry["kind"],
+                entry["time"],
+                entry["uid"],
+                " > ".join(entry["lineage"]),
+                None if entry["num_rows"] is None else str(entry["num_rows"]),
+                entry["sql"],
+                json.dumps(entry["params"]),
+                entry["profile"],
+            )
+            for entry in slow_queries.latest()
+        ]
+        table = MemoryTable.from_records(
+            name="slow_queries",
+            cols=_slow_query_cols,
+            rows=rows,
+            wrapped_col_indices=[4, 6, 8],
+        )
+        _slow_query_table = (version, table)
+        return table
@@ -1,6 +1,14 @@
+import os
+import pytest
 from table import Table
 from pypika import Query
 
+# tests on `test_2` and the demo datasets need the database, which is
+# fetched from object storage rather than kept in the repository
+needs_database = pytest.mark.skipif(
+    not os.path.isfile("vow.db"), reason="vow.db hasn't been fetched"
+)
+
 
 def load_test_table():
     return Table(
@@ -20,6 +28,1337 @@ def test_create_table():
     )
 
 
+@needs_database
 def test_table_num_rows():
     table = load_test_table()
     assert len(table) == 63160
+
+
+def test_pool_reuses_cursor_within_thread(tmp_path):
+    import duckdb
+    import threading
+    from pool import ConnectionPool
+
+    path = str(tmp_path / "pool.db")
+    duckdb.connect(path).close()
+    pool = ConnectionPool(path, size=1, timeout=5)
+
+    with pool.connection() as outer:
+        with pool.connection() as inner:
+            assert inner is outer
+
+    # the single cursor has to be returned before another thread gets it
+    seen = []
+
+    def worker():
+        with pool.connection() as conn:
+            seen.append(conn.execute("SELECT 42").fetchall()[0][0])
+
+    with pool.connection():
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join(timeout=0.2)
+        assert thread.is_alive()
+    thread.join()
+
+    assert seen == [42]
+    stats = pool.stats()
+    assert stats["waits"] == 1
+    assert stats["idle"] == 1
+    assert pool.health_check()
+
+
+@needs_database
+def test_downloads_use_dedicated_cursors(tmp_path, monkeypatch):
+    import duckdb
+    import threading
+    from fastapi.testclient import TestClient
+    from app import app
+    from pool import ConnectionPool, PoolTimeout
+    from table import disk_pool
+
+    path = str(tmp_path / "pool.db")
+    duckdb.connect(path).close()
+    pool = ConnectionPool(path, size=1, timeout=0.1, max_dedicated=1)
+
+    # a held download cursor leaves the pooled one to other queries
+    with pool.dedicated() as download:
+        with pool.connection() as conn:
+            assert conn is not download
+        assert pool.stats()["dedicated"] == 1
+        with pytest.raises(PoolTimeout):
+            with pool.dedicated():
+                pass
+    assert pool.stats()["dedicated"] == 0
+    assert pool.stats()["idle"] == 1
+
+    # and a download that can't get one is refused before it starts
+    table = load_test_table()
+    monkeypatch.setattr(disk_pool, "timeout", 0.1)
+    monkeypatch.setattr(disk_pool, "_dedicated", threading.Semaphore(0))
+    response = TestClient(app).get(f"/downloads/{table.uid}")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+
+def test_bounded_cache_evicts_unpinned_lru():
+    from cache import BoundedCache
+
+    cache = BoundedCache(max_bytes=10)
+    cache.put("pinned", 0, size=4, pinned=True)
+    cache.put("a", 1, size=3)
+    cache.put("b", 2, size=3)
+    assert cache.get("a") == 1
+    cache.put("c", 3, size=3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("pinned") == 0
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["bytes"] == 10
+
+
+@needs_database
+def test_evicted_table_is_recreated_from_recipe():
+    from table import table_store
+
+    table = load_test_table()
+    filtered = table.filter_exact([("grp", "1")], cols_to_return=None)
+    table_store.in_memory_db.pop(filtered.uid)
+    table_store.in_memory_db.pop(table.uid)
+
+    reloaded = Table.load(filtered.uid)
+    assert reloaded is not filtered
+    assert reloaded.uid == filtered.uid
+    assert reloaded.source.uid == table.uid
+    assert Table.load("testtable").uid == table.uid
+
+
+@needs_database
+def test_uid_does_not_depend_on_table_history():
+    from table import table_store
+
+    table = load_test_table()
+    len(table)
+    freq_uid = table.frequency(["grp"]).uid
+
+    table_store.in_memory_db.pop(table.uid)
+    reloaded = Table.load(table.uid)
+    assert reloaded.frequency(["grp"]).uid == freq_uid
+
+
+@needs_database
+def test_operation_chains_are_flattened():
+    from table import page_cache
+
+    table = load_test_table()
+    chained = (
+        table.filter_regex("name", "_1", None)
+        .sort("id", False)
+        .filter_exact([("grp", "3")], ["id", "name"])
+        .sort("name", True)
+    )
+    sql = chained.view.get_sql()
+    assert sql.count("SELECT") == 1
+    assert sql.count("ORDER BY") == 1
+
+    # the same query reached without the intermediate sort shares its rows,
+    # but it's a different table, with a different lineage
+    reordered = table.filter_regex("name", "_1", None).filter_exact(
+        [("grp", "3")], ["id", "name"]
+    )
+    resorted = reordered.sort("name", True)
+    assert resorted.query_key == chained.query_key
+    assert resorted.uid != chained.uid
+    hits = page_cache.hits
+    assert chained[0:50] == resorted[0:50]
+    assert page_cache.hits == hits + 1
+
+    # neither is the same as the sort of the filter
+    filtered = table.filter_exact([("grp", "3")], None)
+    sorted_first = table.sort("amount").filter_exact([("grp", "3")], None)
+    filtered_first = filtered.sort("amount")
+    assert sorted_first.query_key == filtered_first.query_key
+    assert sorted_first.uid != filtered_first.uid
+    assert Table.load(filtered_first.uid).lineage[-2].uid == table.uid
+
+
+def test_derived_tables_do_not_replace_their_source():
+    from table import FilterOperation, TableOfTables, table_store
+
+    main = Table.load("main")
+    filtered = main.run_op(FilterOperation(filters=[], columns_to_return=None))
+    assert filtered.uid != main.uid
+    assert isinstance(Table.load(main.uid), TableOfTables)
+
+    table_store.in_memory_db.pop(filtered.uid)
+    assert Table.load(filtered.uid).source.uid == main.uid
+
+
+@needs_database
+def test_derived_schemas_need_no_query(monkeypatch):
+    import table as table_module
+
+    table = load_test_table()
+    columns = table.columns
+
+    def fail(*args, **kwargs):
+        raise AssertionError("schema should not be inferred")
+
+    monkeypatch.setattr(table_module, "_get_schema_for_view", fail)
+
+    assert table.sort("amount", ascending=False).columns == columns
+    searched = table.filter_regex("name", "_1$", cols_to_return=["name"])
+    assert [c.name for c in searched.columns] == ["name"]
+    freq = table.frequency(["grp"])
+    assert freq.wrapped_col_indices == [2]
+    assert freq.schema is None
+    assert Table.load(freq.uid).schema is None
+
+
+@needs_database
+def test_deriving_tables_runs_no_query(monkeypatch):
+    import table as table_module
+
+    def fail(*args, **kwargs):
+        raise AssertionError("nothing should be queried")
+
+    monkeypatch.setattr(table_module, "_execute_query", fail)
+
+    # e.g. a table's truth value is its number of rows
+    table = load_test_table().filter_exact([("grp", "4")], ["id", "grp"])
+    sorted_table = table.sort("id", ascending=False)
+    assert Table.load(sorted_table.uid).uid == sorted_table.uid
+
+
+@needs_database
+def test_row_counts_are_cached_and_derived(monkeypatch):
+    import table as table_module
+
+    table = load_test_table()
+    filtered = table.filter_exact([("grp", "1")], cols_to_return=None)
+    num_rows = len(filtered)
+    freq = table.frequency(["grp"])
+    freq[0:25]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("rows should not be counted")
+
+    monkeypatch.setattr(Table, "_count", fail)
+
+    assert len(filtered) == num_rows
+    assert len(filtered.sort("amount", ascending=False)) == num_rows
+    # the whole freq table fits on a page, so its rows add up to the source
+    assert len(table) == 63160
+    # and each of its rows is the count of a facet
+    assert len(freq.facet_search([("grp", "1")])) == num_rows
+    assert table_module.table_store.get_count(filtered.query_key) == num_rows
+
+
+@needs_database
+def test_estimated_row_count(monkeypatch):
+    import table as table_module
+
+    monkeypatch.setattr(table_module, "_ESTIMATED_COUNTS", True)
+    monkeypatch.setattr(table_module, "_COUNT_PROBE_ROWS", 1000)
+
+    table = load_test_table().filter_regex("name", "_9", cols_to_return=None)
+    table_module.table_store.counts.pop(table.query_key, None)
+    num_rows, is_exact = table.estimated_len()
+    assert (num_rows, is_exact) == (1000, False)
+
+    future = table_module._in_flight.get(f"len:{table.query_key}")
+    if future is not None:
+        future.result()
+    assert table.estimated_len() == (len(table), True)
+
+
+@needs_database
+def test_approximate_frequency(monkeypatch):
+    import table as table_module
+    from table import Operation
+
+    monkeypatch.setattr(table_module, "_APPROX_FREQ_SAMPLE_ROWS", 20000)
+    table = load_test_table()
+    approx = table.frequency(["grp"], approx=True)
+    assert approx.is_approx
+    assert approx.distinct_estimate == 7
+
+    exact = approx.run_op(Operation(operation_type="exact", params=""))
+    assert not exact.is_approx
+    assert exact.uid == table.frequency(["grp"]).uid
+
+    exact_rows, _ = exact[0:10]
+    counts = {grp: num_rows for grp, num_rows, _ in exact_rows}
+    rows, columns = approx[0:10]
+    assert columns == ["grp", "num_rows", "error", "percentage"]
+    assert len(rows) == 7
+    for grp, num_rows, error, _ in rows:
+        assert abs(num_rows - counts[grp]) <= error
+
+    # small tables aren't sampled
+    assert (
+        not table.filter_exact([("grp", "1")], None)
+        .frequency(["name"], approx=True)
+        .is_approx
+    )
+
+    # whether to sample is told without counting the table
+    def fail(*args, **kwargs):
+        raise AssertionError("the rows should not be counted")
+
+    searched = table.filter_regex("name", "_", None)
+    table_module.table_store.counts.pop(searched.query_key, None)
+    len(table)
+    monkeypatch.setattr(Table, "_count", fail)
+    monkeypatch.setattr(table_module, "_APPROX_FREQ_MIN_ROWS", 50000)
+    assert searched.frequency(["grp"]).is_approx
+    assert len(searched) == len(table)
+
+
+@needs_database
+def test_pivot_groups_its_source_once(monkeypatch):
+    import table as table_module
+    from fastapi import HTTPException
+
+    queries = []
+    execute = table_module._execute_query
+
+    def _execute_query(conn, view, query_params=None):
+        queries.append(view)
+        return execute(conn, view, query_params)
+
+    monkeypatch.setattr(table_module, "_execute_query", _execute_query)
+
+    # only the values of the pivot column are queried for, the grouping
+    # query isn't run through `_execute_query`, and the first page is read
+    # from its reshaped rows
+    table = load_test_table().filter_regex("name", "_1$", None)
+    first = table.pivot(["name"], "grp", "amount", "sum")
+    rows, columns = first[0:1]
+    assert columns == ["name", "0", "1", "2", "3", "4", "5", "6"]
+    scans = [query.get_sql() for query in queries]
+    scans = [sql for sql in scans if "test_2" in sql]
+    assert len(scans) == 1 and "DISTINCT" in scans[0]
+
+    # which match the rows of its view
+    table_module.materializer.tables.pop(first.query_key)
+    table_module.page_cache.clear()
+    assert first[0:1] == (rows, columns)
+
+    # a different aggregation of the same column needs only one query
+    queries.clear()
+    counts, _ = table.pivot(["name"], "grp", "amount", "count")[0:1]
+    assert len(queries) == 1
+    assert counts == [("name_1", 18, 19, 18, 18, 18, 18, 18)]
+
+    with pytest.raises(HTTPException) as excinfo:
+        table.pivot(["grp"], "name", "name", "avg")
+    assert excinfo.value.status_code == 400
+
+    # too many values are refused before the rows are grouped
+    def _read_arrow(*args):
+        raise AssertionError("grouped a pivot with too many columns")
+
+    monkeypatch.setattr(Table, "_read_arrow", _read_arrow)
+    with pytest.raises(HTTPException) as excinfo:
+        load_test_table().pivot(["grp"], "id", "name")
+    assert excinfo.value.status_code == 400
+
+
+@needs_database
+def test_regex_search_prefilter(monkeypatch):
+    import table as table_module
+    from plan import required_literal
+
+    assert required_literal("name_1[0-9]$") == "name_1"
+    assert required_literal(r"\d+-(abcd)+x?") == "abcd"
+    assert required_literal("foo|barbaz") is None
+    assert required_literal("(?i)hello") is None
+    assert required_literal("ab.c") is None
+    # POSIX classes, which python's re doesn't have
+    assert required_literal("_[[:digit:]]23") is None
+    assert required_literal("x[[:alpha:]]yz") is None
+    assert required_literal("[[:digit:]]abc") == "abc"
+    assert required_literal(r"\x41bcd") is None
+
+    patterns = [
+        "me_1[0-9]$",
+        "_[[:digit:]]23",
+        "e_[[:digit:]]+3",
+        "[[:alpha:]]e_12",
+        "(?:name)_[[:digit:]]{2}$",
+    ]
+    table = load_test_table()
+    prefiltered = {
+        regex: table.filter_regex("name", regex, None) for regex in patterns
+    }
+    assert "contains" in prefiltered["me_1[0-9]$"].view.get_sql()
+
+    monkeypatch.setattr(table_module, "_REGEX_PREFILTER", False)
+    for regex in patterns:
+        plain = table.filter_regex("name", regex, None)
+        assert "contains" not in plain.view.get_sql()
+        assert len(plain) == len(prefiltered[regex]) > 0, regex
+        assert plain[0:300] == prefiltered[regex][0:300]
+
+
+@needs_database
+def test_cancelled_scope_stops_queries(monkeypatch):
+    import contextvars
+    import pytest
+    import table as table_module
+    from fastapi import HTTPException
+    from cancel import CancelScope, current_scope
+
+    monkeypatch.setattr(table_module, "_EXPORT_BATCH_ROWS", 1000)
+    table = load_test_table().filter_exact([("grp", "4")], None)
+    scope = CancelScope()
+    ctx = contextvars.copy_context()
+    ctx.run(current_scope.set, scope)
+
+    chunks = ctx.run(table.iter_file, "csv")
+    assert ctx.run(next, chunks)
+    scope.cancel()
+    with pytest.raises(HTTPException) as exc_info:
+        ctx.run(lambda: list(chunks))
+    assert exc_info.value.status_code == 499
+
+    with pytest.raises(HTTPException):
+        ctx.run(table._count)
+    # queries outside of the scope are unaffected
+    assert table._count() == 9023
+
+
+@needs_database
+def test_page_views_are_not_queued_behind_operations(monkeypatch):
+    import threading
+    import app as app_module
+    from fastapi.testclient import TestClient
+
+    table = load_test_table().filter_exact([("grp", "0")], ["id"])
+    release = threading.Event()
+    executor = app_module.query_executor
+    busy = [
+        executor.submit(release.wait, 10) for _ in range(executor._max_workers)
+    ]
+    try:
+        response = TestClient(app_module.app).get(f"/tables/{table.uid}")
+        assert response.status_code == 200
+        assert not any(future.done() for future in busy)
+    finally:
+        release.set()
+
+    # whereas the first render of a frequency table runs its GROUP BY, as
+    # an operation, and later ones read cached rows
+    threads = []
+    render = app_module._render_page
+
+    def recording_render(*args):
+        threads.append(threading.current_thread().name)
+        return render(*args)
+
+    monkeypatch.setattr(app_module, "_render_page", recording_render)
+    freq = table.frequency(["id"], approx=False)
+    client = TestClient(app_module.app)
+    for _ in range(2):
+        assert client.get(f"/tables/{freq.uid}").status_code == 200
+    assert threads[0].startswith("vow-query")
+    assert threads[1].startswith("vow-page")
+
+
+@needs_database
+def test_timed_out_queries_count_until_they_finish(monkeypatch):
+    import time
+    import app as app_module
+    from fastapi.testclient import TestClient
+    from governor import governor
+
+    table = load_test_table().filter_exact([("grp", "1")], ["name"])
+    render = app_module._render_page
+
+    def slow_render(*args):
+        time.sleep(0.5)
+        return render(*args)
+
+    monkeypatch.setattr(governor, "max_running", {"page": 1})
+    monkeypatch.setattr(governor, "timeouts", {"page": 0.1})
+    monkeypatch.setattr(app_module, "_render_page", slow_render)
+    client = TestClient(app_module.app)
+
+    response = client.get(f"/tables/{table.uid}")
+    assert response.status_code == 503
+    assert "too long" in response.json()["detail"]
+    # the render is still running, so nothing else is let in
+    response = client.get(f"/tables/{table.uid}")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+    assert governor.stats()["page"] == 1
+
+    time.sleep(0.5)
+    monkeypatch.setattr(app_module, "_render_page", render)
+    assert client.get(f"/tables/{table.uid}").status_code == 200
+    assert governor.stats()["page"] == 0
+
+
+@needs_database
+def test_first_render_of_an_operation_is_governed_as_it(monkeypatch):
+    import time
+    import app as app_module
+    from fastapi.testclient import TestClient
+    from governor import governor
+
+    table = load_test_table().filter_exact([("grp", "2")], None)
+    response = TestClient(app_module.app).post(
+        f"/tables/{table.uid}",
+        json={"operation_type": "f", "cols": ["name"], "approx": False},
+    )
+    freq_uid = response.json()["new_table"]
+    render = app_module._render_page
+
+    def slow_render(*args):
+        time.sleep(0.5)
+        return render(*args)
+
+    monkeypatch.setattr(governor, "max_running", {"f": 1})
+    monkeypatch.setattr(governor, "timeouts", {"f": 0.1})
+    monkeypatch.setattr(app_module, "_render_page", slow_render)
+    client = TestClient(app_module.app)
+
+    # the GROUP BY runs on the first render, under the limits of "f"
+    response = client.get(f"/tables/{freq_uid}")
+    assert response.status_code == 503
+    assert "too long" in response.json()["detail"]
+    assert client.get(f"/tables/{freq_uid}").status_code == 503
+    assert governor.stats()["f"] == 1
+
+    time.sleep(0.5)
+    monkeypatch.setattr(app_module, "_render_page", render)
+    assert client.get(f"/tables/{freq_uid}").status_code == 200
+    assert governor.stats()["f"] == 0
+
+
+@needs_database
+def test_governor_limits_expensive_operations(monkeypatch):
+    import time
+    import pytest
+    import table as table_module
+    from fastapi import HTTPException
+    from cancel import CancelScope
+    from governor import governor
+    from table import FreqOperation, RegexSearchOperation
+
+    monkeypatch.setattr(table_module, "_APPROX_FREQ_SAMPLE_ROWS", 20000)
+    monkeypatch.setattr(governor, "max_rows", {"f": 50000, "search": 50000})
+    table = load_test_table()
+
+    # too big to count exactly, so it falls back to sampling
+    freq = table.run_op(FreqOperation(cols=["grp"]))
+    assert freq.is_approx
+    with pytest.raises(HTTPException) as exc_info:
+        table.run_op(FreqOperation(cols=["grp"], approx=False))
+    assert exc_info.value.status_code == 400
+    with pytest.raises(HTTPException):
+        table.run_op(RegexSearchOperation(col="name", regex="_1"))
+
+    scope = CancelScope(timeout=0.01)
+    time.sleep(0.02)
+    with pytest.raises(HTTPException) as exc_info:
+        scope.check()
+    assert exc_info.value.status_code == 503
+
+
+def test_fast_html_rows_match_yattag_rows():
+    from table import MarkdownTable
+    from view import html_rows
+    from benchmarks.bench_render import generated_rows, html_rows_doc
+
+    for num_rows in [0, 1, 25]:
+        table, rows = generated_rows(num_rows, 50)
+        assert html_rows(table, rows) == html_rows_doc(table, rows)
+
+    markdown_table = MarkdownTable.from_markdown_str("render_md", "# hi *")
+    rows, _ = markdown_table[0:1]
+    assert html_rows(markdown_table, rows) == html_rows_doc(
+        markdown_table, rows
+    )
+
+
+@needs_database
+def test_pages_are_shared_between_table_objects():
+    from table import page_cache, table_store
+
+    table = load_test_table().sort("id", ascending=False)
+    rows, _ = table[25:50]
+    table_store.in_memory_db.pop(table.uid)
+    reloaded = Table.load(table.uid)
+    assert reloaded is not table
+
+    hits = page_cache.hits
+    assert reloaded[25:50][0] == rows
+    assert page_cache.hits == hits + 1
+    assert rows[0][0] == 63160 - 26
+
+
+@needs_database
+def test_prefetch_fills_page_cache():
+    import table as table_module
+
+    table = load_test_table().filter_exact([("grp", "2")], None)
+    table.prefetch(slice(25, 50))
+    future = table_module._in_flight.get(f"page:{table.query_key}:25:25")
+    if future is not None:
+        future.result()
+    assert (table.query_key, 25, 25) in table_module.page_cache
+
+
+@needs_database
+def test_hot_tables_are_materialized(monkeypatch):
+    import table as table_module
+
+    materializer = table_module.Materializer(
+        max_bytes=2**30, min_hits=2, min_seconds=60
+    )
+    monkeypatch.setattr(table_module, "materializer", materializer)
+
+    table = load_test_table().filter_regex("name", "_3", None)
+    table = table.sort("amount", False)
+    expected = table[100:150]
+
+    table_module.page_cache.pop((table.query_key, 100, 50))
+    table[100:150]
+    future = table_module._in_flight.get(f"materialize:{table.query_key}")
+    if future is not None:
+        future.result()
+    name = materializer.get(table.query_key)
+    assert name is not None
+
+    table_module.page_cache.pop((table.query_key, 100, 50))
+    assert table[100:150] == expected
+
+    # so are counts, and frequency tables of it
+    freq = table.frequency(["grp"], approx=False)
+    counted_sql = []
+    execute_query = table_module._execute_query
+
+    def _execute_query(conn, view, query_params=None):
+        counted_sql.append(view.get_sql())
+        return execute_query(conn, view, query_params)
+
+    monkeypatch.setattr(table_module, "_execute_query", _execute_query)
+    assert table._count() == len(table)
+    freq_rows, _ = freq[0:10]
+    assert freq._count() == 7
+    assert len(counted_sql) == 3
+    assert all(name in sql for sql in counted_sql)
+    monkeypatch.setattr(table_module, "_execute_query", execute_query)
+
+    # reads fall back to the view once the table is evicted
+    materializer.tables.max_bytes = 0
+    materializer.tables.put("other", "other", size=1)
+    assert materializer.get(table.query_key) is None
+    table_module.page_cache.pop((table.query_key, 100, 50))
+    assert table[100:150] == expected
+    table_module.page_cache.pop((freq.query_key, 0, 10))
+    assert freq[0:10] == (freq_rows, ["grp", "num_rows", "percentage"])
+
+
+def test_keyset_pages_match_offset_pages():
+    from table import MemoryTable
+
+    records = [
+        (str(i % 7) if i % 5 else None, str(i % 3), str(i)) for i in range(300)
+    ]
+    table = MemoryTable.from_records(
+        name="keyset", cols=["key", "other", "idx"], rows=records
+    )
+    for ascending in [True, False]:
+        # lots of ties, and NULLs that go last
+        sorted_table = table.sort("key", ascending)
+        all_rows, columns = sorted_table[0:300]
+        keys = [row[0] for row in all_rows if row[0] is not None]
+        assert keys == sorted(keys, reverse=not ascending)
+        assert all_rows[-1][0] is None
+
+        rows, after = [], None
+        while True:
+            page, _ = (
+                sorted_table[len(rows) : len(rows) + 40]
+                if after is None
+                else sorted_table.seek(after, 40)
+            )
+            rows.extend(page)
+            if len(page) < 40:
+                break
+            after = sorted_table.page_token(page, columns, after)
+        assert rows == all_rows
+
+        # pages near the end are read backwards
+        len(sorted_table)
+        assert sorted_table[270:310][0] == all_rows[-30:]
+
+
+def test_keyset_pages_with_duplicate_column_names():
+    from pypika import Field, Query
+    from table import MemoryTable
+
+    records = [(str(i % 20), str(i % 3), str(i)) for i in range(200)]
+    table = MemoryTable.from_records(
+        name="duplicates", cols=["key", "a", "b"], rows=records
+    )
+    duplicates = Table(
+        view=Query.from_(table.view).select(
+            Field("key"), Field("a").as_("v"), Field("b").as_("v")
+        ),
+        source=table,
+    ).sort("key")
+    all_rows, columns = duplicates[0:200]
+    assert [c.name for c in duplicates.columns] == ["key", "v", "v"]
+
+    rows, after = [], None
+    while True:
+        page, _ = (
+            duplicates[0:30] if after is None else duplicates.seek(after, 30)
+        )
+        rows.extend(page)
+        if len(page) < 30:
+            break
+        after = duplicates.page_token(page, columns, after)
+        assert after is not None
+    assert rows == all_rows
+
+
+@needs_database
+def test_base_table_pages_by_rowid():
+    table = load_test_table()
+    assert table._rowid_table() == "test_2"
+    rows, _ = table[60000:60003]
+    assert [row[0] for row in rows] == [60000, 60001, 60002]
+
+
+@needs_database
+def test_csv_export_streams_batches_and_stops(monkeypatch):
+    import csv
+    import table as table_module
+
+    monkeypatch.setattr(table_module, "_EXPORT_BATCH_ROWS", 1000)
+    table = load_test_table().filter_exact([("grp", "4")], ["id", "name"])
+    chunks = list(table.iter_file("csv"))
+    assert len(chunks) > 1
+
+    rows = list(csv.reader(b"".join(chunks).decode("utf-8").splitlines()))
+    assert rows[0] == ["id", "name"]
+    assert rows[1] == ["4", "name_4"]
+    assert len(rows) == len(table) + 1
+
+    empty = load_test_table().filter_exact([("grp", "9")], None)
+    empty_csv = b"".join(empty.iter_file("csv")).decode("utf-8")
+    assert list(csv.reader(empty_csv.splitlines())) == [
+        ["id", "name", "amount", "grp", "d"]
+    ]
+
+
+def test_csv_export_writes_nested_columns_as_text():
+    import csv
+    from table import in_memory_conn
+
+    with in_memory_conn() as conn:
+        conn.execute(
+            "CREATE OR REPLACE TABLE nested_export AS"
+            " SELECT [1, 2] AS l, {'a': 1} AS s, 'x' AS t"
+            " UNION ALL SELECT NULL, NULL, 'y'"
+        )
+    table = Table(
+        view=Query.from_("nested_export").select("*"),
+        source=None,
+        dbtype="memory",
+    )
+    text = b"".join(table.iter_file("csv")).decode("utf-8")
+    assert list(csv.reader(text.splitlines())) == [
+        ["l", "s", "t"],
+        ["[1, 2]", "{'a': 1}", "x"],
+        ["", "", "y"],
+    ]
+
+
+@needs_database
+def test_columnar_exports_round_trip():
+    import io
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = load_test_table().filter_exact([("grp", "5")], ["id", "d"])
+    rows, _ = table[0 : len(table)]
+
+    parquet = pq.read_table(io.BytesIO(b"".join(table.iter_file("parquet"))))
+    arrow = pa.ipc.open_stream(b"".join(table.iter_file("arrow"))).read_all()
+    for result in [parquet, arrow]:
+        assert result.column_names == ["id", "d"]
+        assert list(zip(*result.to_pydict().values())) == rows
+
+
+@needs_database
+def test_rows_endpoint_returns_columns():
+    import io
+    import pyarrow as pa
+    from fastapi.testclient import TestClient
+    from app import app
+
+    table = load_test_table().filter_exact([("grp", "3")], ["id", "name"])
+    rows, _ = table[100:110]
+    client = TestClient(app)
+
+    response = client.get(f"/tables/{table.uid}/rows?offset=100&limit=10")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["columns"] == ["id", "name"]
+    assert body["kinds"] == ["int", "text"]
+    assert list(zip(*body["data"])) == rows
+
+    response = client.get(
+        f"/tables/{table.uid}/rows?offset=100&limit=10&format=arrow"
+    )
+    arrow = pa.ipc.open_stream(io.BytesIO(response.content)).read_all()
+    assert list(zip(*arrow.to_pydict().values())) == rows
+
+    assert client.get("/tables/unknown/rows").status_code == 404
+
+
+@needs_database
+def test_rows_endpoint_follows_page_tokens():
+    from fastapi.testclient import TestClient
+    from app import app
+    from view import html_table
+
+    table = load_test_table().sort("id", False)
+    client = TestClient(app)
+
+    first = client.get(f"/tables/{table.uid}/rows?limit=100").json()
+    assert first["after"] is not None
+    response = client.get(
+        f"/tables/{table.uid}/rows",
+        params={"after": first["after"], "limit": 100},
+    )
+    ids = [row[0] for row in table[100:200][0]]
+    assert response.json()["data"][0] == ids
+
+    # a page reached through a token is only continued through tokens
+    token = table.page_token(*table[0:25])
+    assert f", 0, 0, true, '{token}')" in html_table(table, 0)
+    assert f", 1, null, true, '" in html_table(table, 1, after=token)
+
+
+def test_rows_endpoint_sends_large_ints_as_strings():
+    from pypika import Query
+    from table import in_memory_conn
+    from view import page_columns
+
+    with in_memory_conn() as conn:
+        conn.execute(
+            "CREATE OR REPLACE TABLE large_ints AS"
+            " SELECT * FROM (VALUES (1), (9007199254740993), (NULL)) t(n)"
+        )
+    table = Table(
+        view=Query.from_("large_ints").select("*"),
+        dbtype="memory",
+        source=None,
+    )
+    body = page_columns(table, 0, 10)
+    assert body["kinds"] == ["int"]
+    assert body["data"] == [[1, "9007199254740993", None]]
+
+
+@needs_database
+def test_pages_are_answered_with_304(monkeypatch):
+    import app as app_module
+    from fastapi.testclient import TestClient
+
+    client = TestClient(app_module.app)
+    table = load_test_table().filter_exact([("grp", "6")], ["id", "name"])
+    len(table)
+
+    response = client.get(f"/tables/{table.uid}?page=1")
+    assert response.status_code == 200
+    tag = response.headers["etag"]
+    assert response.headers["cache-control"] == "public, max-age=300"
+    assert client.get(f"/tables/{table.uid}?page=2").headers["etag"] != tag
+
+    # tables with the same rows show different breadcrumbs and links
+    other = (
+        load_test_table()
+        .filter_exact([("grp", "6")], None)
+        .filter_exact([], ["id", "name"])
+    )
+    assert other.query_key == table.query_key
+    len(other)
+    other_tag = client.get(f"/tables/{other.uid}?page=1").headers["etag"]
+    assert other_tag != tag
+
+    # names can be re-bound, so those are revalidated
+    len(Table.load("main"))
+    response = client.get("/tables/main")
+    assert response.headers["cache-control"] == "no-cache"
+    main_tag = response.headers["etag"]
+
+    def fail(*args):
+        raise AssertionError("the page should not be rendered")
+
+    monkeypatch.setattr(app_module, "_render_page", fail)
+    response = client.get(
+        f"/tables/{table.uid}?page=1", headers={"If-None-Match": tag}
+    )
+    assert response.status_code == 304
+    assert response.headers["etag"] == tag
+    response = client.get(
+        "/tables/main", headers={"If-None-Match": f"W/{main_tag}"}
+    )
+    assert response.status_code == 304
+
+    # a new version of the dataset invalidates every tag
+    monkeypatch.setattr(app_module, "DATASET_VERSION", "next")
+    with pytest.raises(AssertionError, match="should not be rendered"):
+        client.get(
+            f"/tables/{table.uid}?page=1", headers={"If-None-Match": tag}
+        )
+
+
+def test_memory_table_etags_are_the_same_in_every_process():
+    import sys
+    import subprocess
+
+    script = """
+from http_cache import etag
+from table import Table
+print(etag("version", Table.load("main"), "html"))
+"""
+    tags = {
+        subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        for _ in range(2)
+    }
+    assert len(tags) == 1
+
+
+def test_database_download_resumes(tmp_path, monkeypatch):
+    import io
+    import utils
+
+    data = bytes(range(256)) * 40
+    etag = '"v1"'
+    requested = []
+    failed = []
+
+    class FakeClient:
+        def head_object(self, Bucket, Key):
+            return {"ContentLength": len(data), "ETag": etag}
+
+        def get_object(self, Bucket, Key, Range, IfMatch):
+            assert IfMatch == etag
+            start, end = map(int, Range.removeprefix("bytes=").split("-"))
+            requested.append(start)
+            if len(requested) == 3 and not failed:
+                failed.append(start)
+                raise ConnectionError("connection reset")
+            return {"Body": io.BytesIO(data[start : end + 1])}
+
+    monkeypatch.setenv("SPACES_BUCKET", "bucket")
+    monkeypatch.setattr(utils, "_s3_client", FakeClient)
+    monkeypatch.setattr(utils, "_CHUNK_BYTES", 1000)
+    monkeypatch.setattr(utils, "_CHUNK_RETRIES", 1)
+
+    fetch = utils.DatabaseFetch(str(tmp_path / "vow.db"))
+    with pytest.raises(ConnectionError):
+        fetch.run()
+    assert fetch.status()["state"] == "failed"
+    assert fetch.done_bytes == 2000
+
+    fetch = utils.DatabaseFetch(str(tmp_path / "vow.db"))
+    fetch.start()
+    assert fetch.wait(10) and fetch.ready
+    # the third chunk failed, and is requested again
+    assert requested == [0, 1000, 2000, *range(2000, len(data), 1000)]
+    assert (tmp_path / "vow.db").read_bytes() == data
+    assert not (tmp_path / "vow.db.part.etag").exists()
+
+    # a partial download of another version, or one that is too big, is
+    # started over
+    (tmp_path / "vow.db").unlink()
+    for part, part_etag in [(b"x" * 1500, '"v0"'), (data + b"x", etag)]:
+        (tmp_path / "vow.db.part").write_bytes(part)
+        (tmp_path / "vow.db.part.etag").write_text(part_etag)
+        requested.clear()
+        fetch = utils.DatabaseFetch(str(tmp_path / "vow.db"))
+        fetch.run()
+        assert requested == list(range(0, len(data), 1000))
+        assert (tmp_path / "vow.db").read_bytes() == data
+        (tmp_path / "vow.db").unlink()
+
+
+def test_lazy_startup_stays_within_import_budget():
+    import os
+    import sys
+    import subprocess
+
+    # the slow third-party imports are the same with or without it
+    script = """
+import time, duckdb, fastapi, pyarrow, pypika, yattag
+start = time.perf_counter()
+import app
+from table import table_store
+print(time.perf_counter() - start, "main" in table_store.aliases)
+"""
+    env = {**os.environ, "VOW_LAZY_STARTUP": "1"}
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        env=env,
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout.split()
+    seconds, catalog_created = float(output[0]), output[1] == "True"
+    budget = float(os.environ.get("VOW_IMPORT_BUDGET_SECONDS", "0.5"))
+    assert seconds < budget
+    assert not catalog_created
+
+
+@needs_database
+def test_health_endpoints_and_lazy_catalog(monkeypatch):
+    import app as app_module
+    from fastapi.testclient import TestClient
+    from utils import database
+
+    client = TestClient(app_module.app)
+    assert client.get("/healthz").status_code == 200
+    assert client.get("/readyz").json()["ready"]
+
+    response = client.get("/tables/about")
+    assert response.status_code == 200
+
+    monkeypatch.setattr(database, "state", "downloading")
+    assert client.get("/readyz").status_code == 503
+    response = client.get(f"/tables/{load_test_table().uid}")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+
+def test_benchmark_suite_runs_at_small_scale():
+    from benchmarks import suite
+
+    results = [r.summary() for r in suite.run_scale(2000, 1, None)]
+    names = {r["benchmark"] for r in results}
+    assert {"op:pivot", "op:facet", "load:chain", "render:freq"} <= names
+    assert all(r["error"] is None and r["min"] > 0 for r in results)
+    assert suite.compare(results, {"results": results}, 1.25) == 0
+
+
+@needs_database
+def test_spans_are_exported_as_metrics():
+    from fastapi.testclient import TestClient
+    from app import app
+
+    client = TestClient(app)
+    table = load_test_table().filter_exact([("grp", "1")], ["id", "name"])
+    response = client.post(
+        f"/tables/{table.uid}",
+        json={"operation_type": "f", "cols": ["name"]},
+    )
+    freq_uid = response.json()["new_table"]
+    response = client.get(
+        f"/tables/{freq_uid}", headers={"server-timing": "1"}
+    )
+    stages = [
+        item.split(";")[0]
+        for item in response.headers["server-timing"].split(", ")
+    ]
+    assert "page_query" in stages and "render" in stages
+
+    text = client.get("/metrics").text
+    assert (
+        'vow_span_seconds_count{stage="run_op",operation="f",'
+        'table_class="Table"} '
+    ) in text
+    # the first render runs the GROUP BY, so it counts as the operation
+    assert (
+        'vow_span_seconds_bucket{stage="render",operation="f",'
+        'table_class="FreqTable",le="+Inf"}'
+    ) in text
+    assert "vow_page_cache_hits " in text
+
+
+@needs_database
+def test_slow_queries_are_logged_with_profiles(tmp_path, monkeypatch):
+    import json
+    import table as table_module
+    from fastapi.testclient import TestClient
+    from app import app
+    from slowlog import SlowQueryLog
+
+    log_path = tmp_path / "slow.jsonl"
+    log = SlowQueryLog(str(log_path), threshold=0.0, profile_rate=1.0)
+    monkeypatch.setattr(table_module, "slow_queries", log)
+
+    table = load_test_table().filter_exact([("grp", "2")], ["id", "name"])
+    table._count()
+    log.flush()
+    entry = json.loads(log_path.read_text().splitlines()[-1])
+    assert entry["uid"] == table.uid
+    assert entry["lineage"] == [str(t) for t in table.lineage]
+    assert entry["num_rows"] == 1 and entry["params"] == []
+    assert "COUNT(*)" in entry["sql"]
+    assert "Total Time" in entry["profile"]
+
+    client = TestClient(app)
+    response = client.get("/slow_queries", follow_redirects=False)
+    uid = response.headers["location"].split("/")[-1]
+    slow_table = Table.load(uid)
+    rows, columns = slow_table[0 : len(slow_table)]
+    assert columns[:2] == ["seconds", "kind"]
+    assert table.uid in [row[3] for row in rows]
+    assert client.get(f"/tables/{uid}").status_code == 200
+
+
+@needs_database
+def test_tables_are_shared_between_processes(tmp_path):
+    import os
+    import sys
+    import json
+    import subprocess
+
+    create = """
+import json
+from pypika import Query
+from table import Table
+base = Table(
+    view=Query.from_("test_2").select("*"), source=None, dbtype="disk"
+)
+table = base.filter_exact([("grp", "3")], ["id", "name"]).sort("id", False)
+columns = table.open_column_table()
+print(json.dumps([table.uid, columns.uid, table[0:3][0], len(table)]))
+"""
+    load = """
+import sys, json
+from table import Table, table_store
+uid, columns_uid = sys.argv[1:]
+table = Table.load(uid)
+columns = Table.load(columns_uid)
+known = table_store.get_count(table.query_key)
+print(json.dumps([table[0:3][0], known, columns[0:2][0]]))
+"""
+    env = {**os.environ, "VOW_STORE_URL": f"sqlite://{tmp_path}/store.db"}
+
+    def run(script, *args):
+        output = subprocess.run(
+            [sys.executable, "-c", script, *args],
+            env=env,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        return json.loads(output)
+
+    uid, columns_uid, rows, num_rows = run(create)
+    loaded_rows, known_num_rows, column_rows = run(load, uid, columns_uid)
+    assert loaded_rows == rows
+    assert known_num_rows == num_rows
+    assert column_rows == [["id", "INT"], ["name", "STRING"]]
+
+
+@needs_database
+def test_memory_tables_are_replaced_without_disturbing_readers():
+    import time
+    import threading
+    from table import MemoryTable, table_store
+
+    def records(version):
+        return [(str(version), str(i)) for i in range(20 + version)]
+
+    MemoryTable.from_records(
+        name="stress", cols=["version", "idx"], rows=records(0)
+    )
+    base = load_test_table().filter_exact([("grp", "5")], ["id", "name"])
+    errors = []
+    stop = threading.Event()
+
+    def run(fn):
+        def loop():
+            try:
+                while not stop.is_set():
+                    fn()
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+        return threading.Thread(target=loop)
+
+    def write():
+        for version in range(1, 16):
+            MemoryTable.from_records(
+                name="stress", cols=["version", "idx"], rows=records(version)
+            )
+        stop.set()
+
+    def read():
+        table = Table.load("stress")
+        rows, _ = table[0:200]
+        version = int(rows[0][0])
+        assert rows == records(version)
+        assert len(table) == len(rows)
+
+    def read_columns():
+        for table in [base, Table.load("stress")]:
+            columns = table.open_column_table()
+            rows, _ = columns[0:10]
+            assert [row[0] for row in rows] == [c.name for c in table.columns]
+
+    def evict():
+        # readers that loaded a table before keep reading it
+        table_store.in_memory_db.clear()
+        time.sleep(0.001)
+
+    threads = [run(read) for _ in range(4)]
+    threads += [run(read_columns) for _ in range(2)]
+    threads.append(run(evict))
+    threads.append(threading.Thread(target=write))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    assert errors == []
+    assert Table.load("stress")[0:1][0] == [("15", "0")]
+
+
+@needs_database
+def test_files_are_ingested_into_the_catalog(tmp_path, monkeypatch):
+    import time
+    import datetime
+    import duckdb
+    import app as app_module
+    from fastapi.testclient import TestClient
+    from table import OpenOperation, TableOfTables, table_store
+    from shared_store import SQLiteBackend
+
+    conn = duckdb.connect()
+    paths = {}
+    for file_format, options in [
+        ("csv", "(HEADER)"),
+        ("parquet", "(FORMAT PARQUET)"),
+        ("json", "(FORMAT JSON)"),
+    ]:
+        paths[file_format] = tmp_path / f"upload.{file_format}"
+        conn.execute(
+            "COPY (SELECT range AS id, 'name_' || range AS name,"
+            " range * 0.25 AS amount, DATE '2023-01-01' + range::INT AS d"
+            f" FROM range(1000)) TO '{paths[file_format]}' {options}"
+        )
+
+    client = TestClient(app_module.app)
+    assert client.post("/ingest?name=x", content=b"").status_code == 404
+    monkeypatch.setattr(app_module, "_INGEST_TOKEN", "secret")
+    assert client.post("/ingest?name=x", content=b"").status_code == 401
+
+    headers = {"Authorization": "Bearer secret"}
+    pinned_main = Table.load("main").uid
+    for file_format, path in paths.items():
+        response = client.post(
+            f"/ingest?name=upload_{file_format}&format={file_format}",
+            content=path.read_bytes(),
+            headers=headers,
+        )
+        assert response.status_code == 202
+        status_url = response.json()["status"]
+        for _ in range(100):
+            status = client.get(status_url, headers=headers).json()
+            if status["state"] not in ("uploading", "loading"):
+                break
+            time.sleep(0.05)
+        assert status["state"] == "done", status["error"]
+        assert status["num_rows"] == 1000
+        assert status["upload_progress"] == 1.0
+
+        table = Table.load(status["table_uid"])
+        assert [c.type for c in table.columns][0] == "INT"
+        assert table.columns[3].type == "DATE"
+
+        main = Table.load("main")
+        assert isinstance(main, TableOfTables)
+        assert main.rows[-1][0] == f"upload_{file_format}"
+        opened = main.run_op(OpenOperation(rowid=len(main.rows) - 1))
+        assert opened.uid == table.uid
+        rows, _ = opened[0:2]
+        assert rows[1] == (1, "name_1", 0.25, datetime.date(2023, 1, 2))
+
+        # only the latest list of datasets is kept around for good
+        assert not table_store.in_memory_db._entries[pinned_main].pinned
+        pinned_main = main.uid
+
+    # other processes couldn't read the uploaded tables
+    monkeypatch.setattr(
+        table_store, "backend", SQLiteBackend(str(tmp_path / "store.db"))
+    )
+    response = client.post(
+        "/ingest?name=shared", content=b"id\n1\n", headers=headers
+    )
+    assert response.status_code == 501
+
+
+def test_memory_tables_are_dropped_once_unread():
+    import gc
+    from table import MemoryTable, in_memory_conn, table_store
+
+    def exists(name):
+        with in_memory_conn() as conn:
+            conn.execute(
+                "SELECT count(*) FROM information_schema.tables"
+                " WHERE table_name = ?",
+                [name],
+            )
+            return conn.fetchone()[0] == 1
+
+    table = MemoryTable.from_records(
+        name="unread", cols=["a", "b"], rows=[("1", "x"), ("2", "y")]
+    )
+    derived = table.filter_exact([("a", "1")], ["a", "b"])
+    uid, table_name = derived.uid, table.table_name
+
+    # evicted tables can still be read by whoever holds them
+    table_store.in_memory_db.clear()
+    assert table[0:25][0] == [("1", "x"), ("2", "y")]
+    del table
+    table_store.in_memory_db.clear()
+    assert derived[0:25][0] == [("1", "x")]
+
+    # the rows are dropped once nothing reads them
+    del derived
+    table_store.in_memory_db.clear()
+    gc.collect()
+    MemoryTable.from_records(name="unread_other", cols=["a"], rows=[])
+    assert not exists(table_name)
+
+    # and created again with a table re-created from its recipe
+    assert Table.load(uid)[0:2][0] == [("1", "x")]
+    assert exists(table_name)
+
+
+def test_catalog_tables_are_bound_by_any_process(tmp_path, monkeypatch):
+    from table import LazyCatalog, MemoryTable, table_store
+    from shared_store import SQLiteBackend
+
+    backend = SQLiteBackend(str(tmp_path / "store.db"))
+    monkeypatch.setattr(table_store, "backend", backend)
+    catalog = LazyCatalog()
+
+    @catalog.register("catalog_test")
+    def build():
+        return MemoryTable.from_records(
+            name="catalog_test", cols=["a"], rows=[("built",)]
+        )
+
+    # a table another process has bound the name to
+    other = MemoryTable.from_records(
+        name="catalog_test_other", cols=["a"], rows=[("other",)]
+    )
+    backend.put("alias", "catalog_test", other.uid.encode("utf-8"))
+    assert catalog.get("catalog_test").uid == other.uid
@@ -1,14 +1,18 @@
 import os
-import boto3
+import time
+import threading
+from typing import Any, Dict, Optional
 
+_CHUNK_BYTES = int(os.environ.get("VOW_DOWNLOAD_CHUNK_MB", "16")) * 2**20
+_CHUNK_RETRIES = 3
 
-def fetch_sample_database():
-    if os.path.isfile("vow.db"):
-        return
 
-    print("Fetching data from object storage...")
+def _s3_client():
+    # boto3 takes a while to import, and is only needed for the download
+    import boto3
+
     session = boto3.session.Session()
-    client = session.client(
+    return session.client(
         "s3",
         endpoint_url=os.environ["SPACES_URL"],
         region_name=os.environ["SPACES_REGION"],
@@ -16,4 +20,156 @@ def fetch_sample_database():
         aws_secret_access_key=os.environ["SPACES_SECRET"],
     )
 
-    client.download_file(os.environ["SPACES_BUCKET"], "vow.db", "vow.db")
+
+class DatabaseFetch:
+    """
+    Fetches the database from object storage, unless it's already there
+
+    The download is written to `<path>.part` in chunks, so that an
+    interrupted download resumes where it stopped, and is only moved to
+    `path` once it's complete. The ETag of the object is kept next to it
+    in `<path>.part.etag`, and a partial download of another version of
+    the object is started over. With VOW_VERIFY_DATABASE=1 an existing
+    file is checked against the size of the object too
+    """
+
+    def __init__(self, path: str, key: str = "vow.db"):
+        self.path = path
+        self.key = key
+        self.state = "pending"
+        self.done_bytes = 0
+        self.total_bytes: Optional[int] = None
+        self.error: Optional[str] = None
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "done_bytes": self.done_bytes,
+            "total_bytes": self.total_bytes,
+            "error": self.error,
+        }
+
+    def run(self) -> None:
+        try:
+            self._fetch()
+        except Exception as e:
+            self.state = "failed"
+            self.error = repr(e)
+            raise
+        else:
+            self.state = "ready"
+        finally:
+            self._done.set()
+
+    def start(self) -> None:
+        """
+        Fetches the database on a background thread
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run_quietly, name="vow-fetch", daemon=True
+            )
+        self._thread.start()
+
+    def _run_quietly(self) -> None:
+        try:
+            self.run()
+        except Exception as e:
+            print(f"Fetching the database failed: {e!r}")
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def _fetch(self) -> None:
+        verify = os.environ.get("VOW_VERIFY_DATABASE") == "1"
+        if os.path.isfile(self.path) and not verify:
+            self.done_bytes = self.total_bytes = os.path.getsize(self.path)
+            return
+
+        self.state = "downloading"
+        client = _s3_client()
+        bucket = os.environ["SPACES_BUCKET"]
+        head = client.head_object(Bucket=bucket, Key=self.key)
+        self.total_bytes = head["ContentLength"]
+        etag = head["ETag"]
+        if os.path.isfile(self.path):
+            if os.path.getsize(self.path) != self.total_bytes:
+                raise ValueError(
+                    f"{self.path} has {os.path.getsize(self.path)} bytes,"
+                    f" expected {self.total_bytes}"
+                )
+            self.done_bytes = self.total_bytes
+            return
+
+        print("Fetching data from object storage...")
+        part_path = f"{self.path}.part"
+        etag_path = f"{part_path}.etag"
+        if not self._can_resume(part_path, etag_path, etag):
+            with open(part_path, "wb"):
+                pass
+        with open(etag_path, "w") as f:
+            f.write(etag)
+        with open(part_path, "ab") as f:
+            self.done_bytes = f.tell()
+            while self.done_bytes < self.total_bytes:
+                end = min(self.done_bytes + _CHUNK_BYTES, self.total_bytes)
+                chunk = self._get_range(
+                    client, bucket, etag, self.done_bytes, end
+                )
+                if not chunk:
+                    break
+                f.write(chunk)
+                f.flush()
+                self.done_bytes = f.tell()
+        if self.done_bytes != self.total_bytes:
+            raise ValueError(
+                f"Downloaded {self.done_bytes} bytes of {self.key},"
+                f" expected {self.total_bytes}"
+            )
+        os.replace(part_path, self.path)
+        os.remove(etag_path)
+
+    def _can_resume(self, part_path: str, etag_path: str, etag: str) -> bool:
+        """
+        Whether the partial download is a prefix of the object with `etag`
+        """
+        if not os.path.isfile(part_path) or not os.path.isfile(etag_path):
+            return False
+        with open(etag_path) as f:
+            if f.read() != etag:
+                return False
+        assert self.total_bytes is not None
+        return os.path.getsize(part_path) <= self.total_bytes
+
+    def _get_range(
+        self, client, bucket: str, etag: str, start: int, end: int
+    ) -> bytes:
+        byte_range = f"bytes={start}-{end - 1}"
+        for attempt in range(_CHUNK_RETRIES):
+            try:
+                # fails rather than mixing in chunks of a newer version
+                response = client.get_object(
+                    Bucket=bucket, Key=self.key, Range=byte_range, IfMatch=etag
+                )
+                return response["Body"].read()
+            except Exception:
+                if attempt == _CHUNK_RETRIES - 1:
+                    raise
+                time.sleep(2**attempt)
+        return b""
+
+
+database = DatabaseFetch("vow.db")
+
+
+def fetch_sample_database():
+    database.run()
@@ -1,8 +1,12 @@
-from typing import Any, List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import pyarrow as pa
+from pyarrow import ipc as pa_ipc
 from yattag.doc import Doc
+from yattag.simpledoc import attr_escape, html_escape
 from table import ColType, Table, FreqTable, TableOfTables
 from table import MarkdownTable
 from markdown2 import markdown
+from metrics import span
 
 
 def html_lineage(s: Table) -> str:
@@ -134,68 +138,236 @@ def html_search_row(s: Table) -> str:
     return doc.getvalue()
 
 
-def html_cell(
-    s: Table, val: Any, i: int, j: int, is_percent: bool = False
-) -> str:
-    doc, tag, text = Doc().tagtext()
-    is_none = val is None
-    is_float = isinstance(val, float)
-    display_val = str(val)
-    if is_none:
-        display_val = "NaN"
-    elif is_float:
-        display_val = f"{val:.2f}"
-
-    klass = "markdown-cell" if isinstance(s, MarkdownTable) else ""
-
-    # TODO: refactor: None and empty string have the same
-    # data-val attribute.
-    # The frontend js checks for the presence of "null" class
-    # to distinguish between the two
-    with tag(
-        "td",
-        ("x-ref", f"cell-{i}-{j}"),
-        ("x-bind", f"cell({i}, {j})"),
-        ("data-val", str(val) if not is_none else ""),
-        klass=klass,
-    ):
-        doc.add_class("null" if is_none else "")
-        doc.add_class("percentage" if is_percent else "")
+def _cell_class(*classes: str) -> str:
+    """
+    The class attribute of a cell, built the same way yattag's `add_class`
+    builds it, which the cells used to be rendered with (and is why it
+    isn't sorted)
+    """
+    klass = classes[0]
+    for added in classes[1:]:
+        klass = " ".join(set(klass.split()).union((added,)))
+    return klass
+
+
+def _cell_formatter(
+    is_markdown: bool, is_percent: bool
+) -> Callable[[Any], str]:
+    """
+    Returns a function rendering a value as a cell of the column, from
+    the `data-val` attribute on
+    """
+    klass = "markdown-cell" if is_markdown else ""
+    percent = "percentage" if is_percent else ""
+    null_class = _cell_class(klass, "null", percent)
+    other_class = _cell_class(klass, "", percent)
+
+    def format_cell(val: Any) -> str:
+        if val is None:
+            display_val = "NaN"
+            attrs = f'data-val="" class="{null_class}"'
+        else:
+            if isinstance(val, float):
+                display_val = f"{val:.2f}"
+            else:
+                display_val = str(val)
+            data_val = attr_escape(str(val))
+            attrs = f'data-val="{data_val}" class="{other_class}"'
         if is_percent:
-            doc.attr(style=f"background-size: {display_val}% 100%")
-        if isinstance(s, MarkdownTable):
-            doc.asis(markdown(display_val))
+            style = attr_escape(f"background-size: {display_val}% 100%")
+            attrs += f' style="{style}"'
+
+        if is_markdown:
+            content = markdown(display_val)
         elif type(val) == float:
-            doc.line("em", display_val)
+            content = f"<em>{html_escape(display_val)}</em>"
         elif type(val) == int:
-            doc.line("span", display_val, klass="int")
+            content = f'<span class="int">{html_escape(display_val)}</span>'
         else:
-            text(display_val)
+            content = html_escape(display_val)
+        return f"{attrs}>{content}</td>"
 
-    return doc.getvalue()
+    return format_cell
 
 
 def html_rows(s: Table, rows: List[Tuple[str]]) -> str:
-    doc, tag, text = Doc().tagtext()
-    for i, row in enumerate(rows):
-        with tag(
-            "tr",
-            ("x-bind", f"row({i})"),
-            ("x-ref", f"row-{i}"),
-            style="cursor: pointer",
-        ):
-            for j, column in enumerate(s.columns):
-                is_percent = column.name == "percentage"
-                doc.asis(html_cell(s, row[j], i, j, is_percent=is_percent))
-
-    return doc.getvalue()
+    """
+    Rows of a page, formatted a column at a time with plain string
+    formatting rather than yattag
+    """
+    is_markdown = isinstance(s, MarkdownTable)
+    columns = [
+        map(
+            _cell_formatter(is_markdown, column.name == "percentage"),
+            [row[j] for row in rows],
+        )
+        for j, column in enumerate(s.columns)
+    ]
+    # cells of each row, which are still missing their position
+    cells_by_row = zip(*columns) if columns else ([] for _ in rows)
+
+    parts = []
+    for i, cells in enumerate(cells_by_row):
+        parts.append(
+            f'<tr x-bind="row({i})" x-ref="row-{i}" style="cursor: pointer">'
+        )
+        for j, cell in enumerate(cells):
+            parts.append(
+                f'<td x-ref="cell-{i}-{j}" x-bind="cell({i}, {j})" {cell}'
+            )
+        parts.append("</tr>")
+    return "".join(parts)
 
 
 _MAX_NUM_ROWS = 25
 
 
-def html_table(s: Table, page: int) -> str:
-    rows, _ = s[page * _MAX_NUM_ROWS : (page + 1) * _MAX_NUM_ROWS]
+def page_rows(
+    s: Table, page: int, after: Optional[str] = None
+) -> Tuple[List, List]:
+    """
+    Rows of a page, read after the page token `after` if there is one
+    """
+    if after is not None:
+        return s.seek(after, _MAX_NUM_ROWS)
+    return s[page * _MAX_NUM_ROWS : (page + 1) * _MAX_NUM_ROWS]
+
+
+def page_kind(s: Table, page: int, after: Optional[str] = None) -> str:
+    """
+    The kind of operation (see `governor`) rendering a page amounts to
+    """
+    return s.read_kind(page * _MAX_NUM_ROWS, _MAX_NUM_ROWS, after)
+
+
+_MAX_API_ROWS = 1000
+
+
+def _column_kind(values: List[Any]) -> str:
+    """
+    How the cells of a column are rendered: "int", "float" or "text"
+    """
+    types = {type(val) for val in values if val is not None}
+    if types == {int}:
+        return "int"
+    if types == {float}:
+        return "float"
+    return "text"
+
+
+# integers a javascript number holds exactly
+_MAX_SAFE_INT = 2**53 - 1
+
+
+def _json_int(val: Optional[int]) -> Any:
+    if val is not None and abs(val) > _MAX_SAFE_INT:
+        return str(val)
+    return val
+
+
+def _api_rows(
+    s: Table, offset: int, limit: int, after: Optional[str]
+) -> Tuple[List, List]:
+    """
+    Rows requested from /tables/{uid}/rows, read after the page token
+    `after` if there is one, and from `offset` otherwise
+    """
+    limit = min(limit, _MAX_API_ROWS)
+    if after is not None:
+        return s.seek(after, limit)
+    return s[offset : offset + limit]
+
+
+def api_rows_kind(
+    s: Table, offset: int, limit: int, after: Optional[str] = None
+) -> str:
+    """
+    The kind of operation reading rows for /tables/{uid}/rows amounts to
+    """
+    return s.read_kind(offset, min(limit, _MAX_API_ROWS), after)
+
+
+def page_columns(
+    s: Table, offset: int, limit: int, after: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Rows of a table in columnar form, for the client to render itself
+
+    Integers are sent as numbers, unless they're too large for a
+    javascript number to hold, and everything else as the strings that
+    would end up in the `data-val` attribute of their cells. `after` is
+    the token of the rows that follow, if the table is sorted
+    """
+    rows, columns = _api_rows(s, offset, limit, after)
+    data, kinds = [], []
+    for j in range(len(columns)):
+        values = [row[j] for row in rows]
+        kind = _column_kind(values)
+        if kind != "int":
+            values = [None if val is None else str(val) for val in values]
+        else:
+            values = [_json_int(val) for val in values]
+        data.append(values)
+        kinds.append(kind)
+    num_rows, is_exact = s.estimated_len()
+    return {
+        "offset": offset,
+        "after": s.page_token(rows, columns, after),
+        "columns": columns,
+        "kinds": kinds,
+        "data": data,
+        "num_rows": num_rows,
+        "exact": is_exact,
+    }
+
+
+def page_arrow(
+    s: Table, offset: int, limit: int, after: Optional[str] = None
+) -> bytes:
+    """
+    Rows of a table as an Arrow IPC stream, with the token of the rows
+    that follow in the schema metadata under "after"
+    """
+    rows, columns = _api_rows(s, offset, limit, after)
+    arrays = []
+    for j in range(len(columns)):
+        values = [row[j] for row in rows]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # e.g. a column of mixed types
+            arrays.append(
+                pa.array([None if val is None else str(val) for val in values])
+            )
+    batch = pa.RecordBatch.from_arrays(arrays, names=columns)
+    token = s.page_token(rows, columns, after)
+    if token is not None:
+        batch = batch.replace_schema_metadata({"after": token})
+    sink = pa.BufferOutputStream()
+    with pa_ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def html_table(s: Table, page: int, after: Optional[str] = None) -> str:
+    rows, columns = page_rows(s, page, after)
+    next_token = s.page_token(rows, columns, after)
+    if len(rows) == _MAX_NUM_ROWS:
+        # so that going to the next page doesn't wait on a query
+        next_page = page + 1
+        s.prefetch(
+            slice(next_page * _MAX_NUM_ROWS, (next_page + 1) * _MAX_NUM_ROWS),
+            after=next_token,
+        )
+    # the rest of the table is fetched from /tables/{uid}/rows as the
+    # table is scrolled, following page tokens where the table has them.
+    # A page reached through a token has no known offset, so it can only
+    # be continued through tokens
+    row_offset = "null" if after is not None else page * _MAX_NUM_ROWS
+    js_token = "null" if next_token is None else f"'{next_token}'"
+    has_more = len(rows) == _MAX_NUM_ROWS and (
+        after is None or next_token is not None
+    )
     doc, tag, text = Doc().tagtext()
     with tag(
         "table",
@@ -204,11 +376,14 @@ def html_table(s: Table, page: int) -> str:
         style="border-collapse: separate;",
     ):
         num_cols = len(s.columns)
-        parent_uid: str = s.parent.uid if s.parent else "none"
+        parent_uid: str = "none" if s.parent is None else s.parent.uid
         doc.attr(
             (
                 "x-data",
-                f"table({len(rows)}, {num_cols}, '{parent_uid}', {s.wrapped_col_indices})",
+                f"table({len(rows)}, {num_cols}, '{parent_uid}',"
+                f" {s.wrapped_col_indices}, '{s.uid}', {page},"
+                f" {row_offset}, {'true' if has_more else 'false'},"
+                f" {js_token})",
             )
         )
         if isinstance(s, FreqTable):
@@ -223,13 +398,26 @@ def html_table(s: Table, page: int) -> str:
     return doc.getvalue()
 
 
-def html_footer(s: Table, page: int = 0) -> str:
+def html_footer(s: Table, page: int = 0, after: Optional[str] = None) -> str:
     doc, tag, text = Doc().tagtext()
+    num_rows, is_exact = s.estimated_len()
+    next_page_url = f"/tables/{s.uid}?page={page + 1}"
+    next_token = s.page_token(*page_rows(s, page, after), after=after)
+    if next_token is not None:
+        next_page_url += f"&after={next_token}"
     with tag("div", "x-cloak", id="table-footer"):
-        doc.line("b", str(len(s)))
+        doc.line("b", str(num_rows) if is_exact else f"{num_rows}+")
         text(" rows")
+        if isinstance(s, FreqTable) and s.is_approx:
+            text(
+                f", counts estimated from a sample of {s.sample_rows} rows"
+                f" (~{s.distinct_estimate} distinct values) "
+            )
+            with tag("a", ("x-bind", "exact_freq"), id="exact-freq", href="#"):
+                text("exact ")
+            doc.line("span", "[E]", klass="label")
         has_prev_page = page > 0
-        has_next_page = (page + 1) * _MAX_NUM_ROWS < len(s)
+        has_next_page = (page + 1) * _MAX_NUM_ROWS < num_rows or not is_exact
         if has_prev_page or has_next_page:
             with tag("span", style="float:right"):
                 if has_prev_page:
@@ -250,7 +438,7 @@ def html_footer(s: Table, page: int = 0) -> str:
                         "a",
                         "next",
                         id="next-page",
-                        href=f"/tables/{s.uid}?page={page + 1}",
+                        href=next_page_url,
                     )
                 else:
                     text("next")
@@ -268,7 +456,7 @@ def html_right_cheatsheet() -> str:
     return doc.getvalue()
 
 
-def html_table_parent(s: Table, page) -> str:
+def html_table_parent(s: Table, page: int, after: Optional[str] = None) -> str:
     doc, tag, text = Doc().tagtext()
     with tag(
         "div",
@@ -296,8 +484,8 @@ def html_table_parent(s: Table, page) -> str:
                     if isinstance(s, MarkdownTable):
                         doc.asis(html_markdown(s))
                     else:
-                        doc.asis(html_table(s, page=page))
-                        doc.asis(html_footer(s, page=page))
+                        doc.asis(html_table(s, page=page, after=after))
+                        doc.asis(html_footer(s, page=page, after=after))
 
                 with tag("div", klass="column col-1 hide-xl", id="cheatsheet"):
                     doc.asis(html_right_cheatsheet())
@@ -314,7 +502,12 @@ def html_markdown(s: MarkdownTable) -> str:
     return doc.getvalue()
 
 
-def html_page(s: Table, page: int) -> str:
+def html_page(s: Table, page: int, after: Optional[str] = None) -> str:
+    with span("render", s):
+        return _html_page(s, page, after)
+
+
+def _html_page(s: Table, page: int, after: Optional[str] = None) -> str:
     doc = Doc()
     doc.asis("<!DOCTYPE html>")
     with doc.tag("html", lang="en"):
@@ -350,6 +543,6 @@ def html_page(s: Table, page: int) -> str:
         doc.line("script", "", "defer", src="/static/cdn.min.js")
         doc.stag("link", rel="stylesheet", href="/static/style.css")
         with doc.tag("body"):
-            doc.asis(html_table_parent(s, page))
+            doc.asis(html_table_parent(s, page, after))
 
     return doc.getvalue()